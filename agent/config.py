@@ -14,6 +14,21 @@ def get_base_path():
 
 
 BASE_DIR = get_base_path()
+
+
+def get_data_path():
+    """
+    Writable folder kept between launches. In the frozen build BASE_DIR is
+    sys._MEIPASS, a temp folder that does not survive the process, so
+    documents are kept under %LOCALAPPDATA% instead.
+    """
+    if getattr(sys, "frozen", False):
+        root = os.environ.get("LOCALAPPDATA") or os.path.expanduser("~")
+        return os.path.join(root, "DigitalSignatureAgent")
+    return BASE_DIR
+
+
+DATA_DIR = get_data_path()
 COMMON_DIR = os.path.join(BASE_DIR, "common")
 IMAGES_DIR = os.path.join(COMMON_DIR, "images")
 
@@ -25,21 +40,116 @@ BASE_URL = "http://127.0.0.1:5001"
 SECRET_KEY = "digital-signature-agent-secret-key"
 SECRET_PASSWORD_KEY = "password-encryption-key"
 
-PDF_SOURCE_BASE_URL = "http://10.10.1.13/uploads/unsigned_docs/"
+# Where unsigned PDFs are fetched from; AGENT_PDF_SOURCE_BASE_URL overrides
+# it, e.g. for the portal stand-in of benchmarks/loadtest.py
+PDF_SOURCE_BASE_URL = os.environ.get(
+    "AGENT_PDF_SOURCE_BASE_URL", "http://10.10.1.13/uploads/unsigned_docs/"
+)
 
 AUTO_FETCH_PDF = True
 
+# Source PDF downloads: timeout per request (seconds) and retries with
+# exponential backoff for connection errors and 429/5xx responses
+FETCH_TIMEOUT = 30
+FETCH_RETRIES = 3
+FETCH_BACKOFF = 0.5
+
+# Downloads are hashed as they stream in; documents larger than the spool
+# threshold are written to a temporary file instead of being held in memory
+FETCH_CHUNK_SIZE = 64 * 1024
+FETCH_SPOOL_THRESHOLD = 8 * 1024 * 1024
+
+# Bulk signing downloads upcoming documents while the token signs.
+# Parallel downloads, and how many fetched bytes may wait for the token.
+PREFETCH_WORKERS = 4
+PREFETCH_MAX_INFLIGHT_BYTES = 64 * 1024 * 1024
+
+# Downloaded PDFs are cached in UNSIGNED_DOCS_PATH by content hash and
+# revalidated with ETag/Last-Modified, so signing the same document again
+# (e.g. after a wrong PIN) costs a 304 instead of a download. The least
+# recently used documents are removed past FETCH_CACHE_MAX_BYTES.
+FETCH_CACHE_ENABLED = True
+FETCH_CACHE_MAX_BYTES = 512 * 1024 * 1024
+
 PORT = 5001
 
+# Worker threads serving HTTP requests. Token access is serialized per
+# token, so /status and cached lookups are answered while a sign runs.
+HTTP_WORKERS = 8
+
+# Signed PDFs are returned from memory and saved to SIGNED_DOCS_PATH by a
+# background writer. Set SAVE_SIGNED_DOCS to False to skip saving; at most
+# SIGNED_SAVE_QUEUE_SIZE documents wait for the disk.
+SAVE_SIGNED_DOCS = True
+SIGNED_SAVE_QUEUE_SIZE = 32
+
+# Worker processes rendering overlay stamps for /sign-batch while the token
+# signs (0 disables the process pool and signs one document at a time)
+PREPARE_WORKERS = max(0, min(4, (os.cpu_count() or 1) - 1))
+
+# Share /sign-batch documents between the plugged-in tokens holding the
+# same signer's certificate that are already logged in with the batch's
+# PIN, one signer per token. The PIN is never tried on other tokens
+# unless the caller lists them in "token_serials".
+SPREAD_ACROSS_TOKENS = True
+
+# Most digests accepted by one /sign-digests request
+SIGN_DIGESTS_MAX = 5000
+
+# Finished signing jobs kept for GET /jobs/<id>
+JOB_HISTORY = 200
+
+# Agent log level (DEBUG, INFO, WARNING); DEBUG lines are not even
+# formatted unless enabled. The last LOG_BUFFER_SIZE records are kept in
+# memory for GET /debug/logs.
+LOG_LEVEL = os.environ.get("AGENT_LOG_LEVEL", "INFO").upper()
+LOG_BUFFER_SIZE = 2000
+
+# /sign-pdf and /cert-info requests sent with "X-Profile: 1" (or
+# ?profile=1) run under cProfile. The newest PROFILE_KEEP profiles are kept
+# in PROFILES_PATH and listed at GET /debug/profiles; set PROFILING_ENABLED
+# to False to ignore the flag.
+PROFILING_ENABLED = True
+PROFILE_KEEP = 50
+
 # Create directories
-os.makedirs(os.path.join(BASE_DIR, "unsigned_docs"), exist_ok=True)
-os.makedirs(os.path.join(BASE_DIR, "signed_docs"), exist_ok=True)
+os.makedirs(os.path.join(DATA_DIR, "unsigned_docs"), exist_ok=True)
+os.makedirs(os.path.join(DATA_DIR, "signed_docs"), exist_ok=True)
+
+UNSIGNED_DOCS_PATH = os.path.join(DATA_DIR, "unsigned_docs")
+SIGNED_DOCS_PATH = os.path.join(DATA_DIR, "signed_docs")
+PROFILES_PATH = os.path.join(DATA_DIR, "profiles")
+
+# Signed output kept by (source document hash, certificate, signing mode):
+# signing the same document with the same certificate again returns the
+# stored PDF after the PIN check, without C_Sign. Stored copies older than
+# SIGNED_RETENTION_DAYS are removed, the oldest go first past
+# SIGNED_STORE_MAX_BYTES. Files in SIGNED_DOCS_PATH are never removed.
+# The store is a second saved copy of each document, so it is off too
+# while SAVE_SIGNED_DOCS is False.
+SIGNED_STORE_ENABLED = True
+SIGNED_STORE_PATH = os.path.join(DATA_DIR, "signed_store")
+SIGNED_STORE_MAX_BYTES = 1024 * 1024 * 1024
+SIGNED_RETENTION_DAYS = 30
+
+# Set PKCS#11 library path - USE ABSOLUTE PATH. AGENT_PKCS11_PATH overrides
+# it, e.g. to run against SoftHSMv2 (see benchmarks/)
+PKCS11_PATH = os.environ.get(
+    "AGENT_PKCS11_PATH",
+    r"C:\Windows\System32\Watchdata\PROXKey CSP India V3.0\wdpkcs.dll",
+)
+
+# Logged-in token sessions are reused between requests and logged out
+# after this many seconds without use
+SESSION_IDLE_TIMEOUT = 300
 
-UNSIGNED_DOCS_PATH = os.path.join(BASE_DIR, "unsigned_docs")
-SIGNED_DOCS_PATH = os.path.join(BASE_DIR, "signed_docs")
+# Seconds between token hot-plug checks by the background monitor
+TOKEN_POLL_INTERVAL = 1.0
 
-# Set PKCS#11 library path - USE ABSOLUTE PATH
-PKCS11_PATH = r"C:\Windows\System32\Watchdata\PROXKey CSP India V3.0\wdpkcs.dll"
+# How signatures are applied to the PDF:
+#   "overlay"     - stamp merged into page 1 and the whole document rewritten
+#   "incremental" - PAdES signature (CMS) appended as an incremental update
+SIGNING_MODE = "overlay"
 
 # DB config - not needed for basic functionality
 DB_CONFIG = {
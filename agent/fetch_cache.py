@@ -0,0 +1,274 @@
+# agent/fetch_cache.py
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import tempfile
+import threading
+
+from .config import FETCH_CACHE_MAX_BYTES, FETCH_CHUNK_SIZE, UNSIGNED_DOCS_PATH
+from .storage import write_atomic
+
+log = logging.getLogger(__name__)
+
+_OBJECT_NAME = re.compile(r"[0-9a-f]{64}\.pdf")
+
+
+class CachedSource:
+    """Where a URL's last download is stored and how to revalidate it"""
+
+    def __init__(self, url, sha256, size, etag=None, last_modified=None):
+        self.url = url
+        self.sha256 = sha256
+        self.size = size
+        self.etag = etag
+        self.last_modified = last_modified
+
+    def conditional_headers(self):
+        """Headers turning the next GET into a conditional one"""
+        headers = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+    def to_dict(self):
+        return {
+            "url": self.url,
+            "sha256": self.sha256,
+            "size": self.size,
+            "etag": self.etag,
+            "last_modified": self.last_modified,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(
+            data["url"],
+            data["sha256"],
+            data["size"],
+            data.get("etag"),
+            data.get("last_modified"),
+        )
+
+
+class FetchCache:
+    """
+    Source PDFs downloaded from the portal, kept on disk so a retry or
+    re-sign of the same document costs a 304 instead of a download.
+
+    Documents are stored by content (``objects/<sha256>.pdf``), so URLs
+    serving the same bytes share one file. Each URL has a small record
+    (``urls/<sha256 of url>.json``) with the document hash and the ETag /
+    Last-Modified it was served with. A document's mtime is its last use;
+    the least recently used ones are removed once the cache holds more
+    than ``max_bytes``.
+    """
+
+    def __init__(self, directory=UNSIGNED_DOCS_PATH, max_bytes=FETCH_CACHE_MAX_BYTES):
+        self.objects_dir = os.path.join(directory, "objects")
+        self.urls_dir = os.path.join(directory, "urls")
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        # Bytes in objects_dir, counted on first store
+        self._total = None
+
+    def _object_path(self, sha256):
+        return os.path.join(self.objects_dir, f"{sha256}.pdf")
+
+    def _record_path(self, url):
+        name = hashlib.sha256(url.encode("utf-8")).hexdigest()
+        return os.path.join(self.urls_dir, f"{name}.json")
+
+    def lookup(self, url):
+        """CachedSource for ``url`` if its document is still cached"""
+        try:
+            with open(self._record_path(url), encoding="utf-8") as f:
+                entry = CachedSource.from_dict(json.load(f))
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError) as e:
+            log.warning("Unreadable fetch cache record for %s: %s", url, e)
+            return None
+
+        if entry.url != url or not os.path.isfile(self._object_path(entry.sha256)):
+            return None
+        return entry
+
+    def open(self, entry):
+        """
+        FetchedPdf of a cached document, re-hashed while it is read so a
+        damaged file is never signed. None if it was evicted or damaged.
+        """
+        from .pdf_fetch import FetchedPdf
+
+        path = self._object_path(entry.sha256)
+        try:
+            with open(path, "rb") as f:
+                fetched = FetchedPdf.from_stream(
+                    iter(lambda: f.read(FETCH_CHUNK_SIZE), b"")
+                )
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            log.warning("Cached copy of %s unreadable: %s", entry.url, e)
+            self.discard(entry)
+            return None
+
+        if fetched.sha256.hex() != entry.sha256:
+            log.warning("Cached copy of %s is damaged, dropping it", entry.url)
+            fetched.close()
+            self.discard(entry)
+            return None
+
+        self._touch(path)
+        return fetched
+
+    def store(self, url, fetched, etag=None, last_modified=None):
+        """
+        Keep a downloaded FetchedPdf for ``url``. Responses without an
+        ETag or Last-Modified cannot be revalidated and are not stored.
+        """
+        if not etag and not last_modified:
+            return None
+
+        entry = CachedSource(
+            url, fetched.sha256.hex(), fetched.size, etag, last_modified
+        )
+        path = self._object_path(entry.sha256)
+        try:
+            if os.path.isfile(path):
+                self._touch(path)
+                added = 0
+            else:
+                self._write_object(path, fetched)
+                added = fetched.size
+            write_atomic(
+                self._record_path(url), json.dumps(entry.to_dict()).encode("utf-8")
+            )
+        except OSError as e:
+            log.warning("Caching %s failed: %s", url, e)
+            return None
+
+        with self._lock:
+            self._count(added)
+            self._evict(keep=path)
+        return entry
+
+    def discard(self, entry):
+        for path in (self._object_path(entry.sha256), self._record_path(entry.url)):
+            try:
+                size = os.path.getsize(path)
+                os.remove(path)
+            except OSError:
+                continue
+            if path.endswith(".pdf"):
+                with self._lock:
+                    self._count(-size)
+
+    def _write_object(self, path, fetched):
+        os.makedirs(self.objects_dir, exist_ok=True)
+        if fetched.data is not None:
+            write_atomic(path, fetched.data)
+            return
+
+        # Spooled download: copy the temp file, it is removed on close()
+        fd, tmp_path = tempfile.mkstemp(prefix=".tmp_", dir=self.objects_dir)
+        try:
+            with os.fdopen(fd, "wb") as out, open(fetched.path, "rb") as src:
+                shutil.copyfileobj(src, out, FETCH_CHUNK_SIZE)
+            os.replace(tmp_path, path)
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+
+    def _touch(self, path):
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+    def _objects(self):
+        """(mtime, size, path) of cached documents"""
+        try:
+            names = os.listdir(self.objects_dir)
+        except FileNotFoundError:
+            return []
+        objects = []
+        for name in names:
+            if not _OBJECT_NAME.fullmatch(name):
+                continue
+            path = os.path.join(self.objects_dir, name)
+            try:
+                info = os.stat(path)
+            except OSError:
+                continue
+            objects.append((info.st_mtime, info.st_size, path))
+        return objects
+
+    def _count(self, delta):
+        if self._total is None:
+            self._total = sum(size for _, size, _ in self._objects())
+        else:
+            self._total += delta
+
+    def _evict(self, keep=None):
+        if self._total <= self.max_bytes:
+            return
+        evicted = 0
+        for _, size, path in sorted(self._objects()):
+            if self._total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            self._total -= size
+            evicted += 1
+        if evicted:
+            log.info(
+                "Fetch cache evicted %s document(s), %s bytes cached",
+                evicted,
+                self._total,
+            )
+            self._prune_records()
+
+    def _prune_records(self):
+        """Drop URL records whose document was evicted"""
+        try:
+            names = os.listdir(self.urls_dir)
+        except FileNotFoundError:
+            return
+        for name in names:
+            path = os.path.join(self.urls_dir, name)
+            try:
+                with open(path, encoding="utf-8") as f:
+                    sha256 = json.load(f)["sha256"]
+            except (OSError, ValueError, KeyError):
+                continue
+            if not os.path.isfile(self._object_path(sha256)):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+
+_CACHE = None
+_CACHE_LOCK = threading.Lock()
+
+
+def get_fetch_cache():
+    """Process-wide FetchCache in UNSIGNED_DOCS_PATH"""
+    global _CACHE
+    with _CACHE_LOCK:
+        if _CACHE is None:
+            _CACHE = FetchCache()
+        return _CACHE
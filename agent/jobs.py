@@ -0,0 +1,216 @@
+# agent/jobs.py
+import heapq
+import itertools
+import logging
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from .config import JOB_HISTORY
+from .log import reset_request_id, set_request_id
+from .pdf_fetch import PdfPrefetcher
+
+log = logging.getLogger(__name__)
+
+# Lower runs first. Single-document signs from the UI jump ahead of bulk
+# jobs, between two documents of the bulk job being signed.
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BULK = 1
+
+PRIORITIES = {"interactive": PRIORITY_INTERACTIVE, "bulk": PRIORITY_BULK}
+
+
+def item_filename(item):
+    """Filename of a job item: a string or {"pdf_filename": ...}"""
+    if isinstance(item, dict):
+        return item.get("pdf_filename")
+    return item
+
+
+class Job:
+    """
+    One signing request: a list of documents signed under one PIN.
+    The PIN is dropped as soon as the job has finished. ``token`` holds the
+    optional {"serial", "thumbprint"} selection of the signing token.
+    """
+
+    def __init__(
+        self, pin, items, priority=PRIORITY_BULK, signing_mode=None, token=None
+    ):
+        self.id = uuid.uuid4().hex
+        self.pin = pin
+        self.items = list(items)
+        self.priority = priority
+        self.signing_mode = signing_mode
+        self.token = token or {}
+        self.status = "queued"
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.documents = [
+            {"index": i, "original_filename": item_filename(item), "status": "queued"}
+            for i, item in enumerate(self.items)
+        ]
+
+    @property
+    def finished(self):
+        return self.status in ("completed", "failed")
+
+    def to_dict(self):
+        counts = {}
+        for doc in self.documents:
+            counts[doc["status"]] = counts.get(doc["status"], 0) + 1
+
+        def iso(ts):
+            return time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(ts)) if ts else None
+
+        result = {
+            "job_id": self.id,
+            "status": self.status,
+            "priority": "interactive" if self.priority == PRIORITY_INTERACTIVE else "bulk",
+            "total": len(self.documents),
+            "signed": counts.get("success", 0),
+            "failed": counts.get("error", 0),
+            "created_at": iso(self.created_at),
+            "started_at": iso(self.started_at),
+            "finished_at": iso(self.finished_at),
+            "documents": [dict(doc) for doc in self.documents],
+        }
+        if self.started_at:
+            end = self.finished_at or time.time()
+            result["elapsed_ms"] = int((end - self.started_at) * 1000)
+        if self.error:
+            result.update(self.error)
+        return result
+
+
+class JobQueue:
+    """
+    Signing jobs drained by a single worker thread that owns the token.
+
+    ``load(item)`` returns a FetchedPdf for a job item,
+    ``sign_document(job, document, source_pdf)`` signs it and returns the
+    fields to record (output_filename, saved_path, ...), and
+    ``describe_error(exc, filename)`` turns an exception into an
+    ``{"error", "error_type"}`` payload. ``login(job)``, if given, runs
+    before the first document so a wrong PIN fails the whole job at once.
+    """
+
+    def __init__(
+        self, load, sign_document, describe_error, login=None, history=JOB_HISTORY
+    ):
+        self.load = load
+        self.sign_document = sign_document
+        self.describe_error = describe_error
+        self.login = login
+        self.history = history
+        self._jobs = OrderedDict()
+        self._heap = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._worker = None
+
+    def submit(self, job):
+        with self._cond:
+            self._jobs[job.id] = job
+            self._forget_old_jobs()
+            heapq.heappush(self._heap, (job.priority, next(self._seq), job))
+            self._cond.notify()
+            if self._worker is None:
+                self._worker = threading.Thread(
+                    target=self._run, name="signing-job-worker", daemon=True
+                )
+                self._worker.start()
+        log.info("Queued job %s with %s document(s)", job.id, len(job.items))
+        return job
+
+    def get(self, job_id):
+        with self._cond:
+            return self._jobs.get(job_id)
+
+    def pending(self):
+        with self._cond:
+            return len(self._heap)
+
+    def _forget_old_jobs(self):
+        # Caller holds the lock
+        finished = [job_id for job_id, job in self._jobs.items() if job.finished]
+        for job_id in finished[: max(0, len(self._jobs) - self.history)]:
+            del self._jobs[job_id]
+
+    def _pop(self, below=None):
+        """Next job to run; with ``below`` only a more urgent one, or None"""
+        with self._cond:
+            if below is None:
+                while not self._heap:
+                    self._cond.wait()
+            elif not self._heap or self._heap[0][0] >= below:
+                return None
+            return heapq.heappop(self._heap)[2]
+
+    def _run(self):
+        while True:
+            self.run_job(self._pop())
+
+    def run_job(self, job):
+        # Log lines of the job carry its ID instead of the submitting request's
+        request_token = set_request_id(job.id[:12])
+        job.status = "running"
+        job.started_at = time.time()
+        log.info("Running job %s", job.id)
+        try:
+            if self.login is not None:
+                try:
+                    self.login(job)
+                except Exception as e:
+                    log.warning("Job %s login failed: %r", job.id, e)
+                    job.error = self.describe_error(e, None)
+                    for doc in job.documents:
+                        doc["status"] = "skipped"
+                    job.status = "failed"
+                    return
+
+            # Upcoming documents are downloaded while the current one is signed
+            for index, (item, source_pdf, fetch_error) in enumerate(
+                PdfPrefetcher(job.items, load=self.load)
+            ):
+                # Let interactive signs go first between two bulk documents
+                while True:
+                    urgent = self._pop(below=job.priority)
+                    if urgent is None:
+                        break
+                    self.run_job(urgent)
+
+                self._sign(job, job.documents[index], source_pdf, fetch_error)
+
+            job.status = "completed"
+        except Exception as e:
+            log.warning("Job %s crashed: %r", job.id, e)
+            job.error = {"error": str(e), "error_type": "job_failed"}
+            job.status = "failed"
+        finally:
+            job.pin = None
+            job.finished_at = time.time()
+            log.info("Job %s %s", job.id, job.status)
+            reset_request_id(request_token)
+
+    def _sign(self, job, doc, source_pdf, fetch_error):
+        started = time.time()
+        doc["status"] = "signing"
+        try:
+            if not doc["original_filename"]:
+                raise ValueError("PDF filename missing")
+            if fetch_error is not None:
+                raise fetch_error
+            try:
+                doc.update(self.sign_document(job, doc, source_pdf))
+            finally:
+                source_pdf.close()
+            doc["status"] = "success"
+        except Exception as e:
+            log.warning("%s failed: %s", doc["original_filename"], e)
+            doc.update(self.describe_error(e, doc["original_filename"]))
+            doc["status"] = "error"
+        doc["elapsed_ms"] = int((time.time() - started) * 1000)
@@ -0,0 +1,129 @@
+# agent/log.py
+import contextvars
+import logging
+import re
+import sys
+import threading
+import uuid
+from collections import deque
+
+from .config import LOG_BUFFER_SIZE, LOG_LEVEL
+
+# Correlation ID of the request (or job) the current code runs for
+REQUEST_ID = contextvars.ContextVar("request_id", default="-")
+
+LOG_FORMAT = "%(asctime)s %(levelname)-7s [%(request_id)s] %(name)s: %(message)s"
+
+# "pin": "1234", pin=1234, PIN: 1234, X-Token-Pin: 1234 ...
+_PIN_PATTERN = re.compile(
+    r"""(?P<key>\b(?:user_)?pin\b["']?\s*[:=]\s*["']?)(?P<value>[^"'\s,&}]+)""",
+    re.IGNORECASE,
+)
+
+
+def redact(text):
+    """Replace PIN values in a log message with ***"""
+    return _PIN_PATTERN.sub(r"\g<key>***", text)
+
+
+# Caller-supplied request IDs are kept only if they look like one
+_REQUEST_ID_PATTERN = re.compile(r"[A-Za-z0-9._:-]{1,64}")
+
+
+def new_request_id():
+    return uuid.uuid4().hex[:12]
+
+
+def set_request_id(request_id=None):
+    """Tag log records of the current context; returns a token for reset"""
+    if not request_id or not _REQUEST_ID_PATTERN.fullmatch(request_id):
+        request_id = new_request_id()
+    return REQUEST_ID.set(request_id)
+
+
+def reset_request_id(token):
+    REQUEST_ID.reset(token)
+
+
+class ContextFilter(logging.Filter):
+    """
+    Adds the request ID to each record and redacts PINs. Filters run only
+    for records that pass the level check, so disabled levels cost nothing
+    beyond that check.
+    """
+
+    def filter(self, record):
+        if not hasattr(record, "request_id"):
+            record.request_id = REQUEST_ID.get()
+            record.msg, record.args = redact(record.getMessage()), None
+        return True
+
+
+class RingBufferHandler(logging.Handler):
+    """Keeps the last ``capacity`` records in memory for /debug/logs"""
+
+    def __init__(self, capacity=LOG_BUFFER_SIZE):
+        super().__init__()
+        self._records = deque(maxlen=capacity)
+
+    def emit(self, record):
+        # deque.append is atomic, no lock needed on the logging hot path
+        self._records.append(
+            {
+                "time": record.created,
+                "level": record.levelname,
+                "logger": record.name,
+                "request_id": getattr(record, "request_id", "-"),
+                "thread": record.threadName,
+                "message": record.getMessage(),
+            }
+        )
+
+    def records(self, limit=None, level=None, request_id=None):
+        """Oldest first; optionally only ``level`` and above or one request"""
+        minimum = logging.getLevelName(level.upper()) if level else 0
+        if not isinstance(minimum, int):
+            raise ValueError(f"Unknown log level: {level}")
+        result = [
+            record
+            for record in list(self._records)
+            if logging.getLevelName(record["level"]) >= minimum
+            and (request_id is None or record["request_id"] == request_id)
+        ]
+        return result[-limit:] if limit else result
+
+
+_BUFFER = None
+_SETUP_LOCK = threading.Lock()
+
+
+def setup_logging(level=LOG_LEVEL):
+    """
+    Configure the "agent" logger once: records at ``level`` and above go
+    to the ring buffer and, when there is a console (not the windowed
+    build, where sys.stderr is None), to stderr.
+    """
+    global _BUFFER
+    with _SETUP_LOCK:
+        if _BUFFER is not None:
+            return _BUFFER
+
+        logger = logging.getLogger("agent")
+        logger.setLevel(level)
+        logger.propagate = False
+
+        context = ContextFilter()
+        _BUFFER = RingBufferHandler()
+        _BUFFER.addFilter(context)
+        logger.addHandler(_BUFFER)
+
+        if sys.stderr is not None:
+            console = logging.StreamHandler()
+            console.addFilter(context)
+            console.setFormatter(logging.Formatter(LOG_FORMAT))
+            logger.addHandler(console)
+        return _BUFFER
+
+
+def get_log_buffer():
+    return setup_logging()
@@ -1,13 +1,44 @@
 # agent/main.py
-from flask import Flask, request, jsonify
+from flask import (
+    Flask,
+    Response,
+    g,
+    request,
+    jsonify,
+    send_file,
+    stream_with_context,
+)
 from flask_cors import CORS
-from .pkcs11_utils import PKCS11Manager
+from werkzeug.wsgi import ClosingIterator
+from .pkcs11_utils import get_manager
+from .pdf_fetch import FetchedPdf, PdfPrefetcher, fetch_pdf, read_pdf_stream
+from .storage import get_writer
+from .pipeline import OverlayPipeline, sign_on_tokens
+from .jobs import PRIORITIES, PRIORITY_BULK, PRIORITY_INTERACTIVE, Job, JobQueue
+from .log import REQUEST_ID, get_log_buffer, set_request_id, setup_logging
+from .metrics import (
+    BYTES_IN,
+    BYTES_OUT,
+    ERRORS,
+    HTTP_REQUESTS,
+    HTTP_SECONDS,
+    REGISTRY,
+)
+from .profiling import list_profiles, profile_path, profile_text, run_profiled
 import base64
+import binascii
+import functools
+import io
+import json
+import logging
 import os
-from .config import PKCS11_PATH, PORT
+import time
+import uuid
+from .config import PKCS11_PATH, PORT, PROFILING_ENABLED, SIGN_DIGESTS_MAX
 import traceback
-import requests
 
+log = logging.getLogger(__name__)
+setup_logging()
 
 app = Flask(__name__)
 
@@ -18,7 +49,71 @@ app = Flask(__name__)
 # )
 
 # For testing, allow all origins (not recommended for production)
-CORS(app, resources={r"/*": {"origins": "*"}})
+CORS(
+    app,
+    resources={r"/*": {"origins": "*"}},
+    expose_headers=[
+        "X-Original-Filename",
+        "X-Output-Filename",
+        "X-Saved-Path",
+        "X-Request-ID",
+        "X-Profile-Name",
+    ],
+)
+
+# Response bodies /sign-pdf can produce, picked from the Accept header.
+# JSON (base64 PDF) stays the default for existing callers and */*.
+SIGNED_PDF_FORMATS = ["application/json", "application/pdf", "multipart/mixed"]
+
+
+@app.before_request
+def tag_request():
+    # Log lines of this request carry the caller's X-Request-ID or a new one
+    set_request_id(request.headers.get("X-Request-ID"))
+    g.started = time.perf_counter()
+    log.debug("%s %s", request.method, request.path)
+
+
+@app.after_request
+def add_request_id(response):
+    response.headers["X-Request-ID"] = REQUEST_ID.get()
+    return response
+
+
+def count_sent(iterable, endpoint):
+    """Count streamed response bytes as they go out, keeping close()"""
+
+    def chunks():
+        for chunk in iterable:
+            BYTES_OUT.inc(len(chunk), endpoint=endpoint)
+            yield chunk
+
+    close = getattr(iterable, "close", None)
+    return ClosingIterator(chunks(), [close] if close else None)
+
+
+@app.after_request
+def record_metrics(response):
+    # Route pattern, not the path, so /jobs/<job_id> is one series
+    endpoint = request.url_rule.rule if request.url_rule else "unmatched"
+    status = response.status_code
+
+    HTTP_REQUESTS.inc(endpoint=endpoint, method=request.method, status=str(status))
+    if "started" in g:
+        HTTP_SECONDS.observe(time.perf_counter() - g.started, endpoint=endpoint)
+    if request.content_length:
+        BYTES_IN.inc(request.content_length, source="request")
+
+    if response.is_streamed:
+        response.response = count_sent(response.response, endpoint)
+    elif response.content_length:
+        BYTES_OUT.inc(response.content_length, endpoint=endpoint)
+
+    if status >= 400:
+        payload = response.get_json(silent=True) if response.is_json else None
+        error_type = (payload or {}).get("error_type") or f"http_{status}"
+        ERRORS.inc(endpoint=endpoint, error_type=error_type)
+    return response
 
 
 @app.route("/")
@@ -37,18 +132,139 @@ def index():
 
 @app.route("/status", methods=["POST", "GET"])
 def status():
-    return jsonify({"status": "running", "os": os.name})
+    # Answered from the background token monitor, never touches the slots
+    mgr = get_manager(PKCS11_PATH)
+    tokens = mgr.present_tokens()
+
+    if tokens is not None:
+        monitor_state = "ready"
+    elif mgr.monitor is not None and mgr.monitor.error:
+        monitor_state = "pkcs11_load_error"
+    else:
+        monitor_state = "starting"
+
+    return jsonify(
+        {
+            "status": "running",
+            "os": os.name,
+            "token_monitor": monitor_state,
+            "token_present": bool(tokens) if tokens is not None else None,
+            "tokens": tokens or [],
+        }
+    )
+
+
+@app.route("/tokens", methods=["GET"])
+def tokens():
+    """
+    Plugged-in tokens with the certificates they hold (read without a PIN).
+    A serial or thumbprint from here selects the token on the signing
+    endpoints.
+    """
+    try:
+        return jsonify({"tokens": get_manager(PKCS11_PATH).list_tokens()})
+    except Exception as e:
+        log.warning("Listing tokens failed: %r", e)
+        return jsonify({"error": str(e), "error_type": "pkcs11_error"}), 500
+
+
+@app.route("/debug/logs", methods=["GET"])
+def debug_logs():
+    """
+    Recent log records from memory, oldest first (PINs redacted).
+    Query: limit (default 200), level (e.g. WARNING), request_id.
+    """
+    try:
+        limit = int(request.args.get("limit", 200))
+        records = get_log_buffer().records(
+            limit=limit,
+            level=request.args.get("level"),
+            request_id=request.args.get("request_id"),
+        )
+    except ValueError as e:
+        return jsonify({"error": str(e), "error_type": "invalid_query"}), 400
+    return jsonify({"records": records})
+
+
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    """Request, stage and throughput metrics in Prometheus text format"""
+    return Response(REGISTRY.render(), mimetype="text/plain; version=0.0.4")
+
+
+def profiled(label):
+    """
+    Run the view under cProfile when the request carries "X-Profile: 1"
+    or ?profile=1. The saved profile's name is returned in X-Profile-Name.
+    """
+
+    def decorate(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            flag = request.headers.get("X-Profile") or request.args.get("profile")
+            if not PROFILING_ENABLED or (flag or "").lower() not in ("1", "true"):
+                return view(*args, **kwargs)
+
+            response, name = run_profiled(
+                label, lambda: app.make_response(view(*args, **kwargs))
+            )
+            if name:
+                response.headers["X-Profile-Name"] = name
+            return response
+
+        return wrapper
+
+    return decorate
+
+
+@app.route("/debug/profiles", methods=["GET"])
+def debug_profiles():
+    """Saved request profiles, newest first"""
+    return jsonify({"enabled": PROFILING_ENABLED, "profiles": list_profiles()})
+
+
+@app.route("/debug/profiles/<name>", methods=["GET"])
+def debug_profile(name):
+    """
+    Download a profile (pstats file for snakeviz, `python -m pstats`, ...)
+    or, with ?format=text, read the top functions (?sort=, ?limit=).
+    """
+    path = profile_path(name)
+    if path is None:
+        return jsonify(
+            {"error": "Unknown profile", "error_type": "profile_not_found"}
+        ), 404
+
+    if request.args.get("format") != "text":
+        return send_file(
+            path,
+            mimetype="application/octet-stream",
+            as_attachment=True,
+            download_name=name,
+        )
+
+    try:
+        text = profile_text(
+            path,
+            sort=request.args.get("sort", "cumulative"),
+            limit=int(request.args.get("limit", 50)),
+        )
+    except ValueError as e:
+        return jsonify({"error": str(e), "error_type": "invalid_query"}), 400
+    return Response(text, mimetype="text/plain")
 
 
 @app.route("/cert-info", methods=["POST", "GET"])
+@profiled("cert-info")
 def cert_info():
     try:
-        print("[API] Certificate info request received")
+        log.info("Certificate info request received")
 
         # -----------------------
         # Extract PIN
         # -----------------------
         if request.method == "GET":
+            data = {}
             pin = request.args.get("pin")
         else:
             data = request.get_json() or {}
@@ -57,27 +273,17 @@ def cert_info():
         if not pin:
             pin = "12345678"
 
-        print(f"[API] Using PIN: {pin}")
-
         # -----------------------
-        # Initialize PKCS11
+        # Shared PKCS11 manager (library + logged-in sessions are reused)
         # -----------------------
-        from agent.pkcs11_utils import PKCS11Manager
-        from agent.config import PKCS11_PATH
-
-        mgr = PKCS11Manager(PKCS11_PATH)
+        mgr = get_manager(PKCS11_PATH)
 
         try:
-            key, cert_data, cert_info_data = mgr.get_token_credentials(
-                pin, cert_info_only=True
-            )
+            cert_info_data = mgr.get_cert_info(pin, **token_selection(data))
 
         except Exception as e:
-            raw = repr(e)
             err = str(e).lower().strip()
-
-            print(f"[CERT ERROR RAW]: {raw}")
-            print(f"[CERT ERROR STR]: '{err}'")
+            log.warning("Certificate lookup failed: %r", e)
 
             # ✅ Case 1: EMPTY ERROR → ALWAYS WRONG PIN
             if err == "" or err is None:
@@ -100,6 +306,18 @@ def cert_info():
                     {"error": "Incorrect PIN", "error_type": "wrong_pin"}
                 ), 400
 
+            # ✅ Requested serial / thumbprint not plugged in
+            if "requested token not present" in err:
+                return jsonify(
+                    {"error": str(e), "error_type": "token_not_found"}
+                ), 404
+
+            # ✅ Requested certificate has no key on the token
+            if "no private key on the token for certificate" in err:
+                return jsonify(
+                    {"error": str(e), "error_type": "certificate_not_found"}
+                ), 404
+
             # ✅ Dongle missing
             if any(k in err for k in ["token", "dongle", "slot", "not present"]):
                 return jsonify(
@@ -157,53 +375,328 @@ def cert_info():
         )
 
     except Exception as e:
-        print(f"[API] CRITICAL FAILURE: {e}")
+        log.warning("Certificate info failed: %s", e)
         return jsonify({"error": str(e), "error_type": "critical_failure"}), 500
 
 
-def fetch_pdf_from_url(pdf_filename):
-    """Fetch specific PDF from the configured URL"""
-    try:
-        from .config import PDF_SOURCE_BASE_URL
+def build_output_filename(pdf_filename):
+    """signedDoc_<name>.pdf for an unsingedDoc_<name>.pdf source"""
+    original_name = os.path.splitext(pdf_filename)[0]
+    # remove prefix "unsingedDoc_"
+    cleaned_name = original_name.replace("unsingedDoc_", "")
+    return f"signedDoc_{cleaned_name}.pdf"
+
 
-        if not pdf_filename:
-            raise Exception("PDF filename is required")
+def load_source_pdf(pdf_filename, pdf_b64=None):
+    """
+    PDF to sign as a FetchedPdf: fetched (and hashed while streaming) from
+    the portal, or decoded from base64
+    """
+    from .config import AUTO_FETCH_PDF
 
-        # Ensure the filename has .pdf extension
-        if not pdf_filename.lower().endswith(".pdf"):
-            pdf_filename += ".pdf"
+    if AUTO_FETCH_PDF:
+        log.debug("Auto-fetch enabled for: %s", pdf_filename)
+        return fetch_pdf(pdf_filename)
 
-        pdf_url = f"{PDF_SOURCE_BASE_URL}{pdf_filename}"
+    # Fallback to original base64 method
+    if not pdf_b64:
+        raise ValueError("Missing PDF data")
+    pdf_bytes = base64.b64decode(pdf_b64.encode("utf-8"))
+    log.debug("Using base64 PDF data, size: %s bytes", len(pdf_bytes))
+    return FetchedPdf(data=pdf_bytes)
 
-        print(f"[PDF-FETCH] Fetching PDF from: {pdf_url}")
 
-        response = requests.get(pdf_url, timeout=30)
-        response.raise_for_status()
+def read_sign_request():
+    """
+    Parameters and upload of a /sign-pdf request, as (params, upload).
+
+    - application/json: {"pin", "pdf_filename", "pdf_base64", "signing_mode"};
+      upload is None and the PDF is fetched or decoded by load_source_pdf
+    - application/pdf: the raw body is the document; pin, pdf_filename and
+      signing_mode come from the query string (or X-Token-Pin header)
+    - multipart/form-data: the "pdf" (or "file") part is the document,
+      the other values are form fields
+
+    Uploads may leave pdf_filename out; sign_pdf then names them after
+    their content hash (see upload_filename).
+    """
+    if request.mimetype == "application/pdf":
+        params = {
+            "pin": request.headers.get("X-Token-Pin") or request.args.get("pin"),
+            "pdf_filename": request.args.get("pdf_filename"),
+            "signing_mode": request.args.get("signing_mode"),
+        }
+        return params, request.stream
+
+    if request.mimetype == "multipart/form-data":
+        upload = request.files.get("pdf") or request.files.get("file")
+        params = {
+            "pin": request.headers.get("X-Token-Pin") or request.form.get("pin"),
+            "pdf_filename": request.form.get("pdf_filename")
+            or (upload.filename if upload else None),
+            "signing_mode": request.form.get("signing_mode"),
+            "token_serial": request.form.get("token_serial"),
+            "thumbprint": request.form.get("thumbprint"),
+        }
+        if upload is None:
+            raise ValueError("Missing PDF data")
+        return params, upload.stream
+
+    return request.get_json() or {}, None
+
+
+def upload_filename(source_pdf):
+    """Name of an upload sent without one, from its content hash"""
+    return f"upload_{source_pdf.sha256.hex()[:16]}.pdf"
+
+
+def load_job_item(item):
+    """FetchedPdf for a batch/job item: a filename or {"pdf_filename", "pdf_base64"}"""
+    if isinstance(item, dict):
+        return load_source_pdf(item.get("pdf_filename"), item.get("pdf_base64"))
+    return load_source_pdf(item)
+
+
+def token_selection(data):
+    """
+    Token and certificate chosen by the caller when several dongles are
+    plugged in: "token_serial" and/or "thumbprint" (SHA-256 of the
+    certificate, see /tokens) from the body, form or query string.
+    """
+    return {
+        "serial": data.get("token_serial") or request.args.get("token_serial"),
+        "thumbprint": data.get("thumbprint") or request.args.get("thumbprint"),
+    }
+
+
+def save_signed_pdf(pdf_filename, signed_pdf_bytes, save=None):
+    """
+    Unless ``save`` is False (default SAVE_SIGNED_DOCS) queue the signed
+    PDF for writing to SIGNED_DOCS_PATH in the background.
+    Returns (output name, saved path or None).
+    """
+    from .config import SAVE_SIGNED_DOCS, SIGNED_DOCS_PATH
 
-        # Validate PDF content
-        if not response.content.startswith(b"%PDF"):
-            raise Exception("Downloaded content is not a valid PDF file")
+    output_filename = build_output_filename(pdf_filename)
 
-        print(
-            f"[PDF-FETCH] Successfully fetched {pdf_filename}, size: {len(response.content)} bytes"
+    signed_pdf_path = None
+    if SAVE_SIGNED_DOCS if save is None else save:
+        signed_pdf_path = os.path.join(SIGNED_DOCS_PATH, output_filename)
+        get_writer().save(signed_pdf_path, signed_pdf_bytes)
+    return output_filename, signed_pdf_path
+
+
+def sign_source_pdf(
+    manager,
+    pdf_filename,
+    source_pdf,
+    pin,
+    signing_mode=None,
+    save=None,
+    serial=None,
+    thumbprint=None,
+):
+    """
+    Sign a loaded source PDF in memory and save it (see save_signed_pdf).
+    Returns (output name, saved path or None, bytes).
+    """
+    signed_pdf_bytes = manager.sign_pdf_bytes(
+        source_pdf.source,
+        pin,
+        mode=signing_mode,
+        pdf_hash=source_pdf.sha256,
+        serial=serial,
+        thumbprint=thumbprint,
+        save=save,
+    )
+    output_filename, signed_pdf_path = save_signed_pdf(
+        pdf_filename, signed_pdf_bytes, save
+    )
+    return output_filename, signed_pdf_path, signed_pdf_bytes
+
+
+def sign_prefetched(
+    manager,
+    pin,
+    prefetched,
+    signing_mode=None,
+    serial=None,
+    thumbprint=None,
+    serials=None,
+    save=None,
+):
+    """
+    Sign documents from a PdfPrefetcher, yielding (item, signed bytes,
+    error, seconds spent signing it) in order. Overlay signing of several
+    documents goes through the process pool (see OverlayPipeline);
+    incremental signatures cover the final bytes, so they are produced one
+    at a time per token.
+
+    Documents are shared between the tokens in ``serials`` or, with
+    SPREAD_ACROSS_TOKENS, between the tokens already logged in with this
+    PIN that hold the same signer's certificate (see signing_tokens).
+    """
+    from .config import PREPARE_WORKERS, SIGNING_MODE, SPREAD_ACROSS_TOKENS
+
+    bulk = len(prefetched.items) > 1
+    tokens = manager.signing_tokens(
+        pin,
+        serial,
+        thumbprint,
+        spread=SPREAD_ACROSS_TOKENS and bulk,
+        serials=serials if bulk else None,
+    )
+
+    if (
+        PREPARE_WORKERS > 0
+        and bulk
+        and (signing_mode or SIGNING_MODE) != "incremental"
+    ):
+        yield from OverlayPipeline(manager, pin, tokens, save=save).run(prefetched)
+        return
+
+    if len(tokens) > 1:
+        yield from sign_on_tokens(manager, pin, prefetched, tokens, signing_mode, save)
+        return
+
+    for item, source_pdf, error in prefetched:
+        signed_pdf_bytes = None
+        started = time.perf_counter()
+        if error is None:
+            try:
+                signed_pdf_bytes = manager.sign_pdf_bytes(
+                    source_pdf.source,
+                    pin,
+                    mode=signing_mode,
+                    pdf_hash=source_pdf.sha256,
+                    serial=serial,
+                    thumbprint=thumbprint,
+                    save=save,
+                )
+            except Exception as e:
+                error = e
+            finally:
+                source_pdf.close()
+        yield item, signed_pdf_bytes, error, time.perf_counter() - started
+
+
+def signed_pdf_response(signed_pdf_bytes, metadata):
+    """
+    Signed PDF in the format the caller accepts:
+      application/json  - metadata plus base64 "signed_pdf" (default)
+      application/pdf   - the raw file, metadata in X-* headers
+      multipart/mixed   - a JSON metadata part followed by the PDF part
+    """
+    best = request.accept_mimetypes.best_match(SIGNED_PDF_FORMATS)
+
+    if best == "application/pdf":
+        response = send_file(
+            io.BytesIO(signed_pdf_bytes),
+            mimetype="application/pdf",
+            as_attachment=True,
+            download_name=metadata["output_filename"],
         )
-        return response.content
+        response.headers["X-Original-Filename"] = metadata["original_filename"]
+        response.headers["X-Output-Filename"] = metadata["output_filename"]
+        if metadata["saved_path"]:
+            response.headers["X-Saved-Path"] = metadata["saved_path"]
+        return response
+
+    if best == "multipart/mixed":
+        boundary = uuid.uuid4().hex
 
-    except requests.exceptions.HTTPError as e:
-        if e.response.status_code == 404:
-            raise Exception(f"PDF file not found on server: {pdf_filename}")
+        def generate():
+            yield (
+                f"--{boundary}\r\nContent-Type: application/json\r\n\r\n"
+                + json.dumps(metadata)
+                + f"\r\n--{boundary}\r\nContent-Type: application/pdf\r\n"
+                + "Content-Disposition: attachment; "
+                + f'filename="{metadata["output_filename"]}"\r\n\r\n'
+            ).encode("utf-8")
+            yield signed_pdf_bytes
+            yield f"\r\n--{boundary}--\r\n".encode("utf-8")
+
+        return Response(
+            generate(), content_type=f"multipart/mixed; boundary={boundary}"
+        )
+
+    signed_b64 = base64.b64encode(signed_pdf_bytes).decode("utf-8")
+    return jsonify({**metadata, "signed_pdf": signed_b64})
+
+
+def parse_digest(value):
+    """32-byte SHA-256 digest from a hex or base64 string"""
+    if not isinstance(value, str) or not value:
+        raise ValueError("Digest missing")
+    try:
+        if len(value) == 64:
+            digest = bytes.fromhex(value)
         else:
-            raise Exception(f"Server error: {e}")
-    except requests.exceptions.RequestException as e:
-        raise Exception(f"Network error: {e}")
-    except Exception as e:
-        raise Exception(f"Error fetching PDF: {e}")
+            digest = base64.b64decode(value, validate=True)
+    except (ValueError, binascii.Error):
+        raise ValueError("Digest must be hex or base64")
+    if len(digest) != 32:
+        raise ValueError("Digest must be a 32-byte SHA-256 value")
+    return digest
+
+
+def signer_details(cert_info):
+    return {
+        "subject_cn": str(cert_info.get("subject_cn", "")),
+        "serial_number": str(cert_info.get("serial_number", "")),
+        "thumbprint": str(cert_info.get("thumbprint", "")),
+    }
+
+
+def sign_error_response(e, pdf_filename=None):
+    """Map a signing exception to (payload, HTTP status)"""
+    err = str(e).lower()
+    kind = type(e).__name__
+
+    # PKCS#11 login errors usually carry no message
+    if kind in ("PinIncorrect", "PinInvalid", "PinLenRange"):
+        return {"error": "Incorrect PIN", "error_type": "wrong_pin"}, 400
+
+    if kind == "PinLocked":
+        return {
+            "error": "Token locked due to repeated wrong attempts",
+            "error_type": "token_locked",
+        }, 400
+
+    if "requested token not present" in err:
+        return {"error": str(e), "error_type": "token_not_found"}, 404
+
+    if "no private key on the token for certificate" in err:
+        return {"error": str(e), "error_type": "certificate_not_found"}, 404
+
+    if "not found" in err or "no such file" in err:
+        return {
+            "error": f"PDF not found on server: {pdf_filename}",
+            "error_type": "pdf_not_found",
+        }, 404
+
+    if "pin" in err and ("wrong" in err or "incorrect" in err):
+        return {"error": "Incorrect PIN", "error_type": "wrong_pin"}, 400
+
+    if "token" in err or "dongle" in err:
+        return {
+            "error": "USB Token/Dongle missing",
+            "error_type": "dongle_missing",
+        }, 400
+
+    # fallback
+    return {"error": str(e), "error_type": "signing_failed"}, 500
 
 
 @app.route("/sign-pdf", methods=["POST"])
+@profiled("sign-pdf")
 def sign_pdf():
+    pdf_filename = None
     try:
-        data = request.get_json() or {}
+        try:
+            data, upload = read_sign_request()
+        except ValueError as e:
+            return jsonify({"error": str(e), "error_type": "invalid_upload"}), 400
         pin = data.get("pin")
         pdf_filename = data.get("pdf_filename")  # Required: specific filename
 
@@ -212,91 +705,424 @@ def sign_pdf():
                 {"error": "PIN is required", "error_type": "missing_pin"}
             ), 400
 
-        if not pdf_filename:
+        if not pdf_filename and upload is None:
             return jsonify(
                 {"error": "PDF filename missing", "error_type": "missing_pdf_file"}
             ), 400
 
-        print(f"[SIGN-PDF] Starting signing process for: {pdf_filename}")
+        # Uploaded body, or AUTO-FETCH PDF from URL with provided filename
+        # (or base64 fallback)
+        try:
+            if upload is not None:
+                source_pdf = read_pdf_stream(upload)
+                log.debug("Using uploaded PDF, size: %s bytes", source_pdf.size)
+                pdf_filename = pdf_filename or upload_filename(source_pdf)
+            else:
+                source_pdf = load_source_pdf(pdf_filename, data.get("pdf_base64"))
+        except ValueError as e:
+            error_type = "invalid_upload" if upload is not None else "missing_pdf_file"
+            return jsonify({"error": str(e), "error_type": error_type}), 400
+
+        log.info("Signing %s", pdf_filename)
+
+        # Shared PKCS#11 manager keeps the token logged in between requests
+        manager = get_manager(PKCS11_PATH)
+
+        try:
+            output_filename, signed_pdf_path, signed_pdf_bytes = sign_source_pdf(
+                manager,
+                pdf_filename,
+                source_pdf,
+                pin,
+                data.get("signing_mode"),
+                save=data.get("save"),
+                **token_selection(data),
+            )
+        finally:
+            source_pdf.close()
+
+        log.info("Signed %s, saving to: %s", output_filename, signed_pdf_path)
+
+        return signed_pdf_response(
+            signed_pdf_bytes,
+            {
+                "status": "success",
+                "message": "PDF signed successfully",
+                "original_filename": pdf_filename,
+                "output_filename": output_filename,
+                "saved_path": signed_pdf_path,
+            },
+        )
+
+    except Exception as e:
+        log.warning("Signing %s failed: %r", pdf_filename, e)
+        payload, code = sign_error_response(e, pdf_filename)
+        return jsonify(payload), code
+
+
+@app.route("/sign-digest", methods=["POST"])
+def sign_digest():
+    """
+    Detached signing: the portal prepares the PDF (signature dictionary
+    with a ByteRange placeholder), sends only the SHA-256 of the ByteRange
+    and embeds the returned CMS in /Contents itself.
+
+    Body: {"pin": "...", "digest": "<hex or base64>", "context": {...}}
+    "context" is echoed back untouched so the portal can match responses.
+    """
+    data = request.get_json() or {}
+    pin = data.get("pin")
+
+    if not pin:
+        return jsonify({"error": "PIN is required", "error_type": "missing_pin"}), 400
+
+    try:
+        digest = parse_digest(data.get("digest"))
+    except ValueError as e:
+        return jsonify({"error": str(e), "error_type": "invalid_digest"}), 400
 
-        # AUTO-FETCH PDF from URL with provided filename
-        from .config import AUTO_FETCH_PDF
+    try:
+        cms, cert_info = get_manager(PKCS11_PATH).sign_digest(
+            pin, digest, **token_selection(data)
+        )
+    except Exception as e:
+        log.warning("Digest signing failed: %r", e)
+        payload, code = sign_error_response(e)
+        return jsonify(payload), code
 
-        if AUTO_FETCH_PDF:
-            print(f"[SIGN-PDF] Auto-fetch enabled for: {pdf_filename}")
-            pdf_bytes = fetch_pdf_from_url(pdf_filename)
+    return jsonify(
+        {
+            "status": "success",
+            "digest": digest.hex(),
+            "cms": base64.b64encode(cms).decode("ascii"),
+            "signer": signer_details(cert_info),
+            "context": data.get("context"),
+        }
+    )
+
+
+@app.route("/sign-digests", methods=["POST"])
+def sign_digests():
+    """
+    Bulk detached signing over one logged-in session.
+
+    Body: {"pin": "...", "format": "cms" | "raw",
+           "digests": [{"id": "app-101", "digest": "<hex or base64>"}, ...]}
+    ("digests" may also be an {id: digest} object.)
+
+    Returns signatures (base64) keyed by id, plus per-id errors. With
+    "raw" the signer certificate is returned once for the portal to build
+    its own CMS.
+    """
+    data = request.get_json() or {}
+    pin = data.get("pin")
+    output = data.get("format", "cms")
+    items = data.get("digests") or []
+    if isinstance(items, dict):
+        items = [{"id": k, "digest": v} for k, v in items.items()]
+
+    if not pin:
+        return jsonify({"error": "PIN is required", "error_type": "missing_pin"}), 400
+
+    if output not in ("cms", "raw"):
+        return jsonify(
+            {"error": "format must be cms or raw", "error_type": "invalid_format"}
+        ), 400
+
+    if not isinstance(items, list) or not items:
+        return jsonify({"error": "Digests missing", "error_type": "invalid_digest"}), 400
+
+    if len(items) > SIGN_DIGESTS_MAX:
+        return jsonify(
+            {
+                "error": f"At most {SIGN_DIGESTS_MAX} digests per request",
+                "error_type": "too_many_digests",
+            }
+        ), 400
+
+    errors = {}
+    digests = []
+    for index, item in enumerate(items):
+        item_id = str(item.get("id", index)) if isinstance(item, dict) else str(index)
+        try:
+            digest_value = item.get("digest") if isinstance(item, dict) else None
+            digests.append((item_id, parse_digest(digest_value)))
+        except ValueError as e:
+            errors[item_id] = {"error": str(e), "error_type": "invalid_digest"}
+
+    started = time.time()
+    try:
+        results, cert_data, cert_info = get_manager(PKCS11_PATH).sign_digests(
+            pin, digests, output, **token_selection(data)
+        )
+    except Exception as e:
+        log.warning("Digest batch login failed: %r", e)
+        payload, code = sign_error_response(e)
+        return jsonify(payload), code
+
+    signatures = {}
+    for item_id, signature, error in results:
+        if error is not None:
+            payload, _ = sign_error_response(error)
+            errors[item_id] = payload
         else:
-            # Fallback to original base64 method
-            pdf_b64 = data.get("pdf_base64")
-            if not pdf_b64:
-                return jsonify({"error": "Missing PDF data"}), 400
-            pdf_bytes = base64.b64decode(pdf_b64.encode("utf-8"))
-            print(f"[SIGN-PDF] Using base64 PDF data, size: {len(pdf_bytes)} bytes")
-
-        # Generate output filename based on original
-        from .config import SIGNED_DOCS_PATH
-
-        # Clean filename for output
-        original_name = os.path.splitext(pdf_filename)[0]
-        if original_name:
-            # remove prefix "unsingedDoc_"
-            cleaned_name = original_name.replace("unsingedDoc_", "")
-
-        output_filename = f"signedDoc_{cleaned_name}.pdf"
-        signed_pdf_path = os.path.join(SIGNED_DOCS_PATH, output_filename)
+            signatures[item_id] = base64.b64encode(signature).decode("ascii")
+    for payload in errors.values():
+        ERRORS.inc(endpoint="/sign-digests", error_type=payload["error_type"])
+
+    elapsed = time.time() - started
+    log.info("Signed %s/%s digest(s) in %.2fs", len(signatures), len(items), elapsed)
 
-        # Initialize PKCS#11 manager and sign PDF
-        print(f"[SIGN-PDF] Initializing PKCS11 manager...")
-        manager = PKCS11Manager(PKCS11_PATH)
+    result = {
+        "status": "completed",
+        "format": output,
+        "total": len(items),
+        "signed": len(signatures),
+        "failed": len(errors),
+        "elapsed_ms": int(elapsed * 1000),
+        "signer": signer_details(cert_info),
+        "signatures": signatures,
+        "errors": errors,
+    }
+    if output == "raw":
+        result["certificate"] = base64.b64encode(cert_data).decode("ascii")
+    return jsonify(result)
 
-        print(f"[SIGN-PDF] Starting PDF signing...")
-        isSuccess = manager.sign_pdf(pdf_bytes, signed_pdf_path, pin)
 
-        if isSuccess:
-            print(f"[SIGN-PDF] SUCCESS: Signed document saved as: {signed_pdf_path}")
+@app.route("/sign-batch", methods=["POST"])
+def sign_batch():
+    """
+    Sign many PDFs under one token login.
+
+    Body: {"pin": "...", "pdf_filenames": ["unsingedDoc_1.pdf", ...],
+           "include_pdf": true, "save": false, "signing_mode": "incremental",
+           "token_serial": "...", "thumbprint": "...",
+           "token_serials": ["...", ...]}
+    Items may also be {"pdf_filename": ..., "pdf_base64": ...} when
+    AUTO_FETCH_PDF is off.
 
-            # Read the signed PDF and return as base64
-            with open(signed_pdf_path, "rb") as f:
-                signed_pdf_bytes = f.read()
+    Streams one JSON line (NDJSON) per document as it is signed, followed
+    by a final {"status": "completed", ...} summary line.
+    """
+    data = request.get_json() or {}
+    pin = data.get("pin")
+    items = data.get("pdf_filenames") or []
+    include_pdf = data.get("include_pdf", True)
+    signing_mode = data.get("signing_mode")
+    save = data.get("save")
+    selection = token_selection(data)
+    # Tokens to share the batch between; the PIN is tried on each of them
+    serials = data.get("token_serials") or None
 
-            signed_b64 = base64.b64encode(signed_pdf_bytes).decode("utf-8")
+    if not pin:
+        return jsonify({"error": "PIN is required", "error_type": "missing_pin"}), 400
 
+    if not isinstance(items, list) or not items:
+        return jsonify(
+            {"error": "PDF filenames missing", "error_type": "missing_pdf_file"}
+        ), 400
+
+    if serials is not None:
+        if not isinstance(serials, list) or not all(
+            isinstance(serial, str) for serial in serials
+        ):
             return jsonify(
                 {
-                    "status": "success",
-                    "message": "PDF signed successfully",
-                    "signed_pdf": signed_b64,
-                    "original_filename": pdf_filename,
-                    "output_filename": output_filename,
-                    "saved_path": signed_pdf_path,
+                    "error": "token_serials must be a list of serials",
+                    "error_type": "invalid_format",
                 }
-            )
-        else:
-            print(f"[SIGN-PDF] FAILED: Could not sign PDF")
-            return jsonify({"error": "PDF signing failed"}), 500
+            ), 400
+        selection["serial"] = selection["serial"] or serials[0]
+
+    manager = get_manager(PKCS11_PATH)
 
+    # Log in once up front so a wrong PIN or missing dongle fails the whole
+    # batch immediately instead of once per document
+    try:
+        manager.get_token_credentials(pin, **selection)
     except Exception as e:
-        err = str(e).lower()
-        print(f"[SIGN-PDF] ERROR: {err}")
+        log.warning("Batch login failed: %r", e)
+        payload, code = sign_error_response(e)
+        return jsonify(payload), code
 
-        if "not found" in err or "no such file" in err:
-            return jsonify(
-                {
-                    "error": f"PDF not found on server: {pdf_filename}",
-                    "error_type": "pdf_not_found",
-                }
-            ), 404
+    log.info("Signing batch of %s document(s)", len(items))
 
-        if "pin" in err and ("wrong" in err or "incorrect" in err):
-            return jsonify({"error": "Incorrect PIN", "error_type": "wrong_pin"}), 400
+    def generate():
+        signed = failed = 0
+        batch_started = time.time()
 
-        if "token" in err or "dongle" in err:
-            return jsonify(
-                {"error": "USB Token/Dongle missing", "error_type": "dongle_missing"}
-            ), 400
+        # Upcoming documents are downloaded and rendered while the current
+        # one is signed
+        prefetched = PdfPrefetcher(items, load=load_job_item)
+        signed_docs = sign_prefetched(
+            manager,
+            pin,
+            prefetched,
+            signing_mode,
+            serials=serials,
+            save=save,
+            **selection,
+        )
+
+        for index, (item, signed_pdf_bytes, sign_error, seconds) in enumerate(
+            signed_docs
+        ):
+            if isinstance(item, dict):
+                pdf_filename = item.get("pdf_filename")
+            else:
+                pdf_filename = item
+
+            result = {"index": index, "original_filename": pdf_filename}
+            try:
+                if not pdf_filename:
+                    raise ValueError("PDF filename missing")
+                if sign_error is not None:
+                    raise sign_error
+
+                output_filename, signed_pdf_path = save_signed_pdf(
+                    pdf_filename, signed_pdf_bytes, save
+                )
+
+                result.update(
+                    {
+                        "status": "success",
+                        "output_filename": output_filename,
+                        "saved_path": signed_pdf_path,
+                    }
+                )
+                if include_pdf:
+                    result["signed_pdf"] = base64.b64encode(signed_pdf_bytes).decode(
+                        "utf-8"
+                    )
+                signed += 1
+
+            except Exception as e:
+                log.warning("%s failed: %s", pdf_filename, e)
+                payload, _ = sign_error_response(e, pdf_filename)
+                result.update({"status": "error", **payload})
+                ERRORS.inc(endpoint="/sign-batch", error_type=payload["error_type"])
+                failed += 1
+
+            # Signing time of this document; with the pipeline others are
+            # signed meanwhile, so these do not add up to the batch total
+            result["elapsed_ms"] = int(seconds * 1000)
+            yield json.dumps(result) + "\n"
+
+        yield json.dumps(
+            {
+                "status": "completed",
+                "total": len(items),
+                "signed": signed,
+                "failed": failed,
+                "elapsed_ms": int((time.time() - batch_started) * 1000),
+            }
+        ) + "\n"
+
+    return Response(
+        stream_with_context(generate()), mimetype="application/x-ndjson"
+    )
+
+
+def sign_job_document(job, document, source_pdf):
+    # Always saved: GET /jobs/<id>?include_pdf=1 reads the files back
+    output_filename, signed_pdf_path, _ = sign_source_pdf(
+        get_manager(PKCS11_PATH),
+        document["original_filename"],
+        source_pdf,
+        job.pin,
+        job.signing_mode,
+        save=True,
+        **job.token,
+    )
+    return {"output_filename": output_filename, "saved_path": signed_pdf_path}
+
+
+def job_error_payload(e, pdf_filename):
+    payload, _ = sign_error_response(e, pdf_filename)
+    ERRORS.inc(endpoint="/jobs", error_type=payload["error_type"])
+    return payload
+
+
+jobs = JobQueue(
+    load=load_job_item,
+    sign_document=sign_job_document,
+    describe_error=job_error_payload,
+    login=lambda job: get_manager(PKCS11_PATH).get_token_credentials(
+        job.pin, **job.token
+    ),
+)
+
+
+@app.route("/jobs", methods=["POST"])
+def create_job():
+    """
+    Queue a signing job and return its ID immediately.
+
+    Body: {"pin": "...", "pdf_filename": "..."} for one document or
+    {"pin": "...", "pdf_filenames": [...]} for many (items as in
+    /sign-batch), plus optional "signing_mode" and "priority"
+    ("interactive" or "bulk"; single documents default to interactive).
+    Poll GET /jobs/<job_id> for progress.
+    """
+    data = request.get_json() or {}
+    pin = data.get("pin")
+    items = data.get("pdf_filenames")
+    if items is None and data.get("pdf_filename"):
+        items = [
+            {"pdf_filename": data["pdf_filename"], "pdf_base64": data.get("pdf_base64")}
+        ]
+
+    if not pin:
+        return jsonify({"error": "PIN is required", "error_type": "missing_pin"}), 400
+
+    if not isinstance(items, list) or not items:
+        return jsonify(
+            {"error": "PDF filenames missing", "error_type": "missing_pdf_file"}
+        ), 400
+
+    default = PRIORITY_INTERACTIVE if len(items) == 1 else PRIORITY_BULK
+    priority = PRIORITIES.get(data.get("priority"), default)
+
+    job = jobs.submit(
+        Job(pin, items, priority, data.get("signing_mode"), token_selection(data))
+    )
+    return jsonify(
+        {
+            "job_id": job.id,
+            "status": job.status,
+            "total": len(job.items),
+            "queued_jobs": jobs.pending(),
+            "status_url": f"/jobs/{job.id}",
+        }
+    ), 202
+
+
+@app.route("/jobs/<job_id>", methods=["GET"])
+def get_job(job_id):
+    """Job state with per-document status, timings and output names.
+    Add ?include_pdf=1 to inline the signed PDFs (base64) once signed."""
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown job", "error_type": "job_not_found"}), 404
 
-        # fallback
-        return jsonify({"error": str(e), "error_type": "signing_failed"}), 500
+    result = job.to_dict()
+    if request.args.get("include_pdf") in ("1", "true"):
+        for doc in result["documents"]:
+            if doc["status"] != "success":
+                continue
+            # A failed save or a file removed since is that document's
+            # error, like a signing failure, not the whole listing's
+            try:
+                get_writer().wait_for(doc["saved_path"])
+                with open(doc["saved_path"], "rb") as f:
+                    doc["signed_pdf"] = base64.b64encode(f.read()).decode("utf-8")
+            except Exception as e:
+                log.warning("Reading %s failed: %s", doc["saved_path"], e)
+                doc.update(job_error_payload(e, doc["output_filename"]))
+                doc["status"] = "error"
+                result["signed"] -= 1
+                result["failed"] += 1
+    return jsonify(result)
 
 
 def run():
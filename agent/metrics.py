@@ -0,0 +1,186 @@
+# agent/metrics.py
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+# Seconds; covers a cached /status answer up to a slow token login
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+def _label_text(names, values):
+    if not names:
+        return ""
+    pairs = []
+    for name, value in zip(names, values):
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"')
+        value = value.replace("\n", "\\n")
+        pairs.append(f'{name}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+class Counter:
+    """Monotonic counter with optional labels"""
+
+    kind = "counter"
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(name, "") for name in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        for key, value in sorted(values.items()):
+            yield f"{self.name}{_label_text(self.labels, key)} {value}"
+
+
+class Histogram:
+    """Cumulative-bucket histogram with optional labels"""
+
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(name, "") for name in self.labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                # Per-bucket counts (last slot is +Inf), sum
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def samples(self):
+        with self._lock:
+            series = {
+                key: (list(counts), total) for key, (counts, total) in self._series.items()
+            }
+        names = self.labels + ("le",)
+        for key, (counts, total) in sorted(series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                yield f"{self.name}_bucket{_label_text(names, key + (le,))} {cumulative}"
+            labels = _label_text(self.labels, key)
+            yield f"{self.name}_sum{labels} {total}"
+            yield f"{self.name}_count{labels} {cumulative}"
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        """Prometheus text exposition format (version 0.0.4)"""
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.register(
+    Histogram(
+        "agent_stage_seconds",
+        "Time spent per signing stage (library_load, login, find_objects, "
+        "token_wait, sign, hash, fetch, overlay_render, merge, write, "
+        "incremental_sign, cms_build, save, prepare_wait, sign_wait)",
+        labels=("stage",),
+    )
+)
+HTTP_REQUESTS = REGISTRY.register(
+    Counter(
+        "agent_http_requests_total",
+        "HTTP requests by endpoint, method and status code",
+        labels=("endpoint", "method", "status"),
+    )
+)
+HTTP_SECONDS = REGISTRY.register(
+    Histogram(
+        "agent_http_request_seconds",
+        "Time to build the response per endpoint (streamed bodies excluded)",
+        labels=("endpoint",),
+    )
+)
+ERRORS = REGISTRY.register(
+    Counter(
+        "agent_errors_total",
+        "Failed requests and failed documents/digests by error_type",
+        labels=("endpoint", "error_type"),
+    )
+)
+BYTES_IN = REGISTRY.register(
+    Counter(
+        "agent_bytes_received_total",
+        "Bytes received: request bodies and PDFs fetched from the portal",
+        labels=("source",),
+    )
+)
+BYTES_OUT = REGISTRY.register(
+    Counter(
+        "agent_bytes_sent_total",
+        "Response body bytes sent per endpoint",
+        labels=("endpoint",),
+    )
+)
+FETCH_CACHE = REGISTRY.register(
+    Counter(
+        "agent_fetch_cache_total",
+        "Source PDF fetches by cache result (hit = 304 from the portal, miss, "
+        "stale = changed on the portal, uncacheable = no validators)",
+        labels=("result",),
+    )
+)
+SIGNED_STORE = REGISTRY.register(
+    Counter(
+        "agent_signed_store_total",
+        "Signing requests by signed-output store result (hit = answered "
+        "without the token, miss)",
+        labels=("result",),
+    )
+)
+DOCUMENTS_SIGNED = REGISTRY.register(
+    Counter(
+        "agent_documents_signed_total",
+        "PDFs and digests signed, by kind",
+        labels=("kind",),
+    )
+)
+
+
+def stage(name):
+    """``with stage("sign"): ...`` records the block in agent_stage_seconds"""
+    return STAGE_SECONDS.time(stage=name)
@@ -0,0 +1,331 @@
+# agent/pdf_fetch.py
+import contextvars
+import hashlib
+import io
+import logging
+import os
+import tempfile
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from .fetch_cache import get_fetch_cache
+from .metrics import BYTES_IN, FETCH_CACHE, stage
+from .config import (
+    FETCH_BACKOFF,
+    FETCH_CACHE_ENABLED,
+    FETCH_CHUNK_SIZE,
+    FETCH_RETRIES,
+    FETCH_SPOOL_THRESHOLD,
+    FETCH_TIMEOUT,
+    PDF_SOURCE_BASE_URL,
+    PREFETCH_MAX_INFLIGHT_BYTES,
+    PREFETCH_WORKERS,
+)
+
+log = logging.getLogger(__name__)
+
+# HTTP statuses worth retrying - the portal is restarting or overloaded
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+_http_session = None
+_http_session_lock = threading.Lock()
+
+
+def get_http_session():
+    """Shared requests session so connections to the portal are kept alive"""
+    global _http_session
+    with _http_session_lock:
+        if _http_session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(
+                pool_connections=4, pool_maxsize=max(PREFETCH_WORKERS, 4)
+            )
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            _http_session = session
+        return _http_session
+
+
+class FetchedPdf:
+    """
+    A source PDF and its SHA-256, hashed while the bytes were received.
+
+    Small documents stay in memory (``data``); larger ones are spooled to a
+    temporary file (``path``) so big scans never sit in RAM. ``source`` is
+    what ``PKCS11Manager.sign_pdf`` accepts. Call ``close()`` when done.
+    """
+
+    def __init__(self, data=None, path=None, sha256=None, size=None):
+        self.data = data
+        self.path = path
+        if sha256 is None and data is not None:
+            sha256 = hashlib.sha256(data).digest()
+        self.sha256 = sha256
+        self.size = size if size is not None else len(data or b"")
+
+    @property
+    def source(self):
+        return self.data if self.data is not None else self.path
+
+    def read(self):
+        if self.data is not None:
+            return self.data
+        with open(self.path, "rb") as f:
+            return f.read()
+
+    def close(self):
+        if self.path and self.data is None:
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+            self.path = None
+
+    def __len__(self):
+        return self.size
+
+    @classmethod
+    def from_stream(cls, chunks, spool_threshold=FETCH_SPOOL_THRESHOLD):
+        """Hash chunks as they arrive, spooling to disk past the threshold"""
+        digest = hashlib.sha256()
+        buffer = io.BytesIO()
+        spool = None
+        path = None
+        size = 0
+        try:
+            for chunk in chunks:
+                if not chunk:
+                    continue
+                if size == 0 and not chunk.startswith(b"%PDF"):
+                    raise Exception("Downloaded content is not a valid PDF file")
+                digest.update(chunk)
+                size += len(chunk)
+                if spool is None and size > spool_threshold:
+                    fd, path = tempfile.mkstemp(prefix="dsa_", suffix=".pdf")
+                    spool = os.fdopen(fd, "wb")
+                    spool.write(buffer.getvalue())
+                    buffer = None
+                if spool is not None:
+                    spool.write(chunk)
+                else:
+                    buffer.write(chunk)
+        except BaseException:
+            if spool is not None:
+                spool.close()
+                os.remove(path)
+            raise
+
+        if size == 0:
+            raise Exception("Downloaded content is not a valid PDF file")
+        if spool is not None:
+            spool.close()
+            return cls(path=path, sha256=digest.digest(), size=size)
+        return cls(data=buffer.getvalue(), sha256=digest.digest(), size=size)
+
+
+def read_pdf_stream(stream, spool_threshold=FETCH_SPOOL_THRESHOLD):
+    """
+    FetchedPdf from an uploaded file object or request body. Hashed and
+    spooled to disk chunk by chunk, like a download.
+    """
+    chunks = iter(lambda: stream.read(FETCH_CHUNK_SIZE), b"")
+    try:
+        return FetchedPdf.from_stream(chunks, spool_threshold)
+    except Exception as e:
+        if "not a valid PDF" in str(e):
+            raise ValueError("Uploaded content is not a valid PDF file")
+        raise
+
+
+def fetch_pdf(pdf_filename, base_url=None, session=None):
+    """
+    Fetch specific PDF from the configured URL.
+    The body is streamed and hashed chunk by chunk, so the digest is ready
+    as soon as the download completes. Documents in the fetch cache are
+    revalidated with a conditional GET and read from disk on a 304.
+    Returns a FetchedPdf.
+    """
+    try:
+        if not pdf_filename:
+            raise Exception("PDF filename is required")
+
+        # Ensure the filename has .pdf extension
+        if not pdf_filename.lower().endswith(".pdf"):
+            pdf_filename += ".pdf"
+
+        pdf_url = f"{base_url or PDF_SOURCE_BASE_URL}{pdf_filename}"
+
+        log.debug("Fetching PDF from: %s", pdf_url)
+
+        cache = get_fetch_cache() if FETCH_CACHE_ENABLED else None
+        cached = cache.lookup(pdf_url) if cache is not None else None
+        http = session or get_http_session()
+
+        with stage("fetch"):
+            response = _get_with_retry(
+                pdf_url,
+                http,
+                headers=cached.conditional_headers() if cached else None,
+            )
+            if response.status_code == 304 and cached is not None:
+                response.close()
+                fetched = cache.open(cached)
+                if fetched is not None:
+                    FETCH_CACHE.inc(result="hit")
+                    log.debug("%s not modified, using cached copy", pdf_filename)
+                    return fetched
+                # Evicted or damaged since the lookup: download it whole
+                cached = None
+                response = _get_with_retry(pdf_url, http)
+
+            with response:
+                response.raise_for_status()
+                fetched = FetchedPdf.from_stream(
+                    response.iter_content(chunk_size=FETCH_CHUNK_SIZE)
+                )
+                validators = (
+                    response.headers.get("ETag"),
+                    response.headers.get("Last-Modified"),
+                )
+        BYTES_IN.inc(fetched.size, source="fetch")
+
+        if cache is not None:
+            if cache.store(pdf_url, fetched, *validators) is None:
+                FETCH_CACHE.inc(result="uncacheable")
+            else:
+                FETCH_CACHE.inc(result="stale" if cached else "miss")
+
+        log.debug("Fetched %s, size: %s bytes", pdf_filename, fetched.size)
+        return fetched
+
+    except requests.exceptions.HTTPError as e:
+        if e.response.status_code == 404:
+            raise Exception(f"PDF file not found on server: {pdf_filename}")
+        else:
+            raise Exception(f"Server error: {e}")
+    except requests.exceptions.RequestException as e:
+        raise Exception(f"Network error: {e}")
+    except Exception as e:
+        raise Exception(f"Error fetching PDF: {e}")
+
+
+def fetch_pdf_from_url(pdf_filename, base_url=None, session=None):
+    """Fetch specific PDF from the configured URL and return its bytes"""
+    fetched = fetch_pdf(pdf_filename, base_url=base_url, session=session)
+    try:
+        return fetched.read()
+    finally:
+        fetched.close()
+
+
+def _get_with_retry(url, session, headers=None):
+    """GET with exponential backoff on connection errors and 429/5xx"""
+    attempt = 0
+    while True:
+        try:
+            response = session.get(
+                url, headers=headers, timeout=FETCH_TIMEOUT, stream=True
+            )
+            if response.status_code not in RETRY_STATUSES or attempt >= FETCH_RETRIES:
+                return response
+            response.close()
+            log.warning("%s returned %s, retrying", url, response.status_code)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+            if attempt >= FETCH_RETRIES:
+                raise
+            log.warning("%s failed (%s), retrying", url, e.__class__.__name__)
+
+        time.sleep(FETCH_BACKOFF * (2**attempt))
+        attempt += 1
+
+
+def _close_result(future):
+    if future.cancelled() or future.exception() is not None:
+        return
+    close = getattr(future.result(), "close", None)
+    if close:
+        close()
+
+
+class PdfPrefetcher:
+    """
+    Downloads upcoming documents in the background while the current one
+    is being signed.
+
+    Iterating yields ``(item, pdf, error)`` in the original order, where
+    ``pdf`` is whatever ``load`` returned (a FetchedPdf by default).
+    At most ``workers`` downloads run at once, and no new download is
+    started while fetched-but-unsigned documents hold more than
+    ``max_inflight_bytes``.
+
+    ``load`` turns an item into a PDF (anything with ``len()``); it
+    defaults to ``fetch_pdf`` against ``base_url``.
+    """
+
+    def __init__(
+        self,
+        items,
+        load=None,
+        workers=PREFETCH_WORKERS,
+        max_inflight_bytes=PREFETCH_MAX_INFLIGHT_BYTES,
+        base_url=None,
+    ):
+        self.items = list(items)
+        self.workers = max(1, int(workers))
+        self.max_inflight_bytes = max_inflight_bytes
+        if load is None:
+            load = lambda name: fetch_pdf(name, base_url=base_url)
+        self.load = load
+
+    def _buffered_bytes(self, pending):
+        total = 0
+        for _, future in pending:
+            if future.done() and future.exception() is None:
+                total += len(future.result())
+        return total
+
+    def __iter__(self):
+        pending = deque()
+        upcoming = iter(self.items)
+        exhausted = False
+        pool = ThreadPoolExecutor(
+            max_workers=self.workers, thread_name_prefix="pdf-prefetch"
+        )
+
+        def fill():
+            nonlocal exhausted
+            while not exhausted and len(pending) < self.workers:
+                # Always keep one download going so the signer never starves
+                if pending and self._buffered_bytes(pending) >= self.max_inflight_bytes:
+                    return
+                try:
+                    item = next(upcoming)
+                except StopIteration:
+                    exhausted = True
+                    return
+                # Copy the context so fetch logs keep the caller's request ID
+                context = contextvars.copy_context()
+                pending.append((item, pool.submit(context.run, self.load, item)))
+
+        try:
+            fill()
+            while pending:
+                item, future = pending.popleft()
+                try:
+                    pdf, error = future.result(), None
+                except Exception as e:
+                    pdf, error = None, e
+                fill()
+                yield item, pdf, error
+        finally:
+            pool.shutdown(wait=False, cancel_futures=True)
+            # Drop spooled files of documents that were never consumed,
+            # including downloads still running (the callback fires when
+            # they finish, or now if they already have)
+            for _, future in pending:
+                future.add_done_callback(_close_result)
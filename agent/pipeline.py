@@ -0,0 +1,337 @@
+# agent/pipeline.py
+import contextvars
+import datetime
+import io
+import multiprocessing
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from cryptography import x509
+
+from .config import PKCS11_PATH, PREPARE_WORKERS
+from .metrics import DOCUMENTS_SIGNED, SIGNED_STORE, stage
+
+# Only these certificate fields are drawn on the stamp; the rest of
+# cert_info (e.g. the parsed certificate object) does not cross processes
+STAMP_FIELDS = ("subject_cn", "serial_number", "not_after", "thumbprint")
+
+# Process pools by worker count
+_POOLS = {}
+_POOL_LOCK = threading.Lock()
+_WORKER_MANAGER = None
+
+
+def get_prepare_pool(workers=PREPARE_WORKERS):
+    """
+    Process pool of ``workers`` processes (at least one) rendering overlay
+    documents, started on first use. Spawned rather than forked so workers
+    never inherit the PKCS#11 library state of the agent process.
+    """
+    workers = max(1, workers)
+    with _POOL_LOCK:
+        pool = _POOLS.get(workers)
+        if pool is None:
+            pool = _POOLS[workers] = ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return pool
+
+
+def shutdown_prepare_pool():
+    with _POOL_LOCK:
+        for pool in _POOLS.values():
+            pool.shutdown(wait=False, cancel_futures=True)
+        _POOLS.clear()
+
+
+def timed(fn, *args, **kwargs):
+    """(result of ``fn``, seconds it took)"""
+    started = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, time.perf_counter() - started
+
+
+def prepare_overlay(source, stamp_info, signing_time, signature_size):
+    """
+    Runs in a worker process: stamp page 1 and write the document with a
+    random placeholder where the signature hex goes. Returns the prepared
+    bytes, the offset of the placeholder and the seconds it took.
+    """
+    global _WORKER_MANAGER
+    from .pkcs11_utils import PKCS11Manager
+
+    started = time.perf_counter()
+
+    if _WORKER_MANAGER is None:
+        # Only the stamp helpers are used; the PKCS#11 library is not loaded
+        _WORKER_MANAGER = PKCS11Manager(PKCS11_PATH)
+
+    placeholder = os.urandom(signature_size)
+    output = io.BytesIO()
+    if not _WORKER_MANAGER.add_visible_signature(
+        source, output, stamp_info, placeholder, None, signing_time
+    ):
+        raise Exception("PDF signing failed")
+
+    prepared = output.getvalue()
+    offset = prepared.index(placeholder.hex().encode("ascii"))
+    return prepared, offset, time.perf_counter() - started
+
+
+class TokenLanes:
+    """
+    One signing thread per (serial, thumbprint) in ``tokens``. Document
+    ``i`` of a batch goes to lane ``i % len(tokens)``, so each token signs
+    its share in order while the other tokens work in parallel.
+    """
+
+    def __init__(self, tokens):
+        self.tokens = list(tokens)
+        self._executors = [
+            ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"token-{serial}")
+            for serial, _ in self.tokens
+        ]
+
+    def __len__(self):
+        return len(self.tokens)
+
+    def lane(self, index):
+        return index % len(self.tokens)
+
+    def submit(self, index, fn, *args, **kwargs):
+        context = contextvars.copy_context()
+        return self._executors[self.lane(index)].submit(
+            context.run, fn, *args, **kwargs
+        )
+
+    def shutdown(self):
+        for executor in self._executors:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+def sign_on_tokens(manager, pin, prefetched, tokens, signing_mode=None, save=None):
+    """
+    Sign each document entirely in this process, spread over the
+    logged-in (serial, thumbprint) ``tokens``. Yields (item, signed bytes,
+    error, signing seconds) in order, like OverlayPipeline.run.
+    """
+    lanes = TokenLanes(tokens)
+    pending = deque()
+    upcoming = enumerate(prefetched)
+
+    def fill():
+        while len(pending) < 2 * len(lanes):
+            try:
+                index, (item, source_pdf, error) = next(upcoming)
+            except StopIteration:
+                return
+            future = None
+            if error is None:
+                serial, thumbprint = lanes.tokens[lanes.lane(index)]
+                future = lanes.submit(
+                    index,
+                    timed,
+                    manager.sign_pdf_bytes,
+                    source_pdf.source,
+                    pin,
+                    mode=signing_mode,
+                    pdf_hash=source_pdf.sha256,
+                    serial=serial,
+                    thumbprint=thumbprint,
+                    save=save,
+                )
+            pending.append((item, source_pdf, error, future))
+
+    try:
+        fill()
+        while pending:
+            item, source_pdf, error, future = pending.popleft()
+            if error is not None:
+                fill()
+                yield item, None, error, 0.0
+                continue
+            signed, seconds = None, 0.0
+            try:
+                signed, seconds = future.result()
+            except Exception as e:
+                error = e
+            finally:
+                source_pdf.close()
+            fill()
+            yield item, signed, error, seconds
+    finally:
+        lanes.shutdown()
+        for _, source_pdf, _, future in pending:
+            if future is not None:
+                future.cancel()
+            if source_pdf is not None:
+                source_pdf.close()
+
+
+class OverlayPipeline:
+    """
+    Overlay-mode bulk signing split across processes.
+
+    Worker processes render the stamp, merge it and write upcoming
+    documents (the CPU-bound part), while each token's signing thread runs
+    C_Sign over the documents' hashes in order; the signature is then
+    patched into the prepared bytes. With several (serial, thumbprint)
+    ``tokens`` the documents are spread over those tokens. With ``save``
+    False the results are not added to the signed store.
+    """
+
+    def __init__(self, manager, pin, tokens=None, workers=PREPARE_WORKERS, save=None):
+        self.manager = manager
+        self.pin = pin
+        self.tokens = tokens
+        self.save = save
+        self.workers = max(1, workers)
+
+    def _credentials(self, serial, thumbprint):
+        from .pkcs11_utils import certificate_thumbprint
+
+        key, cert_data, cert_info = self.manager.get_token_credentials(
+            self.pin, serial=serial, thumbprint=thumbprint
+        )
+        public_key = x509.load_der_x509_certificate(cert_data).public_key()
+        return {
+            "key": key,
+            "cert_data": cert_data,
+            "cert_info": cert_info,
+            "thumbprint": certificate_thumbprint(cert_data),
+            "stamp_info": {field: cert_info.get(field) for field in STAMP_FIELDS},
+            "signature_size": (public_key.key_size + 7) // 8,
+        }
+
+    def run(self, prefetched):
+        """
+        ``prefetched`` yields (item, FetchedPdf, error) as PdfPrefetcher
+        does. Yields (item, signed PDF bytes, error, seconds) in the same
+        order; seconds is the document's own signing work (render, C_Sign
+        and merge), not the time it spent queued behind other documents.
+        """
+        from .signed_store import get_signed_store
+
+        tokens = self.tokens or [(None, None)]
+        credentials = [self._credentials(*token) for token in tokens]
+        store = get_signed_store()
+
+        pool = get_prepare_pool(self.workers)
+        lanes = TokenLanes(tokens)
+        pending = deque()
+        upcoming = enumerate(prefetched)
+
+        def fill():
+            while len(pending) <= self.workers + len(lanes):
+                try:
+                    index, (item, source_pdf, error) = next(upcoming)
+                except StopIteration:
+                    return
+                job = None
+                if error is None:
+                    creds = credentials[lanes.lane(index)]
+                    stored = None
+                    if store is not None:
+                        stored = store.get(
+                            source_pdf.sha256, creds["thumbprint"], "overlay"
+                        )
+                        SIGNED_STORE.inc(result="miss" if stored is None else "hit")
+                    if stored is not None:
+                        pending.append((item, source_pdf, error, {"stored": stored}))
+                        continue
+                    signing_time = datetime.datetime.now()
+                    job = {
+                        "creds": creds,
+                        "signing_time": signing_time,
+                        "prepared": pool.submit(
+                            prepare_overlay,
+                            source_pdf.source,
+                            creds["stamp_info"],
+                            signing_time,
+                            creds["signature_size"],
+                        ),
+                        "signature": lanes.submit(
+                            index,
+                            timed,
+                            self.manager.sign_with_key,
+                            creds["key"],
+                            source_pdf.sha256,
+                        ),
+                    }
+                pending.append((item, source_pdf, error, job))
+
+        try:
+            fill()
+            while pending:
+                item, source_pdf, error, job = pending.popleft()
+                fill()
+                if error is not None:
+                    yield item, None, error, 0.0
+                    continue
+                try:
+                    signed, seconds = self._finish(source_pdf, job)
+                except Exception as e:
+                    yield item, None, e, 0.0
+                else:
+                    if (
+                        store is not None
+                        and self.save is not False
+                        and "stored" not in job
+                    ):
+                        store.put(
+                            source_pdf.sha256,
+                            job["creds"]["thumbprint"],
+                            "overlay",
+                            signed,
+                        )
+                    yield item, signed, None, seconds
+                finally:
+                    source_pdf.close()
+        finally:
+            lanes.shutdown()
+            for _, source_pdf, _, job in pending:
+                if job is not None and "stored" not in job:
+                    job["prepared"].cancel()
+                    job["signature"].cancel()
+                if source_pdf is not None:
+                    source_pdf.close()
+
+    def _finish(self, source_pdf, job):
+        """Signed bytes of a document and the seconds spent signing it"""
+        if "stored" in job:
+            return job["stored"], 0.0
+        creds = job["creds"]
+        # Time blocked on the token vs. on the worker processes shows which
+        # side a bulk run is waiting for
+        with stage("sign_wait"):
+            signature, sign_seconds = job["signature"].result()
+        with stage("prepare_wait"):
+            prepared, offset, prepare_seconds = job["prepared"].result()
+        size = creds["signature_size"]
+
+        merge_started = time.perf_counter()
+        if len(signature) == size:
+            signed = bytearray(prepared)
+            signed[offset : offset + 2 * size] = signature.hex().encode("ascii")
+            DOCUMENTS_SIGNED.inc(kind="overlay")
+            merge_seconds = time.perf_counter() - merge_started
+            return bytes(signed), prepare_seconds + sign_seconds + merge_seconds
+
+        # Unexpected length, render again in this process
+        output = io.BytesIO()
+        if not self.manager.add_visible_signature(
+            source_pdf.source,
+            output,
+            creds["cert_info"],
+            signature,
+            creds["cert_data"],
+            job["signing_time"],
+        ):
+            raise Exception("PDF signing failed")
+        DOCUMENTS_SIGNED.inc(kind="overlay")
+        merge_seconds = time.perf_counter() - merge_started
+        return output.getvalue(), prepare_seconds + sign_seconds + merge_seconds
@@ -1,10 +1,19 @@
 import os
 import io
 import sys
+import hmac
+import time
+import mmap
+import hashlib
+import logging
 import datetime
-import traceback
+import threading
 import pkcs11
-from PyPDF2 import PdfReader, PdfWriter
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import BinaryIO
+from PyPDF2 import PageObject, PdfReader, PdfWriter
+from PyPDF2.generic import DecodedStreamObject, NameObject
 from reportlab.pdfgen import canvas
 from reportlab.lib.pagesizes import letter
 from reportlab.lib.colors import Color
@@ -12,11 +21,390 @@ from reportlab.lib.utils import ImageReader
 from cryptography.hazmat.primitives import hashes
 from cryptography.hazmat.backends import default_backend
 from cryptography import x509
-from .config import IMAGES_DIR
+from .config import IMAGES_DIR, PKCS11_PATH, SESSION_IDLE_TIMEOUT, SIGNING_MODE
+from .token_monitor import TokenMonitor, describe_token
+from .token_objects import SessionObjectIndex
+from .metrics import DOCUMENTS_SIGNED, SIGNED_STORE, stage
+from .storage import write_atomic
+
+log = logging.getLogger(__name__)
+
+
+# ------------------------------------------------------------------------------
+# PROCESS-WIDE PKCS#11 STATE
+# ------------------------------------------------------------------------------
+
+_LIBS = {}
+_LIBS_LOCK = threading.Lock()
+
+# Random per-process key so PIN digests kept in memory can't be brute-forced
+_PIN_DIGEST_KEY = os.urandom(32)
+
+# PKCS#11 errors that mean the token (or our session on it) is gone
+TOKEN_GONE_ERRORS = (
+    pkcs11.exceptions.TokenNotPresent,
+    pkcs11.exceptions.DeviceRemoved,
+    pkcs11.exceptions.SessionClosed,
+    pkcs11.exceptions.SessionHandleInvalid,
+    pkcs11.exceptions.UserNotLoggedIn,
+)
+
+# PKCS#11 login errors that retrying the same PIN would only make worse
+PIN_REJECTED_ERRORS = (
+    pkcs11.exceptions.PinIncorrect,
+    pkcs11.exceptions.PinInvalid,
+    pkcs11.exceptions.PinLenRange,
+    pkcs11.exceptions.PinLocked,
+)
+
+
+def load_pkcs11_lib(pkcs11_lib_path):
+    """Load the PKCS#11 library once per process and reuse the handle"""
+    with _LIBS_LOCK:
+        lib = _LIBS.get(pkcs11_lib_path)
+        if lib is None:
+            log.debug("Loading PKCS11 library: %s", pkcs11_lib_path)
+            with stage("library_load"):
+                lib = pkcs11.lib(pkcs11_lib_path)
+            _LIBS[pkcs11_lib_path] = lib
+        return lib
+
+
+def pin_digest(pin):
+    """Keyed digest of the PIN, used to match pooled sessions"""
+    return hmac.new(
+        _PIN_DIGEST_KEY, str(pin).encode("utf-8"), hashlib.sha256
+    ).hexdigest()
+
+
+def certificate_thumbprint(cert_data):
+    """SHA-256 fingerprint of a DER certificate, as in parse_certificate_info"""
+    return hashlib.sha256(cert_data or b"").hexdigest()
+
+
+def write_output(output_pdf, data):
+    """Write ``data`` to an output path or binary stream"""
+    if isinstance(output_pdf, str):
+        write_atomic(output_pdf, data)
+    else:
+        output_pdf.write(data)
+
+
+def read_output(output_pdf):
+    """Bytes written to an output path or BytesIO, None for other streams"""
+    if isinstance(output_pdf, io.BytesIO):
+        return output_pdf.getvalue()
+    if isinstance(output_pdf, str):
+        with open(output_pdf, "rb") as f:
+            return f.read()
+    return None
+
+
+def sha256_file(path):
+    """SHA-256 of a file through a read-only memory map (no full read)"""
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return hashlib.sha256().digest()
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            return hashlib.sha256(mapped).digest()
+
+
+@contextmanager
+def pdf_buffer(input_pdf):
+    """
+    ``input_pdf`` bytes as they are, or a path as a read-only memory map,
+    so the file is not read into memory as a whole
+    """
+    if isinstance(input_pdf, bytes):
+        yield input_pdf
+        return
+    with open(input_pdf, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            yield b""
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            yield mapped
+
+
+def token_serial(token):
+    """Token serial as a printable string"""
+    serial = getattr(token, "serial", b"")
+    if isinstance(serial, bytes):
+        serial = serial.decode("ascii", "ignore")
+    return str(serial).strip()
+
+
+class PooledSession:
+    """
+    A logged-in token session, the index of its keys and certificates and
+    the credentials chosen at login (``key``, ``cert_data``, ``cert_info``)
+    """
+
+    def __init__(self, token, session, index, key, cert_data, cert_info, cert_id=""):
+        self.token = token
+        self.slot = token.slot
+        self.serial = token_serial(token)
+        self.label = str(getattr(token, "label", "Unknown")).strip()
+        self.session = session
+        self.index = index
+        self.key = key
+        self.cert_data = cert_data
+        self.cert_info = cert_info
+        self.cert_id = cert_id
+        self.thumbprint = certificate_thumbprint(cert_data)
+        self.created = time.monotonic()
+        self.last_used = self.created
+
+    def touch(self):
+        self.last_used = time.monotonic()
+
+    def idle_for(self):
+        return time.monotonic() - self.last_used
+
+    def is_present(self):
+        """True while the same token is still inserted in the slot"""
+        try:
+            return token_serial(self.slot.get_token()) == self.serial
+        except Exception:
+            return False
+
+    def close(self):
+        try:
+            self.session.close()
+        except Exception:
+            pass
+
+
+class CertInfoCache:
+    """
+    Parsed certificate info keyed by (token serial, certificate CKA_ID).
+    Entries live until the token is removed or swapped for another one.
+    """
+
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, serial, cert_id):
+        with self._lock:
+            return self._entries.get((serial, cert_id))
+
+    def put(self, serial, cert_id, cert_info):
+        with self._lock:
+            self._entries[(serial, cert_id)] = cert_info
+        return cert_info
+
+    def drop_token(self, serial):
+        with self._lock:
+            for k in [k for k in self._entries if k[0] == serial]:
+                del self._entries[k]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class TokenSessionPool:
+    """
+    Logged-in sessions keyed by (token serial, PIN digest).
+    Sessions idle longer than ``idle_timeout`` seconds are logged out.
+    ``on_token_removed(serial)`` is called when a token is found unplugged.
+    ``is_present(entry)`` decides whether a pooled token is still inserted;
+    by default the slot is asked directly.
+    """
+
+    def __init__(
+        self,
+        idle_timeout=SESSION_IDLE_TIMEOUT,
+        on_token_removed=None,
+        is_present=None,
+    ):
+        self.idle_timeout = idle_timeout
+        self.on_token_removed = on_token_removed
+        self.is_present = is_present or (lambda entry: entry.is_present())
+        self._entries = {}
+        self._lock = threading.RLock()
+        self._reaper = None
+
+    def get(self, pin_hash, serial=None, thumbprint=None):
+        """
+        Return a live pooled session for this PIN, or None. ``serial`` and
+        ``thumbprint`` restrict the match to one token or certificate.
+        """
+        self.close_idle()
+        with self._lock:
+            for (entry_serial, entry_pin), entry in list(self._entries.items()):
+                if entry_pin != pin_hash:
+                    continue
+                if serial and entry_serial != serial:
+                    continue
+                if thumbprint and not entry.index.has_certificate(thumbprint):
+                    continue
+                if not self.is_present(entry):
+                    self.token_removed(entry_serial)
+                    continue
+                entry.touch()
+                return entry
+        return None
+
+    def put(self, pin_hash, entry):
+        with self._lock:
+            old = self._entries.pop((entry.serial, pin_hash), None)
+            if old is not None and old is not entry:
+                old.close()
+            self._entries[(entry.serial, pin_hash)] = entry
+        self._start_reaper()
+        return entry
+
+    def drop(self, entry):
+        """Log out and forget a single pooled session"""
+        with self._lock:
+            for k, v in list(self._entries.items()):
+                if v is entry:
+                    del self._entries[k]
+        entry.close()
+
+    def find_key(self, key):
+        """The pooled session a private key handle belongs to, or None"""
+        with self._lock:
+            for entry in self._entries.values():
+                if entry.key is key or entry.index.owns(key):
+                    return entry
+        return None
+
+    def token_removed(self, serial):
+        """The token was unplugged or swapped: forget everything about it"""
+        log.debug("Token %s removed, dropping its session", serial)
+        self.drop_token(serial)
+        if self.on_token_removed is not None:
+            self.on_token_removed(serial)
+
+    def drop_token(self, serial):
+        """Forget every session on a token (e.g. after it was unplugged)"""
+        with self._lock:
+            for k in [k for k in self._entries if k[0] == serial]:
+                self._entries.pop(k).close()
+
+    def close_idle(self):
+        with self._lock:
+            for k, entry in list(self._entries.items()):
+                if entry.idle_for() > self.idle_timeout:
+                    log.debug("Session on token %s idle, logging out", k[0])
+                    del self._entries[k]
+                    entry.close()
+
+    def close_all(self):
+        with self._lock:
+            for entry in self._entries.values():
+                entry.close()
+            self._entries.clear()
+
+    def _start_reaper(self):
+        if self._reaper is not None and self._reaper.is_alive():
+            return
+        self._reaper = threading.Thread(
+            target=self._reap_loop, name="pkcs11-session-reaper", daemon=True
+        )
+        self._reaper.start()
+
+    def _reap_loop(self):
+        interval = max(1.0, self.idle_timeout / 4.0)
+        while True:
+            time.sleep(interval)
+            self.close_idle()
+            with self._lock:
+                if not self._entries:
+                    self._reaper = None
+                    return
+
+
+# Signature stamp templates keyed by certificate (see get_stamp_template)
+STAMP_CACHE_SIZE = 16
+STAMP_TIME_PLACEHOLDER = "YYYY-MM-DD HH:MM:SS"
+STAMP_TIME_PLACEHOLDER_BYTES = STAMP_TIME_PLACEHOLDER.encode("latin-1")
+_STAMP_CACHE = OrderedDict()
+_STAMP_LOCK = threading.Lock()
+
+_SEAL = {}
+_SEAL_LOCK = threading.Lock()
+
+
+def _seal_path():
+    # Caller holds _SEAL_LOCK
+    if "path" not in _SEAL:
+        _SEAL["path"] = _find_seal_image()
+    return _SEAL["path"]
+
+
+def find_seal_image():
+    """Path to seal.png in the source tree or PyInstaller bundle, or None"""
+    with _SEAL_LOCK:
+        return _seal_path()
+
+
+def get_seal_image():
+    """seal.png as a reportlab ImageReader, decoded once per process"""
+    with _SEAL_LOCK:
+        if "reader" not in _SEAL:
+            path = _seal_path()
+            _SEAL["reader"] = ImageReader(path) if path else None
+        return _SEAL["reader"]
+
+
+def get_seal_pil_image():
+    """seal.png as a loaded PIL image for the incremental signature widget"""
+    with _SEAL_LOCK:
+        if "pil" not in _SEAL:
+            from PIL import Image
+
+            path = _seal_path()
+            image = None
+            if path:
+                image = Image.open(path)
+                image.load()
+            _SEAL["pil"] = image
+        return _SEAL["pil"]
+
+
+def _find_seal_image():
+    # Try multiple locations for seal.png
+    seal_paths = [
+        os.path.join(IMAGES_DIR, "seal.png"),  # common/images/seal.png
+        "seal.png",  # root directory
+    ]
+
+    # For PyInstaller bundled executable
+    base_path = getattr(sys, "_MEIPASS", "")
+    if base_path:
+        seal_paths += [
+            os.path.join(base_path, "agent", "seal.png"),
+            os.path.join(base_path, "common", "images", "seal.png"),
+            os.path.join(base_path, "seal.png"),
+        ]
+
+    for path in seal_paths:
+        if os.path.exists(path):
+            log.debug("Found seal image at: %s", path)
+            return path
+    return None
+
+
+_MANAGER = None
+_MANAGER_LOCK = threading.Lock()
+
+
+def get_manager(pkcs11_lib_path=None):
+    """Process-wide PKCS11Manager shared by all API requests"""
+    global _MANAGER
+    with _MANAGER_LOCK:
+        if _MANAGER is None:
+            _MANAGER = PKCS11Manager(pkcs11_lib_path or PKCS11_PATH)
+            _MANAGER.start_monitor()
+        return _MANAGER
 
 
 class PKCS11Manager:
-    def __init__(self, pkcs11_lib_path: str):
+    def __init__(self, pkcs11_lib_path: str, idle_timeout=SESSION_IDLE_TIMEOUT):
         """
         Initialize PKCS#11 Manager with the path to the PKCS#11 library.
         Example: 'C:\\Windows\\System32\\Watchdata\\PROXKey CSP India V3.0\\wdpkcs.dll'
@@ -24,132 +412,91 @@ class PKCS11Manager:
         self.pkcs11_lib_path = pkcs11_lib_path
         self.lib = None
         self.session = None
+        self.cert_cache = CertInfoCache()
+        self.sessions = TokenSessionPool(
+            idle_timeout,
+            on_token_removed=self._token_removed,
+            is_present=self._pooled_token_present,
+        )
+        self.monitor = None
+        # Read from the HTTP worker threads and cleared by the monitor thread
+        self._public_certs = {}
+        self._public_certs_lock = threading.Lock()
+        # (serial, PIN digest) pairs a token refused, never retried by
+        # signing_tokens until the token is removed
+        self._rejected_pins = set()
+        self._rejected_lock = threading.Lock()
+        self._token_locks = {}
+        self._token_locks_lock = threading.Lock()
+
+    def load_library(self):
+        """Load (or reuse) the process-wide PKCS#11 library handle"""
+        if self.lib is None:
+            self.lib = load_pkcs11_lib(self.pkcs11_lib_path)
+        return self.lib
+
+    def start_monitor(self):
+        """Start the background hot-plug monitor (loads the library once)"""
+        if self.monitor is None:
+            self.monitor = TokenMonitor(
+                self.load_library, on_removed=self.sessions.token_removed
+            )
+            self.monitor.start()
+        return self.monitor
 
-        # --------------------------------------------------------------------------
-        # CERTIFICATE HANDLING
-        # --------------------------------------------------------------------------
+    def present_tokens(self):
+        """Tokens seen by the monitor, or None while it has no view yet"""
+        if self.monitor is None or not self.monitor.ready:
+            return None
+        return self.monitor.snapshot()
 
-    def get_token_credentials(self, pin, cert_info_only=False):
+    def token_lock(self, serial):
         """
-        Opens a PKCS#11 session using the provided PIN and retrieves the
-        private key, raw certificate data, and parsed certificate info.
-        This method is called by the Flask API.
+        Lock serializing logins and C_Sign on one token. HTTP requests run
+        in parallel; only the ones that need the same token wait here.
         """
-        try:
-            print(
-                f"[DEBUG] get_token_credentials called with pin: {pin}, cert_info_only: {cert_info_only}"
-            )
-
-            # Initialize PKCS11 library
-            print(f"[DEBUG] Initializing PKCS11 library: {self.pkcs11_lib_path}")
-            self.lib = pkcs11.lib(self.pkcs11_lib_path)
-
-            # Find slots with tokens
-            slots = list(self.lib.get_slots())
-            print(f"[DEBUG] Found {len(slots)} slots")
-
-            tokens = []
-            for i, slot in enumerate(slots):
-                try:
-                    token = slot.get_token()
-                    tokens.append(token)
-                    print(f"[DEBUG] ✓ Token found in slot {i}: {token.label}")
-                except Exception as e:
-                    print(f"[DEBUG]   Slot {i} - No token: {e}")
-                    continue
-
-            if not tokens:
-                raise Exception(
-                    "No tokens found in any slot. Please insert your digital signature token."
-                )
-
-            # Use the first token found
-            token = tokens[0]
-            print(f"[DEBUG] Using token: {token.label}")
-
-            # Open session with the token
-            print(f"[DEBUG] Opening session with PIN...")
-            self.session = token.open(user_pin=pin, rw=True)
-            print(f"[DEBUG] Session opened successfully")
-
-            # Find certificates
-            print(f"[DEBUG] Searching for certificates...")
-            certificates = list(
-                self.session.get_objects(
-                    {
-                        pkcs11.constants.Attribute.CLASS: pkcs11.constants.ObjectClass.CERTIFICATE
-                    }
-                )
-            )
-            print(f"[DEBUG] Found {len(certificates)} certificate(s)")
-
-            if not certificates:
-                raise Exception("No certificates found in token")
-
-            # Use the first certificate
-            certificate = certificates[0]
-            print(f"[DEBUG] Getting certificate data...")
-            cert_data = certificate[pkcs11.constants.Attribute.VALUE]
-            print(f"[DEBUG] Certificate data retrieved, length: {len(cert_data)}")
-
-            # Parse certificate info
-            cert_info = self.parse_certificate_info(cert_data)
-            print(f"[DEBUG] Certificate info parsed successfully")
-
-            # Find private key (only if needed for signing)
-            key = None
-            if not cert_info_only:
-                print(f"[DEBUG] Searching for private keys...")
-                private_keys = list(
-                    self.session.get_objects(
-                        {
-                            pkcs11.constants.Attribute.CLASS: pkcs11.constants.ObjectClass.PRIVATE_KEY
-                        }
-                    )
-                )
-                print(f"[DEBUG] Found {len(private_keys)} private key(s)")
-
-                if private_keys:
-                    key = private_keys[0]
-                    print(f"[DEBUG] Using private key for signing")
-                else:
-                    print(f"[DEBUG] No private keys found")
+        with self._token_locks_lock:
+            lock = self._token_locks.get(serial)
+            if lock is None:
+                lock = self._token_locks[serial] = threading.RLock()
+            return lock
+
+    def _token_removed(self, serial):
+        self.cert_cache.drop_token(serial)
+        with self._public_certs_lock:
+            self._public_certs.pop(serial, None)
+        with self._rejected_lock:
+            self._rejected_pins = {
+                entry for entry in self._rejected_pins if entry[0] != serial
+            }
 
-            # Close session if only cert info is needed
-            if cert_info_only and self.session:
-                print(f"[DEBUG] Closing session (cert_info_only=True)")
-                self.session.close()
-                self.session = None
-            else:
-                print(f"[DEBUG] Keeping session open for signing")
+    def _pooled_token_present(self, entry):
+        if self.monitor is not None and self.monitor.ready:
+            return self.monitor.is_present(entry.serial)
+        return entry.is_present()
 
-            print(f"[DEBUG] get_token_credentials completed successfully")
-            return key, cert_data, cert_info
+    def logout(self):
+        """Log out of every pooled token session"""
+        self.sessions.close_all()
+        self.session = None
 
-        except Exception as e:
-            print(f"[DEBUG] get_token_credentials error: {e}")
-            print(f"[DEBUG] Traceback: {traceback.format_exc()}")
-            # Close session on error
-            if self.session:
-                try:
-                    self.session.close()
-                    self.session = None
-                    print(f"[DEBUG] Session closed due to error")
-                except Exception as close_error:
-                    print(f"[DEBUG] Error closing session: {close_error}")
-            raise
+        # --------------------------------------------------------------------------
+        # CERTIFICATE HANDLING
+        # --------------------------------------------------------------------------
 
     def parse_certificate_info(self, cert_data):
         """Extract certificate information from DER encoded certificate - ULTRA SAFE VERSION"""
         try:
-            print(
-                f"[DEBUG] parse_certificate_info: Starting with cert_data type: {type(cert_data)}, length: {len(cert_data) if cert_data else 0}"
+            log.debug(
+                "parse_certificate_info: Starting with cert_data type: %s, length: %s",
+                type(cert_data),
+                len(cert_data) if cert_data else 0,
             )
 
             # Check if cert_data is valid
             if not cert_data:
-                print(
-                    f"[DEBUG] parse_certificate_info: ERROR - cert_data is None or empty!"
+                log.warning(
+                    "parse_certificate_info: ERROR - cert_data is None or empty!"
                 )
                 now = datetime.datetime.now()
                 safe_result = {
@@ -161,82 +508,94 @@ class PKCS11Manager:
                     "thumbprint": "N/A",
                     "certificate": None,
                 }
-                print(
-                    f"[DEBUG] parse_certificate_info: Returning safe fallback: {safe_result}"
+                log.debug(
+                    "parse_certificate_info: Returning safe fallback: %s", safe_result
                 )
                 return safe_result
 
-            print(f"[DEBUG] parse_certificate_info: Attempting to load certificate...")
+            log.debug("parse_certificate_info: Attempting to load certificate...")
             certificate = x509.load_der_x509_certificate(cert_data, default_backend())
-            print(f"[DEBUG] parse_certificate_info: Certificate loaded successfully")
+            log.debug("parse_certificate_info: Certificate loaded successfully")
 
             # SAFELY extract subject CN - with maximum error handling
             subject_cn = "Unknown Subject"
             try:
-                print(f"[DEBUG] parse_certificate_info: Extracting subject...")
+                log.debug("parse_certificate_info: Extracting subject...")
                 subject_attrs = list(certificate.subject)
-                print(
-                    f"[DEBUG] parse_certificate_info: Subject attributes count: {len(subject_attrs)}"
+                log.debug(
+                    "parse_certificate_info: Subject attributes count: %s",
+                    len(subject_attrs),
                 )
 
                 for i, attr in enumerate(subject_attrs):
-                    print(
-                        f"[DEBUG] parse_certificate_info: Subject attr {i}: {attr.oid} = {attr.value}"
+                    log.debug(
+                        "parse_certificate_info: Subject attr %s: %s = %s",
+                        i,
+                        attr.oid,
+                        attr.value,
                     )
                     if attr.oid == x509.NameOID.COMMON_NAME:
                         cn_value = attr.value
-                        print(
-                            f"[DEBUG] parse_certificate_info: Found CN: {cn_value} (type: {type(cn_value)})"
+                        log.debug(
+                            "parse_certificate_info: Found CN: %s (type: %s)",
+                            cn_value,
+                            type(cn_value),
                         )
 
                         # ULTRA SAFE conversion to string
                         if cn_value is None:
                             subject_cn = "No Common Name"
-                            print(f"[DEBUG] parse_certificate_info: CN value is None")
+                            log.debug("parse_certificate_info: CN value is None")
                         else:
                             try:
                                 subject_cn = str(cn_value)
-                                print(
-                                    f"[DEBUG] parse_certificate_info: CN converted to string: {subject_cn}"
+                                log.debug(
+                                    "parse_certificate_info: CN converted to string: %s",
+                                    subject_cn,
                                 )
                             except Exception as str_error:
-                                print(
-                                    f"[DEBUG] parse_certificate_info: Error converting CN to string: {str_error}"
+                                log.warning(
+                                    "parse_certificate_info: Error converting CN to string: %s",
+                                    str_error,
                                 )
                                 subject_cn = "Error Converting CN"
                         break
                 else:
                     subject_cn = "No Common Name Found"
-                    print(
-                        f"[DEBUG] parse_certificate_info: No CN found in subject attributes"
+                    log.debug(
+                        "parse_certificate_info: No CN found in subject attributes"
                     )
 
             except Exception as e:
-                print(
-                    f"[DEBUG] parse_certificate_info: CRITICAL ERROR extracting subject: {e}"
-                )
-                print(
-                    f"[DEBUG] parse_certificate_info: Subject traceback: {traceback.format_exc()}"
+                log.warning(
+                    "parse_certificate_info: CRITICAL ERROR extracting subject: %s", e
                 )
+                log.debug("parse_certificate_info: Subject traceback", exc_info=True)
                 subject_cn = "Error Reading Subject"
 
             # SAFELY extract issuer CN
             issuer_cn = "Unknown Issuer"
             try:
-                print(f"[DEBUG] parse_certificate_info: Extracting issuer...")
+                log.debug("parse_certificate_info: Extracting issuer...")
                 issuer_attrs = list(certificate.issuer)
-                print(
-                    f"[DEBUG] parse_certificate_info: Issuer attributes count: {len(issuer_attrs)}"
+                log.debug(
+                    "parse_certificate_info: Issuer attributes count: %s",
+                    len(issuer_attrs),
                 )
 
                 for i, attr in enumerate(issuer_attrs):
-                    print(
-                        f"[DEBUG] parse_certificate_info: Issuer attr {i}: {attr.oid} = {attr.value}"
+                    log.debug(
+                        "parse_certificate_info: Issuer attr %s: %s = %s",
+                        i,
+                        attr.oid,
+                        attr.value,
                     )
                     if attr.oid == x509.NameOID.COMMON_NAME:
                         cn_value = attr.value
-                        print(
-                            f"[DEBUG] parse_certificate_info: Found issuer CN: {cn_value} (type: {type(cn_value)})"
+                        log.debug(
+                            "parse_certificate_info: Found issuer CN: %s (type: %s)",
+                            cn_value,
+                            type(cn_value),
                         )
 
                         # ULTRA SAFE conversion to string
@@ -246,50 +605,55 @@ class PKCS11Manager:
                             try:
                                 issuer_cn = str(cn_value)
                             except Exception as str_error:
-                                print(
-                                    f"[DEBUG] parse_certificate_info: Error converting issuer CN: {str_error}"
+                                log.warning(
+                                    "parse_certificate_info: Error converting issuer CN: %s",
+                                    str_error,
                                 )
                                 issuer_cn = "Error Converting Issuer CN"
                         break
                 else:
                     issuer_cn = "No Issuer CN Found"
-                    print(
-                        f"[DEBUG] parse_certificate_info: No CN found in issuer attributes"
+                    log.debug(
+                        "parse_certificate_info: No CN found in issuer attributes"
                     )
 
             except Exception as e:
-                print(
-                    f"[DEBUG] parse_certificate_info: CRITICAL ERROR extracting issuer: {e}"
+                log.warning(
+                    "parse_certificate_info: CRITICAL ERROR extracting issuer: %s", e
                 )
                 issuer_cn = "Error Reading Issuer"
 
             # SAFELY handle serial number - PREVENT None FORMATTING
             serial_number = "N/A"
             try:
-                print(f"[DEBUG] parse_certificate_info: Extracting serial number...")
+                log.debug("parse_certificate_info: Extracting serial number...")
                 serial_obj = certificate.serial_number
-                print(
-                    f"[DEBUG] parse_certificate_info: Serial object: {serial_obj} (type: {type(serial_obj)})"
+                log.debug(
+                    "parse_certificate_info: Serial object: %s (type: %s)",
+                    serial_obj,
+                    type(serial_obj),
                 )
 
                 if serial_obj is None:
                     serial_number = "No Serial Number"
-                    print(f"[DEBUG] parse_certificate_info: Serial number is None")
+                    log.debug("parse_certificate_info: Serial number is None")
                 else:
                     try:
                         serial_number = str(serial_obj)
-                        print(
-                            f"[DEBUG] parse_certificate_info: Serial converted to string: {serial_number}"
+                        log.debug(
+                            "parse_certificate_info: Serial converted to string: %s",
+                            serial_number,
                         )
                     except Exception as str_error:
-                        print(
-                            f"[DEBUG] parse_certificate_info: Error converting serial to string: {str_error}"
+                        log.warning(
+                            "parse_certificate_info: Error converting serial to string: %s",
+                            str_error,
                         )
                         serial_number = "Error Converting Serial"
 
             except Exception as e:
-                print(
-                    f"[DEBUG] parse_certificate_info: CRITICAL ERROR with serial number: {e}"
+                log.warning(
+                    "parse_certificate_info: CRITICAL ERROR with serial number: %s", e
                 )
                 serial_number = "Error Reading Serial"
 
@@ -298,62 +662,62 @@ class PKCS11Manager:
             not_before = now
             not_after = now
             try:
-                print(f"[DEBUG] parse_certificate_info: Extracting dates...")
+                log.debug("parse_certificate_info: Extracting dates...")
                 if (
                     hasattr(certificate, "not_valid_before_utc")
                     and certificate.not_valid_before_utc
                 ):
                     not_before = certificate.not_valid_before_utc.replace(tzinfo=None)
-                    print(f"[DEBUG] parse_certificate_info: not_before: {not_before}")
+                    log.debug("parse_certificate_info: not_before: %s", not_before)
                 elif (
                     hasattr(certificate, "not_valid_before")
                     and certificate.not_valid_before
                 ):
                     not_before = certificate.not_valid_before.replace(tzinfo=None)
-                    print(
-                        f"[DEBUG] parse_certificate_info: not_before (legacy): {not_before}"
+                    log.debug(
+                        "parse_certificate_info: not_before (legacy): %s", not_before
                     )
                 else:
-                    print(f"[DEBUG] parse_certificate_info: No not_before date found")
+                    log.debug("parse_certificate_info: No not_before date found")
 
                 if (
                     hasattr(certificate, "not_valid_after_utc")
                     and certificate.not_valid_after_utc
                 ):
                     not_after = certificate.not_valid_after_utc.replace(tzinfo=None)
-                    print(f"[DEBUG] parse_certificate_info: not_after: {not_after}")
+                    log.debug("parse_certificate_info: not_after: %s", not_after)
                 elif (
                     hasattr(certificate, "not_valid_after")
                     and certificate.not_valid_after
                 ):
                     not_after = certificate.not_valid_after.replace(tzinfo=None)
-                    print(
-                        f"[DEBUG] parse_certificate_info: not_after (legacy): {not_after}"
+                    log.debug(
+                        "parse_certificate_info: not_after (legacy): %s", not_after
                     )
                 else:
-                    print(f"[DEBUG] parse_certificate_info: No not_after date found")
+                    log.debug("parse_certificate_info: No not_after date found")
 
             except Exception as e:
-                print(f"[DEBUG] parse_certificate_info: CRITICAL ERROR with dates: {e}")
+                log.warning("parse_certificate_info: CRITICAL ERROR with dates: %s", e)
                 # Keep default dates
 
             # SAFELY handle thumbprint - PREVENT None FORMATTING
             thumbprint = "N/A"
             try:
-                print(f"[DEBUG] parse_certificate_info: Calculating thumbprint...")
+                log.debug("parse_certificate_info: Calculating thumbprint...")
                 if certificate:
                     thumbprint_bytes = certificate.fingerprint(hashes.SHA256())
                     thumbprint = thumbprint_bytes.hex()
-                    print(
-                        f"[DEBUG] parse_certificate_info: Thumbprint calculated: {thumbprint}"
+                    log.debug(
+                        "parse_certificate_info: Thumbprint calculated: %s", thumbprint
                     )
                 else:
-                    print(
-                        f"[DEBUG] parse_certificate_info: Certificate object is None, cannot calculate thumbprint"
+                    log.debug(
+                        "parse_certificate_info: Certificate object is None, cannot calculate thumbprint",
                     )
             except Exception as e:
-                print(
-                    f"[DEBUG] parse_certificate_info: CRITICAL ERROR with thumbprint: {e}"
+                log.warning(
+                    "parse_certificate_info: CRITICAL ERROR with thumbprint: %s", e
                 )
                 thumbprint = "Error Calculating Thumbprint"
 
@@ -376,21 +740,20 @@ class PKCS11Manager:
                 "certificate": certificate,
             }
 
-            print(f"[DEBUG] parse_certificate_info: Final result:")
-            for key, value in result.items():
-                if key != "certificate":  # Skip the certificate object
-                    print(f"[DEBUG]   {key}: {value} (type: {type(value)})")
+            if log.isEnabledFor(logging.DEBUG):
+                log.debug("parse_certificate_info: Final result:")
+                for key, value in result.items():
+                    if key != "certificate":  # Skip the certificate object
+                        log.debug("  %s: %s (type: %s)", key, value, type(value))
 
-            print(f"[DEBUG] parse_certificate_info: Completed successfully")
+            log.debug("parse_certificate_info: Completed successfully")
             return result
 
         except Exception as e:
-            print(
-                f"[DEBUG] parse_certificate_info: CRITICAL ERROR in entire function: {e}"
-            )
-            print(
-                f"[DEBUG] parse_certificate_info: Full traceback: {traceback.format_exc()}"
+            log.warning(
+                "parse_certificate_info: CRITICAL ERROR in entire function: %s", e
             )
+            log.debug("parse_certificate_info: Full traceback", exc_info=True)
             now = datetime.datetime.now()
             safe_result = {
                 "subject_cn": "Certificate Parse Error",
@@ -412,133 +775,163 @@ class PKCS11Manager:
         try:
             packet = io.BytesIO()
             c = canvas.Canvas(packet, pagesize=letter)
-            page_width, page_height = letter
-
-            # Position bottom-right
-            x, y, w, h = page_width - 300, 315, 240, 120
-
-            # Seal image - FIXED PATH
-            try:
-                # Try multiple locations for seal.png
-                seal_paths = [
-                    os.path.join(IMAGES_DIR, "seal.png"),  # common/images/seal.png
-                    "seal.png",  # root directory
-                ]
-
-                image_path = None
-                for path in seal_paths:
-                    if os.path.exists(path):
-                        image_path = path
-                        print(f"[DEBUG] ✓ Found seal image at: {path}")
-                        break
-
-                # For PyInstaller bundled executable
-                if not image_path:
-                    base_path = getattr(sys, "_MEIPASS", "")
-                    if base_path:
-                        bundled_paths = [
-                            os.path.join(base_path, "agent", "seal.png"),
-                            os.path.join(base_path, "common", "images", "seal.png"),
-                            os.path.join(base_path, "seal.png"),
-                        ]
-                        for path in bundled_paths:
-                            if os.path.exists(path):
-                                image_path = path
-                                print(f"[DEBUG] ✓ Found seal image at bundled: {path}")
-                                break
-
-                if image_path and os.path.exists(image_path):
-                    c.drawImage(
-                        ImageReader(image_path),
-                        x + 180,
-                        y + h - 60,
-                        width=40,
-                        height=40,
-                        mask="auto",
-                    )
-                    print(f"[DEBUG] ✓ Seal image added to signature overlay")
-                else:
-                    print(f"[DEBUG] ✗ Seal image not found in any location")
-            except Exception as e:
-                print(f"[DEBUG] Seal image error: {e}")
-
-            # Signer info - safely handle None values
-            subject = (
-                str(cert_info.get("subject_cn", "Unknown"))[:25] + "..."
-                if len(str(cert_info.get("subject_cn", "Unknown"))) > 25
-                else str(cert_info.get("subject_cn", "Unknown"))
+            self.draw_signature_stamp(
+                c, cert_info, signing_time.strftime("%Y-%m-%d %H:%M:%S")
             )
-            serial = (
-                str(cert_info.get("serial_number", "Unknown"))[:15] + "..."
-                if len(str(cert_info.get("serial_number", "Unknown"))) > 15
-                else str(cert_info.get("serial_number", "Unknown"))
-            )
-
-            # All fields in horizontal layout with reduced vertical spacing
-            c.setFillColor(Color(0.2, 0.2, 0.2))
-
-            # Signed by - on one line with reduced vertical gap
-            c.setFont("Helvetica-Bold", 9)
-            c.drawString(x + 50, y + h - 35, "Signed by:  ")
-            c.setFont("Helvetica", 8)
-            c.drawString(x + 50 + 50, y + h - 35, subject)
-
-            # Serial No - on one line with reduced vertical gap
-            c.setFont("Helvetica-Bold", 9)
-            c.drawString(
-                x + 50, y + h - 47, "Serial No:  "
-            )  # Reduced from -50 to -47 (3px less)
-            c.setFont("Helvetica", 8)
-            c.drawString(x + 50 + 50, y + h - 47, serial)  # Reduced from -50 to -47
-
-            # Date/Time - on one line with reduced vertical gap
-            c.setFont("Helvetica-Bold", 9)
-            c.drawString(
-                x + 50, y + h - 59, "Date/Time:  "
-            )  # Reduced from -65 to -59 (6px less)
-            c.setFont("Helvetica", 7)
-            c.drawString(
-                x + 50 + 50, y + h - 59, signing_time.strftime("%Y-%m-%d %H:%M:%S")
-            )  # Reduced from -65 to -59
-
-            # Token - on one line with reduced vertical gap
-            c.setFont("Helvetica-Bold", 9)
-            c.drawString(
-                x + 50, y + h - 71, "Token:  "
-            )  # Reduced from -80 to -71 (9px less)
-            c.setFont("Helvetica", 7)
-            c.drawString(
-                x + 50 + 50, y + h - 71, "Watchdata PROXKey"
-            )  # Reduced from -80 to -71
-
-            # Validity status - positioned to the right
-            valid = (
-                cert_info.get("not_after", datetime.datetime.now())
-                > datetime.datetime.now()
-            )
-            c.setFillColor(
-                Color(0.16, 0.68, 0.32) if valid else Color(0.86, 0.08, 0.24)
-            )
-            c.setFont("Helvetica-Bold", 8)
-            c.drawString(
-                x + 180, y + h - 71, "VALID" if valid else "EXPIRED"
-            )  # Reduced from -80 to -71
-
-            # Footer - moved up significantly to reduce space
-            c.setFillColor(Color(0.6, 0.6, 0.6))
-            c.setFont("Helvetica", 6)
-            c.drawString(
-                x + 50, y + h - 83, "PKCS11 • SHA256 • SECURED"
-            )  # Changed from y + 8 to y + 5 (3px less)
-
             c.save()
             packet.seek(0)
             return packet
 
         except Exception as e:
-            print(f"[DEBUG] Error creating overlay: {e}")
+            log.warning("Error creating overlay: %s", e)
             return None
 
+    def draw_signature_stamp(self, c, cert_info, time_text):
+        """Draw the signature box on a reportlab canvas"""
+        page_width, page_height = letter
+
+        # Position bottom-right
+        x, y, w, h = page_width - 300, 315, 240, 120
+
+        # Seal image - decoded once per process
+        try:
+            seal = get_seal_image()
+            if seal is not None:
+                c.drawImage(
+                    seal,
+                    x + 180,
+                    y + h - 60,
+                    width=40,
+                    height=40,
+                    mask="auto",
+                )
+            else:
+                log.debug("Seal image not found in any location")
+        except Exception as e:
+            log.warning("Seal image error: %s", e)
+
+        # Signer info - safely handle None values
+        subject = (
+            str(cert_info.get("subject_cn", "Unknown"))[:25] + "..."
+            if len(str(cert_info.get("subject_cn", "Unknown"))) > 25
+            else str(cert_info.get("subject_cn", "Unknown"))
+        )
+        serial = (
+            str(cert_info.get("serial_number", "Unknown"))[:15] + "..."
+            if len(str(cert_info.get("serial_number", "Unknown"))) > 15
+            else str(cert_info.get("serial_number", "Unknown"))
+        )
+
+        # All fields in horizontal layout with reduced vertical spacing
+        c.setFillColor(Color(0.2, 0.2, 0.2))
+
+        # Signed by - on one line with reduced vertical gap
+        c.setFont("Helvetica-Bold", 9)
+        c.drawString(x + 50, y + h - 35, "Signed by:  ")
+        c.setFont("Helvetica", 8)
+        c.drawString(x + 50 + 50, y + h - 35, subject)
+
+        # Serial No - on one line with reduced vertical gap
+        c.setFont("Helvetica-Bold", 9)
+        c.drawString(
+            x + 50, y + h - 47, "Serial No:  "
+        )  # Reduced from -50 to -47 (3px less)
+        c.setFont("Helvetica", 8)
+        c.drawString(x + 50 + 50, y + h - 47, serial)  # Reduced from -50 to -47
+
+        # Date/Time - on one line with reduced vertical gap
+        c.setFont("Helvetica-Bold", 9)
+        c.drawString(
+            x + 50, y + h - 59, "Date/Time:  "
+        )  # Reduced from -65 to -59 (6px less)
+        c.setFont("Helvetica", 7)
+        c.drawString(x + 50 + 50, y + h - 59, time_text)  # Reduced from -65 to -59
+
+        # Token - on one line with reduced vertical gap
+        c.setFont("Helvetica-Bold", 9)
+        c.drawString(
+            x + 50, y + h - 71, "Token:  "
+        )  # Reduced from -80 to -71 (9px less)
+        c.setFont("Helvetica", 7)
+        c.drawString(
+            x + 50 + 50, y + h - 71, "Watchdata PROXKey"
+        )  # Reduced from -80 to -71
+
+        # Validity status - positioned to the right
+        valid = (
+            cert_info.get("not_after", datetime.datetime.now())
+            > datetime.datetime.now()
+        )
+        c.setFillColor(Color(0.16, 0.68, 0.32) if valid else Color(0.86, 0.08, 0.24))
+        c.setFont("Helvetica-Bold", 8)
+        c.drawString(
+            x + 180, y + h - 71, "VALID" if valid else "EXPIRED"
+        )  # Reduced from -80 to -71
+
+        # Footer - moved up significantly to reduce space
+        c.setFillColor(Color(0.6, 0.6, 0.6))
+        c.setFont("Helvetica", 6)
+        c.drawString(
+            x + 50, y + h - 83, "PKCS11 • SHA256 • SECURED"
+        )  # Changed from y + 8 to y + 5 (3px less)
+
+    def get_stamp_template(self, cert_info):
+        """
+        Static part of the signature box for a certificate, rendered once.
+        Everything except the signing time is fixed per certificate, so the
+        stamp is drawn with a placeholder time, parsed once and cached.
+        Returns (page, uncompressed content stream bytes).
+        """
+        valid = (
+            cert_info.get("not_after", datetime.datetime.now())
+            > datetime.datetime.now()
+        )
+        cache_key = (
+            str(cert_info.get("thumbprint", "")),
+            str(cert_info.get("subject_cn", "")),
+            str(cert_info.get("serial_number", "")),
+            valid,
+        )
+        with _STAMP_LOCK:
+            template = _STAMP_CACHE.get(cache_key)
+            if template is not None:
+                _STAMP_CACHE.move_to_end(cache_key)
+                return template
+
+        packet = io.BytesIO()
+        # Uncompressed so the time placeholder can be found and replaced
+        c = canvas.Canvas(packet, pagesize=letter, pageCompression=0)
+        self.draw_signature_stamp(c, cert_info, STAMP_TIME_PLACEHOLDER)
+        c.save()
+        packet.seek(0)
+
+        page = PdfReader(packet).pages[0]
+        content = page.get_contents().get_data()
+        template = (page, content)
+
+        with _STAMP_LOCK:
+            _STAMP_CACHE[cache_key] = template
+            while len(_STAMP_CACHE) > STAMP_CACHE_SIZE:
+                _STAMP_CACHE.popitem(last=False)
+        log.debug("Signature stamp template cached for %s", cache_key[2])
+        return template
+
+    def build_signature_stamp(self, cert_info, signing_time):
+        """
+        Per-document stamp page: the cached template with only the signing
+        time written into its content stream
+        """
+        template_page, content = self.get_stamp_template(cert_info)
+        time_text = signing_time.strftime("%Y-%m-%d %H:%M:%S").encode("latin-1")
+
+        stream = DecodedStreamObject()
+        stream.set_data(content.replace(STAMP_TIME_PLACEHOLDER_BYTES, time_text))
+
+        page = PageObject(template_page.pdf)
+        page.update(template_page)
+        page[NameObject("/Contents")] = stream
+        return page
+
     # --------------------------------------------------------------------------
     # PDF SIGNING LOGIC
     # --------------------------------------------------------------------------
@@ -547,234 +940,631 @@ class PKCS11Manager:
     ):
         """Add visible signature box to PDF"""
         try:
-            overlay = self.create_signature_overlay(cert_info, signing_time)
-            if not overlay:
-                raise Exception("Overlay creation failed")
+            with stage("overlay_render"):
+                overlay_page = self.build_signature_stamp(cert_info, signing_time)
 
+            # Paths are read through an open file so PyPDF2 loads objects
+            # on demand instead of copying the whole document into memory
             if isinstance(input_pdf, bytes):
-                input_pdf = io.BytesIO(input_pdf)
-
-            original = PdfReader(input_pdf)
-            overlay_pdf = PdfReader(overlay)
-            overlay_page = overlay_pdf.pages[0]
-
-            writer = PdfWriter()
-            for i, page in enumerate(original.pages):
-                if i == 0:
-                    page.merge_page(overlay_page)
-                writer.add_page(page)
-
-            writer.add_metadata(
-                {
-                    "/Title": "Digitally Signed Document",
-                    "/Author": cert_info.get("subject_cn", "Unknown"),
-                    "/Signer": cert_info.get("subject_cn", "Unknown"),
-                    "/SigningTime": signing_time.isoformat(),
-                    "/Signature": signature.hex(),
-                }
-            )
+                source = io.BytesIO(input_pdf)
+            else:
+                source = open(input_pdf, "rb")
+
+            with source:
+                original = PdfReader(source)
 
-            with open(output_pdf, "wb") as out_file:
-                writer.write(out_file)
+                with stage("merge"):
+                    writer = PdfWriter()
+                    for i, page in enumerate(original.pages):
+                        if i == 0:
+                            page.merge_page(overlay_page)
+                        writer.add_page(page)
 
-            print(f"[DEBUG] ✓ Signature applied to {output_pdf}")
+                writer.add_metadata(
+                    {
+                        "/Title": "Digitally Signed Document",
+                        "/Author": cert_info.get("subject_cn", "Unknown"),
+                        "/Signer": cert_info.get("subject_cn", "Unknown"),
+                        "/SigningTime": signing_time.isoformat(),
+                        "/Signature": signature.hex(),
+                    }
+                )
+
+                with stage("write"):
+                    if hasattr(output_pdf, "write"):
+                        writer.write(output_pdf)
+                    else:
+                        with open(output_pdf, "wb") as out_file:
+                            writer.write(out_file)
+
+            log.debug("Signature applied to %s", output_pdf)
             return True
 
         except Exception as e:
-            print(f"[DEBUG] Error adding signature: {e}")
+            log.warning("Error adding signature: %s", e)
+            return False
+
+    def add_incremental_signature(
+        self, input_pdf, output_pdf, key, cert_data, cert_info, signing_time
+    ):
+        """
+        Append a PAdES signature as an incremental update. The original
+        bytes are copied unchanged, so earlier signatures stay valid and the
+        cost does not depend on the number of pages.
+        """
+        from .signer import sign_pdf_incremental
+
+        try:
+            with pdf_buffer(input_pdf) as pdf_data:
+                # Includes the nested "sign" stage (one C_Sign)
+                with stage("incremental_sign"):
+                    appended = sign_pdf_incremental(
+                        pdf_data,
+                        lambda data: self.sign_with_key(key, data),
+                        cert_data,
+                        cert_info,
+                        signing_time,
+                        get_seal_pil_image(),
+                    )
+
+                if hasattr(output_pdf, "write"):
+                    output_pdf.write(pdf_data)
+                    output_pdf.write(appended)
+                else:
+                    with open(output_pdf, "wb") as out_file:
+                        out_file.write(pdf_data)
+                        out_file.write(appended)
+
+            log.debug("Incremental signature appended to %s", output_pdf)
+            return True
+
+        except Exception as e:
+            log.warning("Error adding incremental signature: %s", e)
+            log.debug("Traceback", exc_info=True)
             return False
 
     # --------------------------------------------------------------------------
     # MAIN SIGNING METHOD
     # --------------------------------------------------------------------------
-    def sign_pdf(self, input_pdf: str | bytes, output_pdf: str, pin: str):
+    def sign_pdf(
+        self,
+        input_pdf: str | bytes,
+        output_pdf: str | BinaryIO,
+        pin: str,
+        mode: str = None,
+        pdf_hash: bytes = None,
+        serial: str = None,
+        thumbprint: str = None,
+        save: bool = None,
+    ):
         """
         Digitally signs a PDF file using the private key and certificate
         stored in the connected PKCS#11 token.
 
         Args:
             input_pdf (str | bytes): Path to the input PDF file or raw PDF bytes.
-            output_pdf (str): Path to save the signed PDF file.
+            output_pdf (str | file): Path to save the signed PDF file, or a
+                writable binary file object (see sign_pdf_bytes).
             pin (str): User PIN for token authentication.
+            mode (str): "overlay" (stamp merged into page 1, document
+                rewritten) or "incremental" (PAdES signature appended).
+                Defaults to SIGNING_MODE from config.
+            pdf_hash (bytes): SHA-256 of the input if already known (e.g.
+                computed while downloading). Otherwise paths are hashed
+                through a memory map and bytes are hashed in place.
+            serial (str): Serial of the token to sign with.
+            thumbprint (str): SHA-256 thumbprint of the certificate to use.
+            save (bool): False keeps the result out of the signed store
+                (see get_signed_store), as the caller asked not to save it.
 
         Returns:
             bool: True if the PDF was signed successfully, False otherwise.
         """
         try:
-            print(f"[DEBUG] Starting PDF signing process")
-            key, cert_data, cert_info = self.get_token_credentials(pin)
-
-            if isinstance(input_pdf, bytes):
-                pdf_data = input_pdf
-            else:
-                with open(input_pdf, "rb") as f:
-                    pdf_data = f.read()
+            return self._sign_document(
+                input_pdf, output_pdf, pin, mode, pdf_hash, serial, thumbprint, save
+            )
 
-            digest = hashes.Hash(hashes.SHA256(), backend=default_backend())
-            digest.update(pdf_data)
-            pdf_hash = digest.finalize()
+        except Exception as e:
+            log.warning("Error during signing: %s", e)
+            log.debug("Traceback", exc_info=True)
+            return False
 
-            signature = key.sign(pdf_hash, mechanism=pkcs11.Mechanism.SHA256_RSA_PKCS)
+    def sign_pdf_bytes(
+        self,
+        input_pdf: str | bytes,
+        pin: str,
+        mode: str = None,
+        pdf_hash: bytes = None,
+        serial: str = None,
+        thumbprint: str = None,
+        save: bool = None,
+    ):
+        """
+        Same as sign_pdf but the signed document is built in memory and
+        returned as bytes; nothing is written to disk. Token errors (wrong
+        PIN, missing dongle) are raised instead of returning False.
+        """
+        output = io.BytesIO()
+        if not self._sign_document(
+            input_pdf, output, pin, mode, pdf_hash, serial, thumbprint, save
+        ):
+            raise Exception("PDF signing failed")
+        return output.getvalue()
+
+    def _sign_document(
+        self,
+        input_pdf,
+        output_pdf,
+        pin,
+        mode,
+        pdf_hash,
+        serial=None,
+        thumbprint=None,
+        save=None,
+    ):
+        from .signed_store import get_signed_store
+
+        log.debug("Starting PDF signing process")
+        # Runs before the store lookup too, so a stored signature is only
+        # handed out after the PIN and the token have been checked
+        key, cert_data, cert_info = self.get_token_credentials(
+            pin, serial=serial, thumbprint=thumbprint
+        )
+
+        mode = mode or SIGNING_MODE
+        store = get_signed_store()
+        if pdf_hash is None and (store is not None or mode != "incremental"):
+            with stage("hash"):
+                if isinstance(input_pdf, bytes):
+                    pdf_hash = hashlib.sha256(input_pdf).digest()
+                else:
+                    pdf_hash = sha256_file(input_pdf)
+
+        if store is not None:
+            cert_thumbprint = certificate_thumbprint(cert_data)
+            stored = store.get(pdf_hash, cert_thumbprint, mode)
+            SIGNED_STORE.inc(result="miss" if stored is None else "hit")
+            if stored is not None:
+                log.debug("Same document and certificate signed before, reusing it")
+                write_output(output_pdf, stored)
+                return True
+
+        if mode == "incremental":
+            signed = self.add_incremental_signature(
+                input_pdf,
+                output_pdf,
+                key,
+                cert_data,
+                cert_info,
+                datetime.datetime.now(),
+            )
+        else:
+            signature = self.sign_with_key(key, pdf_hash)
 
             signing_time = datetime.datetime.now()
-            success = self.add_visible_signature(
+            signed = self.add_visible_signature(
                 input_pdf, output_pdf, cert_info, signature, cert_data, signing_time
             )
 
-            return success
+        if signed:
+            DOCUMENTS_SIGNED.inc(kind=mode)
+            if store is not None and save is not False:
+                signed_pdf = read_output(output_pdf)
+                if signed_pdf is not None:
+                    store.put(pdf_hash, cert_thumbprint, mode, signed_pdf)
+        return signed
 
-        except Exception as e:
-            print(f"[DEBUG] Error during signing: {e}")
-            print(f"[DEBUG] Traceback: {traceback.format_exc()}")
-            return False
-        finally:
-            if self.session:
+    def sign_digest(
+        self, pin: str, digest: bytes, serial: str = None, thumbprint: str = None
+    ):
+        """
+        Detached CMS signature over a document digest prepared by the
+        server. Only the digest reaches the agent, so the cost does not
+        depend on document size. Returns (CMS DER bytes, cert_info).
+        """
+        from .signer import sign_digest_cms
+
+        key, cert_data, cert_info = self.get_token_credentials(
+            pin, serial=serial, thumbprint=thumbprint
+        )
+        # Includes the nested "sign" stage (one C_Sign)
+        with stage("cms_build"):
+            cms = sign_digest_cms(
+                digest, lambda data: self.sign_with_key(key, data), cert_data
+            )
+        DOCUMENTS_SIGNED.inc(kind="digest_cms")
+        return cms, cert_info
+
+    def sign_digests(
+        self,
+        pin: str,
+        digests,
+        output: str = "cms",
+        serial: str = None,
+        thumbprint: str = None,
+    ):
+        """
+        Sign many (id, digest) pairs back to back under one login, holding
+        the token for the whole run. ``output`` is "cms" (detached
+        SignedData per digest) or "raw" (PKCS#1 v1.5 signature of the
+        digest). Returns (results, cert_data, cert_info) where results is a
+        list of (id, signature bytes or None, exception or None).
+        """
+        from .signer import DIGEST_INFO_SHA256, sign_digest_cms
+
+        key, cert_data, cert_info = self.get_token_credentials(
+            pin, serial=serial, thumbprint=thumbprint
+        )
+        entry = self.sessions.find_key(key)
+
+        results = []
+        with self.token_lock(entry.serial if entry is not None else ""):
+            for item_id, digest in digests:
                 try:
-                    self.session.close()
-                except:
-                    pass
+                    if output == "raw":
+                        # CKM_RSA_PKCS pads the given DigestInfo as-is, so
+                        # the digest is not hashed a second time
+                        signature = self.sign_with_key(
+                            key,
+                            DIGEST_INFO_SHA256 + digest,
+                            mechanism=pkcs11.Mechanism.RSA_PKCS,
+                        )
+                    else:
+                        with stage("cms_build"):
+                            signature = sign_digest_cms(
+                                digest,
+                                lambda data: self.sign_with_key(key, data),
+                                cert_data,
+                            )
+                    results.append((item_id, signature, None))
+                    DOCUMENTS_SIGNED.inc(kind=f"digest_{output}")
+                except Exception as e:
+                    results.append((item_id, None, e))
+        return results, cert_data, cert_info
 
-    def get_token_credentials(self, pin, cert_info_only=False):
+    def sign_with_key(
+        self, key, data, mechanism=pkcs11.Mechanism.SHA256_RSA_PKCS
+    ):
         """
-        Opens a PKCS#11 session using the provided PIN and retrieves the
-        private key, raw certificate data, and parsed certificate info
-        from the connected token.
+        Run C_Sign on the pooled session. If the token was pulled out the
+        pooled session is dropped so the next request logs in again.
         """
+        entry = self.sessions.find_key(key)
+        lock = self.token_lock(entry.serial if entry is not None else "")
         try:
-            print(f"[DEBUG] Starting get_token_credentials with PIN: {pin}")
-            print(f"[DEBUG] PKCS11 library path: {self.pkcs11_lib_path}")
+            # Waiting for the token is timed apart from C_Sign itself
+            with stage("token_wait"):
+                lock.acquire()
+            try:
+                with stage("sign"):
+                    return key.sign(data, mechanism=mechanism)
+            finally:
+                lock.release()
+        except TOKEN_GONE_ERRORS as e:
+            log.warning("Token session lost during signing: %r", e)
+            if entry is not None:
+                self.sessions.token_removed(entry.serial)
+            self.session = None
+            raise Exception("Token not present or session lost, please re-insert the dongle")
+
+    def get_cert_info(self, pin, serial=None, thumbprint=None):
+        """
+        Certificate details for /cert-info. Once a PIN has been verified on
+        a token the answer comes from memory until the token is removed.
+        """
+        pooled = self.sessions.get(pin_digest(pin), serial=serial, thumbprint=thumbprint)
+        if pooled is not None:
+            return self._pooled_credentials(pooled, thumbprint, cert_info_only=True)[2]
 
-            # Initialize PKCS11 library
-            print(f"[DEBUG] Initializing PKCS11 library...")
-            self.lib = pkcs11.lib(self.pkcs11_lib_path)
-            print(f"[DEBUG] PKCS11 library initialized successfully")
+        _, _, cert_info = self.get_token_credentials(
+            pin, cert_info_only=True, serial=serial, thumbprint=thumbprint
+        )
+        return cert_info
 
-            # Find slots with tokens
-            print(f"[DEBUG] Getting slots...")
-            slots = list(self.lib.get_slots())
-            print(f"[DEBUG] Found {len(slots)} slots")
+    def find_tokens(self):
+        """
+        Tokens currently present. Answered from the hot-plug monitor's view
+        when it is running, otherwise by scanning all slots.
+        """
+        if self.monitor is not None and self.monitor.ready:
+            tokens = self.monitor.tokens()
+            log.debug("Token monitor reports %s token(s)", len(tokens))
+            return tokens
 
-            tokens = []
-            for i, slot in enumerate(slots):
-                try:
-                    print(f"[DEBUG] Checking slot {i}...")
-                    token = slot.get_token()
-                    token_label = getattr(token, "label", "Unknown")
-                    print(f"[DEBUG] ✓ Token found in slot {i}: {token_label}")
-                    tokens.append(token)
-                except Exception as e:
-                    print(f"[DEBUG]   Slot {i} - No token: {e}")
-                    continue
+        lib = self.load_library()
 
-            if not tokens:
-                raise Exception(
-                    "No tokens found in any slot. Please insert your digital signature token."
-                )
+        log.debug("Getting slots...")
+        slots = list(lib.get_slots())
+        log.debug("Found %s slots", len(slots))
 
-            token = tokens[0]  # Use first token found
-            print(f"[DEBUG] Using token: {getattr(token, 'label', 'Unknown')}")
+        tokens = []
+        for i, slot in enumerate(slots):
+            try:
+                log.debug("Checking slot %s...", i)
+                token = slot.get_token()
+                token_label = getattr(token, "label", "Unknown")
+                log.debug("Token found in slot %s: %s", i, token_label)
+                tokens.append(token)
+            except Exception as e:
+                log.debug("Slot %s - No token: %s", i, e)
+                continue
+        return tokens
 
-            # Open session
-            print(f"[DEBUG] Opening session with PIN...")
-            self.session = token.open(user_pin=pin, rw=True)
-            print(f"[DEBUG] Session opened successfully")
-
-            # Find private keys
-            print(f"[DEBUG] Searching for private keys...")
-            private_keys = list(
-                self.session.get_objects(
-                    {
-                        pkcs11.constants.Attribute.CLASS: pkcs11.constants.ObjectClass.PRIVATE_KEY
-                    }
+    def token_certificates(self, token):
+        """
+        Certificates on a token, read without logging in (certificates are
+        public objects), cached until the token is removed. Returns a list
+        of {"thumbprint", "subject_cn", "issuer_cn", "not_after"}.
+        """
+        serial = token_serial(token)
+        with self._public_certs_lock:
+            certs = self._public_certs.get(serial)
+        if certs is not None:
+            return certs
+
+        def common_name(name):
+            attrs = name.get_attributes_for_oid(x509.NameOID.COMMON_NAME)
+            return attrs[0].value if attrs else name.rfc4514_string()
+
+        def not_after(certificate):
+            # not_valid_after is deprecated from cryptography 42
+            value = getattr(certificate, "not_valid_after_utc", None)
+            if value is None:
+                value = certificate.not_valid_after
+            return value.replace(tzinfo=None).isoformat()
+
+        with token.open() as session:
+            index = SessionObjectIndex(session, private=False)
+        certs = [
+            {
+                "thumbprint": certificate.thumbprint,
+                "subject_cn": common_name(certificate.certificate.subject),
+                "issuer_cn": common_name(certificate.certificate.issuer),
+                "not_after": not_after(certificate.certificate),
+            }
+            for certificate in index.certificates
+        ]
+
+        with self._public_certs_lock:
+            self._public_certs[serial] = certs
+        return certs
+
+    def list_tokens(self):
+        """Every present token with the certificates it holds, for /tokens"""
+        result = []
+        for token in self.find_tokens():
+            info = describe_token(token.slot, token)
+            try:
+                info["certificates"] = self.token_certificates(token)
+            except Exception as e:
+                log.warning(
+                    "Could not list certificates on %s: %s", info["serial"], e
                 )
-            )
-            print(f"[DEBUG] Found {len(private_keys)} private key(s)")
+                info["certificates"] = []
+            result.append(info)
+        return result
 
-            if not private_keys:
-                raise Exception("No private keys found in token")
+    def select_token(self, serial=None, thumbprint=None):
+        """
+        Present token with the given serial and/or holding the certificate
+        with the given thumbprint. Without either, the first token found.
+        """
+        tokens = self.find_tokens()
+        if not tokens:
+            raise Exception(
+                "No tokens found in any slot. Please insert your digital signature token."
+            )
 
-            # Find a signable private key
-            print(f"[DEBUG] Finding signable private key...")
-            signable_key = None
-            for i, key in enumerate(private_keys):
+        for token in tokens:
+            if serial and token_serial(token) != serial:
+                continue
+            if thumbprint and not any(
+                cert["thumbprint"] == thumbprint.lower()
+                for cert in self.token_certificates(token)
+            ):
+                continue
+            return token
+
+        raise Exception(
+            f"Requested token not present (serial={serial}, thumbprint={thumbprint})"
+        )
+
+    def signing_tokens(
+        self, pin, serial=None, thumbprint=None, spread=True, serials=None
+    ):
+        """
+        (serial, certificate thumbprint) of the logged-in tokens a batch
+        can be spread over: the selected token and certificate first, then
+        other present tokens holding a certificate for the same signer
+        (subject and issuer). The PIN is never tried on a token the caller
+        did not name, since wrong attempts lock a dongle:
+
+        - ``serials``: tokens listed by the caller; each one is logged in
+          unless it rejected this PIN before (see _pin_rejected)
+        - otherwise, with ``spread`` and neither ``serial`` nor
+          ``thumbprint`` given, tokens already holding a session pooled
+          for this PIN
+        """
+        if serials and not serial:
+            serial = serials[0]
+        key, cert_data, cert_info = self.get_token_credentials(
+            pin, serial=serial, thumbprint=thumbprint
+        )
+        selected = self.sessions.find_key(key).serial
+        tokens = [(selected, certificate_thumbprint(cert_data))]
+        if not serials and not (spread and not serial and not thumbprint):
+            return tokens
+
+        pin_hash = pin_digest(pin)
+        identity = (str(cert_info.get("subject_cn")), str(cert_info.get("issuer_cn")))
+        for token in self.find_tokens():
+            other = token_serial(token)
+            if any(other == used for used, _ in tokens):
+                continue
+            if serials:
+                if other not in serials or self._pin_rejected(other, pin_hash):
+                    continue
+            elif self.sessions.get(pin_hash, serial=other) is None:
+                continue
+            try:
+                certs = self.token_certificates(token)
+            except Exception as e:
+                log.warning("Skipping token %s: %s", other, e)
+                continue
+            for cert in certs:
+                if (cert["subject_cn"], cert["issuer_cn"]) != identity:
+                    continue
                 try:
-                    print(f"[DEBUG] Checking key {i} for signing capability...")
-                    can_sign = key[pkcs11.constants.Attribute.SIGN]
-                    print(f"[DEBUG] Key {i} - SIGN attribute: {can_sign}")
-                    if can_sign:
-                        signable_key = key
-                        print(f"[DEBUG] Using signable key {i}")
-                        break
+                    self.get_token_credentials(
+                        pin, serial=other, thumbprint=cert["thumbprint"]
+                    )
+                    tokens.append((other, cert["thumbprint"]))
+                except PIN_REJECTED_ERRORS as e:
+                    log.warning("Token %s rejected the PIN: %r", other, e)
+                    self._reject_pin(other, pin_hash)
                 except Exception as e:
-                    print(f"[DEBUG] Key {i} - Error checking SIGN: {e}")
-                    continue
+                    log.warning("Token %s not usable for this signer: %r", other, e)
+                break
+
+        if len(tokens) > 1:
+            log.debug("Spreading signing over tokens: %s", [s for s, _ in tokens])
+        return tokens
+
+    def _pin_rejected(self, serial, pin_hash):
+        """True if the token ``serial`` refused this PIN since it was inserted"""
+        with self._rejected_lock:
+            return (serial, pin_hash) in self._rejected_pins
+
+    def _reject_pin(self, serial, pin_hash):
+        with self._rejected_lock:
+            self._rejected_pins.add((serial, pin_hash))
+
+    def _certificate_info(self, serial, certificate):
+        """Parsed details of a TokenCertificate, once per token and certificate"""
+        cert_info = self.cert_cache.get(serial, certificate.id)
+        if cert_info is None:
+            log.debug("Parsing certificate info...")
+            cert_info = self.cert_cache.put(
+                serial, certificate.id, self.parse_certificate_info(certificate.cert_data)
+            )
+            log.debug("Certificate info parsed successfully")
+        return cert_info
+
+    def _pooled_credentials(self, pooled, thumbprint=None, cert_info_only=False):
+        """Credentials from a pooled session; another certificate on the same
+        login is a lookup in the session's object index"""
+        if thumbprint and thumbprint.lower() != pooled.thumbprint:
+            key, certificate = pooled.index.pair(thumbprint)
+            cert_data = certificate.cert_data
+            cert_info = self._certificate_info(pooled.serial, certificate)
+        else:
+            key, cert_data, cert_info = pooled.key, pooled.cert_data, pooled.cert_info
+        if cert_info_only:
+            return None, cert_data, cert_info
+        return key, cert_data, cert_info
+
+    def get_token_credentials(
+        self, pin, cert_info_only=False, serial=None, thumbprint=None
+    ):
+        """
+        Returns the private key, raw certificate data, and parsed certificate
+        info from the connected token. A logged-in session for the same token
+        and PIN is reused from the pool; otherwise a new session is opened
+        with the PIN and kept for later requests.
 
-            if not signable_key:
-                signable_key = private_keys[0]
-                print(f"[DEBUG] Using first key as fallback")
+        ``serial`` / ``thumbprint`` choose the token and certificate when
+        several dongles are plugged in; by default the first token is used.
+        """
+        pin_hash = pin_digest(pin)
 
-            # Find certificates
-            print(f"[DEBUG] Searching for certificates...")
-            certificates = list(
-                self.session.get_objects(
-                    {
-                        pkcs11.constants.Attribute.CLASS: pkcs11.constants.ObjectClass.CERTIFICATE
-                    }
-                )
-            )
-            print(f"[DEBUG] Found {len(certificates)} certificate(s)")
+        pooled = self.sessions.get(pin_hash, serial=serial, thumbprint=thumbprint)
+        if pooled is not None:
+            log.debug("Reusing logged-in session on token %s", pooled.serial)
+            self.session = pooled.session
+            return self._pooled_credentials(pooled, thumbprint, cert_info_only)
 
-            if not certificates:
-                raise Exception("No certificates found in token")
+        session = None
+        lock = None
+        try:
+            log.debug("Starting get_token_credentials")
+            log.debug("PKCS11 library path: %s", self.pkcs11_lib_path)
 
-            certificate = certificates[0]
-            print(f"[DEBUG] Using first certificate")
+            token = self.select_token(serial, thumbprint)
+            log.debug("Using token: %s", getattr(token, "label", "Unknown"))
 
-            # Get certificate data with safe attribute access
-            print(f"[DEBUG] Getting certificate VALUE attribute...")
-            try:
-                cert_data = certificate[pkcs11.constants.Attribute.VALUE]
-                print(
-                    f"[DEBUG] Certificate data retrieved, length: {len(cert_data) if cert_data else 0}"
-                )
-            except Exception as e:
-                print(f"[DEBUG] Error getting certificate VALUE: {e}")
-                raise Exception(f"Failed to read certificate data: {e}")
+            # No other request may sign or log in on this token meanwhile
+            lock = self.token_lock(token_serial(token))
+            lock.acquire()
 
-            # Parse certificate info
-            print(f"[DEBUG] Parsing certificate info...")
-            cert_info = self.parse_certificate_info(cert_data)
-            print(f"[DEBUG] Certificate info parsed successfully")
+            # Another request may have logged in with this PIN while we
+            # waited, or the PIN is right but the requested certificate has
+            # no key in that session: the index lookup raises the key error
+            pooled = self.sessions.get(pin_hash, serial=token_serial(token))
+            if pooled is not None:
+                return self._pooled_credentials(pooled, thumbprint, cert_info_only)
 
-            # Debug print all certificate info values
-            print(f"[DEBUG] Certificate info values:")
-            for key, value in cert_info.items():
-                if key != "certificate":  # Skip the actual certificate object
-                    print(f"[DEBUG]   {key}: {value} (type: {type(value)})")
+            # Login state is shared by all sessions on a token and C_Login
+            # cannot check another PIN while it is logged in, so a session
+            # pooled under another PIN (e.g. before the PIN was changed) is
+            # closed and the token itself decides whether this PIN is right
+            self.sessions.drop_token(token_serial(token))
+
+            # Open session
+            log.debug("Opening session with PIN...")
+            with stage("login"):
+                session = token.open(user_pin=pin, rw=True)
+            log.debug("Session opened successfully")
+
+            # Keys and certificates are read once per session and paired
+            # by CKA_ID
+            with stage("find_objects"):
+                index = SessionObjectIndex(session)
+            log.debug(
+                "Found %s signing key(s), %s certificate(s), %s pair(s)",
+                len(index.keys),
+                len(index.certificates),
+                len(index.pairs),
+            )
+            signable_key, certificate = index.pair(thumbprint)
+            log.debug("Using certificate %s", certificate.thumbprint)
+
+            cert_data = certificate.cert_data
+            cert_info = self._certificate_info(token_serial(token), certificate)
+
+            # Keep the logged-in session for the next request
+            entry = self.sessions.put(
+                pin_hash,
+                PooledSession(
+                    token,
+                    session,
+                    index,
+                    signable_key,
+                    cert_data,
+                    cert_info,
+                    certificate.id,
+                ),
+            )
+            self.session = entry.session
+            log.debug("Session pooled for token %s", entry.serial)
 
             if cert_info_only:
-                print(f"[DEBUG] cert_info_only=True, closing session...")
-                # close session if only cert info is needed
-                if self.session:
-                    try:
-                        self.session.close()
-                        self.session = None
-                        print(f"[DEBUG] Session closed")
-                    except Exception as e:
-                        print(f"[DEBUG] Error closing session: {e}")
                 return None, cert_data, cert_info
             else:
-                print(f"[DEBUG] Returning key and certificate info for signing")
+                log.debug("Returning key and certificate info for signing")
                 return signable_key, cert_data, cert_info
 
         except Exception as e:
-            print(f"[DEBUG] Error in get_token_credentials: {e}")
-            print(f"[DEBUG] Traceback: {traceback.format_exc()}")
+            log.warning("Error in get_token_credentials: %r", e)
+            log.debug("Traceback", exc_info=True)
             # Ensure session is closed on error
-            if self.session:
+            if session:
                 try:
-                    self.session.close()
-                    self.session = None
+                    session.close()
                 except:
                     pass
+            self.session = None
             raise
+        finally:
+            if lock is not None:
+                lock.release()
@@ -0,0 +1,138 @@
+# agent/profiling.py
+import cProfile
+import io
+import logging
+import os
+import pstats
+import re
+import threading
+import time
+
+from .config import PROFILE_KEEP, PROFILES_PATH
+from .log import REQUEST_ID
+
+log = logging.getLogger(__name__)
+
+PROFILE_SUFFIX = ".prof"
+_NAME_PATTERN = re.compile(r"[A-Za-z0-9-]+_[A-Za-z0-9-]+_[A-Za-z0-9-]+\.prof")
+
+# One profiled call at a time: from Python 3.12 cProfile hooks the whole
+# interpreter, and two requests profiled together would mix their stats
+_LOCK = threading.Lock()
+
+
+def _name_part(text):
+    return re.sub(r"[^A-Za-z0-9-]+", "-", text).strip("-") or "-"
+
+
+def run_profiled(label, fn, *args, **kwargs):
+    """
+    Call ``fn`` under cProfile and save the profile to PROFILES_PATH.
+    Returns (result, profile name). When another profile is running,
+    ``fn`` runs unprofiled and the name is None.
+    """
+    if not _LOCK.acquire(blocking=False):
+        log.info("Profiler busy, %s runs unprofiled", label)
+        return fn(*args, **kwargs), None
+
+    profiler = cProfile.Profile()
+    started = time.time()
+    try:
+        result = profiler.runcall(fn, *args, **kwargs)
+    finally:
+        _LOCK.release()
+        name = save_profile(profiler, label, started)
+    return result, name
+
+
+def save_profile(profiler, label, started):
+    """Write the pstats file, then drop the oldest beyond PROFILE_KEEP"""
+    stamp = time.strftime("%Y%m%d-%H%M%S", time.localtime(started))
+    stamp += f"-{int(started * 1000) % 1000:03d}"
+    name = (
+        f"{stamp}_{_name_part(label)}_{_name_part(REQUEST_ID.get())}"
+        f"{PROFILE_SUFFIX}"
+    )
+    path = os.path.join(PROFILES_PATH, name)
+    try:
+        os.makedirs(PROFILES_PATH, exist_ok=True)
+        # Renamed into place so /debug/profiles never lists a partial file
+        profiler.dump_stats(path + ".tmp")
+        os.replace(path + ".tmp", path)
+    except OSError as e:
+        log.warning("Saving profile %s failed: %s", name, e)
+        return None
+
+    log.info("Saved profile %s", name)
+    prune_profiles()
+    return name
+
+
+def _profile_files():
+    """(mtime, name) of saved profiles, newest first"""
+    try:
+        names = os.listdir(PROFILES_PATH)
+    except FileNotFoundError:
+        return []
+    files = []
+    for name in names:
+        if _NAME_PATTERN.fullmatch(name):
+            try:
+                mtime = os.path.getmtime(os.path.join(PROFILES_PATH, name))
+            except OSError:
+                continue
+            files.append((mtime, name))
+    return sorted(files, reverse=True)
+
+
+def prune_profiles(keep=PROFILE_KEEP):
+    for _, name in _profile_files()[keep:]:
+        try:
+            os.remove(os.path.join(PROFILES_PATH, name))
+        except OSError as e:
+            log.warning("Removing old profile %s failed: %s", name, e)
+
+
+def list_profiles():
+    """Saved profiles, newest first, with the run time each recorded"""
+    profiles = []
+    for mtime, name in _profile_files():
+        path = os.path.join(PROFILES_PATH, name)
+        stamp, label, request_id = name[: -len(PROFILE_SUFFIX)].split("_")
+        try:
+            total = pstats.Stats(path).total_tt
+            size = os.path.getsize(path)
+        except Exception as e:
+            log.warning("Unreadable profile %s: %s", name, e)
+            continue
+        profiles.append(
+            {
+                "name": name,
+                "endpoint": label,
+                "request_id": request_id,
+                "created": mtime,
+                "size": size,
+                "total_seconds": round(total, 6),
+            }
+        )
+    return profiles
+
+
+def profile_path(name):
+    """Path of a saved profile, or None for unknown or invalid names"""
+    if not _NAME_PATTERN.fullmatch(name or ""):
+        return None
+    path = os.path.join(PROFILES_PATH, name)
+    return path if os.path.isfile(path) else None
+
+
+def profile_text(path, sort="cumulative", limit=50):
+    """pstats report of the top ``limit`` functions by ``sort``"""
+    output = io.StringIO()
+    stats = pstats.Stats(path, stream=output)
+    try:
+        stats.sort_stats(sort)
+    except KeyError:
+        raise ValueError(f"Unknown sort key: {sort}")
+    stats.print_stats(limit)
+    return output.getvalue()
@@ -0,0 +1,152 @@
+# agent/signed_store.py
+import hashlib
+import logging
+import os
+import re
+import threading
+import time
+
+from .config import SIGNED_RETENTION_DAYS, SIGNED_STORE_MAX_BYTES, SIGNED_STORE_PATH
+from .storage import get_writer
+
+log = logging.getLogger(__name__)
+
+_ENTRY_NAME = re.compile(r"[0-9a-f]{64}\.pdf")
+
+# Retention is enforced at most this often (seconds), or when over size
+SWEEP_INTERVAL = 3600
+
+
+def store_key(source_sha256, thumbprint, mode):
+    """Name of the signed output of one document, certificate and mode"""
+    if isinstance(source_sha256, bytes):
+        source_sha256 = source_sha256.hex()
+    key = f"{source_sha256}:{thumbprint.lower()}:{mode}"
+    return hashlib.sha256(key.encode("ascii")).hexdigest()
+
+
+class SignedStore:
+    """
+    Signed PDFs kept by source document hash, signing certificate
+    thumbprint and signing mode, so the same document signed again with
+    the same certificate is answered from disk instead of the token.
+
+    A file's mtime is its signing time. Files older than
+    ``retention_days`` are ignored and removed; past ``max_bytes`` the
+    oldest are removed first. Only ``directory`` is swept: the named
+    copies in SIGNED_DOCS_PATH are the user's and are never removed.
+    Files are written by the background SignedDocWriter.
+    """
+
+    def __init__(
+        self,
+        directory=SIGNED_STORE_PATH,
+        max_bytes=SIGNED_STORE_MAX_BYTES,
+        retention_days=SIGNED_RETENTION_DAYS,
+    ):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age = retention_days * 86400 if retention_days else None
+        self._lock = threading.Lock()
+        # Bytes in the store, counted by the first sweep
+        self._total = 0
+        self._last_sweep = 0.0
+
+    def _path(self, source_sha256, thumbprint, mode):
+        return os.path.join(
+            self.directory, f"{store_key(source_sha256, thumbprint, mode)}.pdf"
+        )
+
+    def get(self, source_sha256, thumbprint, mode):
+        """Stored signed PDF bytes, or None"""
+        path = self._path(source_sha256, thumbprint, mode)
+        try:
+            if self.max_age and time.time() - os.path.getmtime(path) > self.max_age:
+                return None
+            with open(path, "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+        except OSError as e:
+            log.warning("Reading stored signature %s failed: %s", path, e)
+            return None
+
+    def put(self, source_sha256, thumbprint, mode, signed_pdf):
+        get_writer().save(self._path(source_sha256, thumbprint, mode), signed_pdf)
+        with self._lock:
+            self._total += len(signed_pdf)
+            due = (
+                self._total > self.max_bytes
+                or time.time() - self._last_sweep > SWEEP_INTERVAL
+            )
+        if due:
+            self.sweep()
+
+    def _files(self, directory, match):
+        """(mtime, size, path) of the files in ``directory`` matching"""
+        try:
+            names = os.listdir(directory)
+        except FileNotFoundError:
+            return []
+        files = []
+        for name in names:
+            if not match(name):
+                continue
+            path = os.path.join(directory, name)
+            try:
+                info = os.stat(path)
+            except OSError:
+                continue
+            files.append((info.st_mtime, info.st_size, path))
+        return files
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+            return True
+        except OSError as e:
+            log.warning("Removing %s failed: %s", path, e)
+            return False
+
+    def sweep(self):
+        """Apply the age and size limits now"""
+        with self._lock:
+            self._last_sweep = time.time()
+            removed = 0
+            cutoff = self._last_sweep - self.max_age if self.max_age else None
+
+            entries = sorted(self._files(self.directory, _ENTRY_NAME.fullmatch))
+            total = sum(size for _, size, _ in entries)
+            for mtime, size, path in entries:
+                too_old = cutoff is not None and mtime < cutoff
+                if not too_old and total <= self.max_bytes:
+                    break
+                if self._remove(path):
+                    total -= size
+                    removed += 1
+            self._total = total
+
+        if removed:
+            log.info(
+                "Signed store: removed %s document(s), %s bytes kept", removed, total
+            )
+
+
+_STORE = None
+_STORE_LOCK = threading.Lock()
+
+
+def get_signed_store():
+    """
+    Process-wide SignedStore, or None when SIGNED_STORE_ENABLED is off or
+    signed documents are not kept at all (SAVE_SIGNED_DOCS off)
+    """
+    from .config import SAVE_SIGNED_DOCS, SIGNED_STORE_ENABLED
+
+    global _STORE
+    if not (SIGNED_STORE_ENABLED and SAVE_SIGNED_DOCS):
+        return None
+    with _STORE_LOCK:
+        if _STORE is None:
+            _STORE = SignedStore()
+        return _STORE
@@ -1,7 +1,25 @@
 # agent/signer.py
+import os
+import threading
+from collections import OrderedDict
+
+from asn1crypto import cms
+from cryptography import x509
+from endesive import signer
 from endesive.pdf.cms import sign
 from datetime import datetime
 
+# Hex characters reserved for the CMS blob in /Contents. Large enough for a
+# 4096-bit RSA signature plus a certificate chain, so endesive signs only once.
+SIGNATURE_RESERVED_HEX = 16384
+
+# Appearance box on page 1, same place as the overlay stamp
+SIGNATURE_BOX = (312, 315, 552, 435)
+
+# DER DigestInfo prefix for SHA-256 (RFC 8017, section 9.2)
+DIGEST_INFO_SHA256 = bytes.fromhex("3031300d060960864801650304020105000420")
+
+
 def sign_pdf(pdf_bytes, cert_file, key_file, password):
     dct = {
         "sigflags": 3,
@@ -12,3 +30,205 @@ def sign_pdf(pdf_bytes, cert_file, key_file, password):
     }
     signed_pdf = sign(pdf_bytes, dct, key_file, cert_file, password)
     return signed_pdf
+
+
+def pdf_date(dt):
+    """PDF date string (D:YYYYMMDDHHmmSS+HH'mm') in local time"""
+    dt = dt.astimezone()
+    offset = dt.strftime("%z")
+    return dt.strftime("D:%Y%m%d%H%M%S") + f"{offset[:3]}'{offset[3:]}'"
+
+
+class TokenHSM:
+    """
+    endesive HSM callback backed by a PKCS#11 private key on the token.
+    ``sign_func(data)`` must return an RSA PKCS#1 v1.5 signature over
+    SHA-256(data), i.e. C_Sign with CKM_SHA256_RSA_PKCS.
+    """
+
+    def __init__(self, sign_func, cert_data):
+        self.sign_func = sign_func
+        self.cert_data = cert_data
+
+    def certificate(self):
+        return 1, self.cert_data
+
+    def sign(self, keyid, data, mech):
+        if mech != "sha256":
+            raise ValueError(f"Unsupported digest algorithm: {mech}")
+        return self.sign_func(data)
+
+
+def signature_appearance(cert_info, signing_time, width, height, seal_image=None):
+    """endesive 'signature_manual' directives for the visible stamp"""
+    subject = str(cert_info.get("subject_cn", "Unknown"))
+    if len(subject) > 25:
+        subject = subject[:25] + "..."
+    serial = str(cert_info.get("serial_number", "Unknown"))
+    if len(serial) > 15:
+        serial = serial[:15] + "..."
+    valid = cert_info.get("not_after", datetime.now()) > datetime.now()
+
+    directives = [
+        ["fill_colour", 0.97, 0.98, 1.0],
+        ["rect_fill", 0, 0, width, height],
+        ["stroke_colour", 0, 0.48, 0.74],
+        ["border", 1],
+    ]
+    if seal_image is not None:
+        directives.append(["image", "seal", 180, height - 60, 220, height - 20, False])
+
+    rows = [
+        ("Signed by:", subject),
+        ("Serial No:", serial),
+        ("Date/Time:", signing_time.strftime("%Y-%m-%d %H:%M:%S")),
+        ("Token:", "Watchdata PROXKey"),
+    ]
+    directives.append(["fill_colour", 0.2, 0.2, 0.2])
+    y = height - 35
+    for label, value in rows:
+        directives += [
+            ["font", "default", 9],
+            ["text_position", 50, y],
+            ["text", label],
+            ["done"],
+            ["font", "default", 8],
+            ["text_position", 100, y],
+            ["text", value],
+            ["done"],
+        ]
+        y -= 12
+
+    if valid:
+        directives.append(["fill_colour", 0.16, 0.68, 0.32])
+    else:
+        directives.append(["fill_colour", 0.86, 0.08, 0.24])
+    directives += [
+        ["font", "default", 8],
+        ["text_position", 180, height - 71],
+        ["text", "VALID" if valid else "EXPIRED"],
+        ["done"],
+        ["fill_colour", 0.6, 0.6, 0.6],
+        ["font", "default", 6],
+        ["text_position", 50, height - 83],
+        ["text", "PKCS11 - SHA256 - SECURED"],
+        ["done"],
+    ]
+    return directives
+
+
+def sign_pdf_incremental(
+    pdf_bytes, sign_func, cert_data, cert_info, signing_time, seal_image=None
+):
+    """
+    PAdES signature appended as an incremental update.
+
+    The original bytes are left untouched (earlier signatures stay valid);
+    endesive appends the signature dictionary with a ByteRange placeholder,
+    the widget and its appearance, hashes only the ByteRange and embeds a
+    CMS SignedData produced with one call to ``sign_func``.
+
+    Returns only the appended bytes; the signed file is
+    ``pdf_bytes + returned``.
+    """
+    x1, y1, x2, y2 = SIGNATURE_BOX
+    dct = {
+        "aligned": SIGNATURE_RESERVED_HEX,
+        "sigflags": 3,
+        "sigpage": 0,
+        "sigfield": "Signature1",
+        "auto_sigfield": True,
+        "signaturebox": SIGNATURE_BOX,
+        "signature_manual": signature_appearance(
+            cert_info, signing_time, x2 - x1, y2 - y1, seal_image
+        ),
+        "manual_images": {} if seal_image is None else {"seal": seal_image},
+        "contact": str(cert_info.get("subject_cn", "Unknown")),
+        "location": "Digital Signature System",
+        "signingdate": pdf_date(signing_time),
+        "reason": "Document Approval",
+    }
+    hsm = TokenHSM(sign_func, cert_data)
+    return sign(pdf_bytes, dct, None, None, [], "sha256", hsm)
+
+
+class CmsTemplate:
+    """
+    Detached CMS SignedData for one certificate, encoded once.
+
+    Per digest only the messageDigest and the signature change, and both
+    have a fixed length for an RSA key, so they are patched into a copy of
+    the cached DER instead of re-encoding the certificate and attributes
+    with asn1crypto for every signature.
+    """
+
+    def __init__(self, cert_data):
+        public_key = x509.load_der_x509_certificate(cert_data).public_key()
+        self.signature_size = (public_key.key_size + 7) // 8
+
+        digest_mark = os.urandom(32)
+        signature_mark = os.urandom(self.signature_size)
+        hsm = TokenHSM(lambda data: signature_mark, cert_data)
+        self.der = signer.sign(
+            None, None, None, [], "sha256", signed_value=digest_mark, hsm=hsm
+        )
+
+        signer_info = cms.ContentInfo.load(self.der)["content"]["signer_infos"][0]
+        attrs = signer_info["signed_attrs"].dump()
+
+        self.attrs_at = self.der.index(attrs)
+        self.attrs_end = self.attrs_at + len(attrs)
+        self.digest_at = self.der.index(digest_mark, self.attrs_at)
+        self.signature_at = self.der.index(signature_mark)
+
+    def sign(self, digest, sign_func):
+        """CMS DER over ``digest``; ``sign_func`` is called once"""
+        der = bytearray(self.der)
+        der[self.digest_at : self.digest_at + 32] = digest
+
+        # Signed attributes are signed as a SET, not as the [0] field
+        signature = sign_func(b"\x31" + bytes(der[self.attrs_at + 1 : self.attrs_end]))
+
+        if len(signature) != self.signature_size:
+            content_info = cms.ContentInfo.load(bytes(der))
+            content_info["content"]["signer_infos"][0]["signature"] = signature
+            return content_info.dump(force=True)
+
+        der[self.signature_at : self.signature_at + self.signature_size] = signature
+        return bytes(der)
+
+
+# CMS templates keyed by certificate (see get_cms_template)
+CMS_TEMPLATE_CACHE_SIZE = 8
+_CMS_TEMPLATES = OrderedDict()
+_CMS_TEMPLATES_LOCK = threading.Lock()
+
+
+def get_cms_template(cert_data):
+    with _CMS_TEMPLATES_LOCK:
+        template = _CMS_TEMPLATES.get(cert_data)
+        if template is not None:
+            _CMS_TEMPLATES.move_to_end(cert_data)
+            return template
+
+    template = CmsTemplate(cert_data)
+
+    with _CMS_TEMPLATES_LOCK:
+        _CMS_TEMPLATES[cert_data] = template
+        while len(_CMS_TEMPLATES) > CMS_TEMPLATE_CACHE_SIZE:
+            _CMS_TEMPLATES.popitem(last=False)
+    return template
+
+
+def sign_digest_cms(digest, sign_func, cert_data):
+    """
+    Detached CMS SignedData (PAdES / adbe.pkcs7.detached) over a SHA-256
+    digest computed elsewhere, e.g. the ByteRange hash of a PDF the portal
+    prepared itself. ``digest`` becomes the messageDigest attribute; the
+    token signs only the signed attributes, once.
+
+    Returns the DER bytes to embed in the PDF's /Contents.
+    """
+    if len(digest) != 32:
+        raise ValueError("Digest must be a 32-byte SHA-256 value")
+    return get_cms_template(cert_data).sign(digest, sign_func)
@@ -4,6 +4,8 @@ from cryptography.hazmat.backends import default_backend
 from cryptography import x509
 import pkcs11
 import os
+import mmap
+import hashlib
 import datetime
 import sys
 from reportlab.pdfgen import canvas
@@ -12,6 +14,15 @@ from reportlab.lib.colors import Color
 from reportlab.lib.utils import ImageReader
 import io
 
+def hash_pdf_file(path):
+    """SHA-256 of a file through a read-only memory map, plus its size"""
+    with open(path, 'rb') as file:
+        size = os.fstat(file.fileno()).st_size
+        if size == 0:
+            return hashlib.sha256().digest(), 0
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            return hashlib.sha256(mapped).digest(), size
+
 def parse_certificate_info(cert_data):
     """Extract certificate information from DER encoded certificate"""
     try:
@@ -227,7 +238,7 @@ def add_visible_signature_to_pdf(input_pdf, output_pdf, cert_info, signature, ce
         traceback.print_exc()
         return False
 
-def sign_pdf_with_pkcs11(input_pdf, output_pdf, pkcs11_lib_path, pin='12345678'):
+def sign_pdf_with_pkcs11(input_pdf, output_pdf, pkcs11_lib_path, pin='12345678', token_serial=None):
     """
     Digitally sign a PDF using PKCS#11 hardware token with GUARANTEED visible signature
     """
@@ -262,7 +273,11 @@ def sign_pdf_with_pkcs11(input_pdf, output_pdf, pkcs11_lib_path, pin='12345678')
         if not tokens:
             raise Exception("No tokens found in any slot. Please insert your digital signature token.")
         
-        # Use first available token
+        # Use the requested token, or the first available one
+        if token_serial:
+            tokens = [t for t in tokens if t.serial.decode('ascii', 'ignore').strip() == token_serial]
+            if not tokens:
+                raise Exception(f"Requested token not present (serial={token_serial})")
         token = tokens[0]
         print(f"Using token: {token.label}")
         
@@ -316,23 +331,17 @@ def sign_pdf_with_pkcs11(input_pdf, output_pdf, pkcs11_lib_path, pin='12345678')
         print(f"✓ Issuer CN: {cert_info['issuer_cn']}")
         print(f"✓ Valid Until: {cert_info['not_after'].strftime('%Y-%m-%d')}")
         
-        # Read and hash PDF content
+        # Hash PDF content through a memory map (no full read into memory)
         print(f"Reading PDF: {input_pdf}")
-        with open(input_pdf, 'rb') as file:
-            pdf_content = file.read()
-            print(f"PDF size: {len(pdf_content)} bytes")
-            
-            # Create hash of PDF content
-            digest = hashes.Hash(hashes.SHA256(), backend=default_backend())
-            digest.update(pdf_content)
-            hash_value = digest.finalize()
-            print("✓ PDF hash computed")
-            
-            # Sign the hash
-            print("Signing hash...")
-            mechanism = pkcs11.Mechanism.SHA256_RSA_PKCS
-            signature = signable_key.sign(hash_value, mechanism=mechanism)
-            print(f"✓ Signature created: {len(signature)} bytes")
+        hash_value, pdf_size = hash_pdf_file(input_pdf)
+        print(f"PDF size: {pdf_size} bytes")
+        print("✓ PDF hash computed")
+        
+        # Sign the hash
+        print("Signing hash...")
+        mechanism = pkcs11.Mechanism.SHA256_RSA_PKCS
+        signature = signable_key.sign(hash_value, mechanism=mechanism)
+        print(f"✓ Signature created: {len(signature)} bytes")
         
         # Create final signed PDF with GUARANTEED visible signature
         signing_time = datetime.datetime.now()
@@ -384,7 +393,7 @@ def sign_pdf_with_pkcs11(input_pdf, output_pdf, pkcs11_lib_path, pin='12345678')
             except:
                 pass
 
-def sign_pdf_with_pkcs11_agent(pdf_bytes, output_pdf, pkcs11_lib_path, pin='12345678'):
+def sign_pdf_with_pkcs11_agent(pdf_bytes, output_pdf, pkcs11_lib_path, pin='12345678', token_serial=None):
     """
     Digitally sign a PDF using PKCS#11 hardware token with GUARANTEED visible signature
     """
@@ -419,7 +428,11 @@ def sign_pdf_with_pkcs11_agent(pdf_bytes, output_pdf, pkcs11_lib_path, pin='1234
         if not tokens:
             raise Exception("No tokens found in any slot. Please insert your digital signature token.")
         
-        # Use first available token
+        # Use the requested token, or the first available one
+        if token_serial:
+            tokens = [t for t in tokens if t.serial.decode('ascii', 'ignore').strip() == token_serial]
+            if not tokens:
+                raise Exception(f"Requested token not present (serial={token_serial})")
         token = tokens[0]
         print(f"Using token: {token.label}")
         
@@ -479,10 +492,8 @@ def sign_pdf_with_pkcs11_agent(pdf_bytes, output_pdf, pkcs11_lib_path, pin='1234
         #     pdf_content = file.read()
         #     print(f"PDF size: {len(pdf_content)} bytes")
         pdf_content = pdf_bytes 
-        # Create hash of PDF content
-        digest = hashes.Hash(hashes.SHA256(), backend=default_backend())
-        digest.update(pdf_content)
-        hash_value = digest.finalize()
+        # Create hash of PDF content (hashed in place, no copy)
+        hash_value = hashlib.sha256(pdf_content).digest()
         print("✓ PDF hash computed")
         
         # Sign the hash
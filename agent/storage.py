@@ -0,0 +1,126 @@
+# agent/storage.py
+import logging
+import os
+import queue
+import tempfile
+import threading
+
+from .config import SIGNED_SAVE_QUEUE_SIZE
+from .metrics import stage
+
+log = logging.getLogger(__name__)
+
+# Read once at import: os.umask can only be read by setting it, which is
+# not safe once other threads create files
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+
+def write_atomic(path, data):
+    """
+    Write ``data`` to ``path`` through a temp file in the same directory
+    and os.replace, so readers never see a half-written PDF. The file keeps
+    the mode of the one it replaces, or gets the usual 0666 minus umask
+    (mkstemp creates it 0600).
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(prefix=".tmp_", suffix=".pdf", dir=directory)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        try:
+            mode = os.stat(path).st_mode & 0o7777
+        except FileNotFoundError:
+            mode = 0o666 & ~_UMASK
+        os.chmod(tmp_path, mode)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+class SignedDocWriter:
+    """
+    Background writer saving signed PDFs to disk after the response has
+    been built. ``save()`` returns at once; when ``max_pending`` documents
+    are waiting it blocks, so a slow disk slows signing down instead of
+    filling memory.
+    """
+
+    def __init__(self, max_pending=SIGNED_SAVE_QUEUE_SIZE):
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._pending = {}
+        self._errors = {}
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def save(self, path, data):
+        with self._cond:
+            self._pending[path] = self._pending.get(path, 0) + 1
+            self._errors.pop(path, None)
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="signed-doc-writer", daemon=True
+                )
+                self._thread.start()
+        self._queue.put((path, data))
+
+    def wait_for(self, path, timeout=None):
+        """
+        Block until queued writes of ``path`` are on disk. Raises the write
+        error if saving failed; returns False on timeout.
+        """
+        with self._cond:
+            if not self._cond.wait_for(
+                lambda: path not in self._pending, timeout=timeout
+            ):
+                return False
+            error = self._errors.get(path)
+        if error is not None:
+            raise error
+        return True
+
+    def flush(self, timeout=None):
+        """Block until every queued document is written"""
+        with self._cond:
+            return self._cond.wait_for(lambda: not self._pending, timeout=timeout)
+
+    def pending(self):
+        with self._cond:
+            return sum(self._pending.values())
+
+    def _run(self):
+        while True:
+            path, data = self._queue.get()
+            error = None
+            try:
+                with stage("save"):
+                    write_atomic(path, data)
+                log.debug("Saved %s (%s bytes)", path, len(data))
+            except Exception as e:
+                log.warning("Failed to save %s: %s", path, e)
+                error = e
+            with self._cond:
+                self._pending[path] -= 1
+                if not self._pending[path]:
+                    del self._pending[path]
+                if error is not None:
+                    self._errors[path] = error
+                self._cond.notify_all()
+
+
+_WRITER = None
+_WRITER_LOCK = threading.Lock()
+
+
+def get_writer():
+    """Process-wide SignedDocWriter"""
+    global _WRITER
+    with _WRITER_LOCK:
+        if _WRITER is None:
+            _WRITER = SignedDocWriter()
+        return _WRITER
@@ -0,0 +1,155 @@
+# agent/token_monitor.py
+import logging
+import threading
+
+import pkcs11
+
+from .config import TOKEN_POLL_INTERVAL
+
+log = logging.getLogger(__name__)
+
+
+def describe_token(slot, token):
+    """Public details of a token for /status"""
+    serial = getattr(token, "serial", b"")
+    if isinstance(serial, bytes):
+        serial = serial.decode("ascii", "ignore")
+    return {
+        "slot_id": getattr(slot, "slot_id", None),
+        "label": str(getattr(token, "label", "")).strip(),
+        "serial": str(serial).strip(),
+        "model": str(getattr(token, "model", "")).strip(),
+        "manufacturer": str(getattr(token, "manufacturer_id", "")).strip(),
+    }
+
+
+class TokenMonitor(threading.Thread):
+    """
+    Background watcher keeping an in-memory view of the tokens present.
+
+    Slot events are read with C_WaitForSlotEvent(CKF_DONT_BLOCK) every
+    ``poll_interval`` seconds and only trigger a rescan when something
+    changed. Libraries without slot event support fall back to rescanning
+    the slot list every interval.
+
+    ``on_removed(serial)`` and ``on_inserted(info)`` are called from the
+    monitor thread when a token disappears or appears.
+    """
+
+    def __init__(
+        self,
+        load_lib,
+        poll_interval=TOKEN_POLL_INTERVAL,
+        on_removed=None,
+        on_inserted=None,
+    ):
+        super().__init__(name="pkcs11-token-monitor", daemon=True)
+        self.load_lib = load_lib
+        self.poll_interval = poll_interval
+        self.on_removed = on_removed
+        self.on_inserted = on_inserted
+        self.use_events = True
+        self.error = None
+        self._tokens = {}
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+        self._stop_event = threading.Event()
+
+    # ------------------------------------------------------------------
+    # In-memory view (read by request threads)
+    # ------------------------------------------------------------------
+
+    @property
+    def ready(self):
+        """True once the first slot scan has completed"""
+        return self._ready.is_set()
+
+    def wait_ready(self, timeout=None):
+        return self._ready.wait(timeout)
+
+    def snapshot(self):
+        """List of present tokens: slot_id, label, serial, model, manufacturer"""
+        with self._lock:
+            return [info for info, _ in self._tokens.values()]
+
+    def tokens(self):
+        """pkcs11 Token objects currently present, in slot order"""
+        with self._lock:
+            return [token for _, token in self._tokens.values()]
+
+    def is_present(self, serial):
+        with self._lock:
+            return any(info["serial"] == serial for info, _ in self._tokens.values())
+
+    def stop(self):
+        self._stop_event.set()
+
+    # ------------------------------------------------------------------
+    # Monitor thread
+    # ------------------------------------------------------------------
+
+    def rescan(self, lib):
+        tokens = {}
+        for slot in lib.get_slots(token_present=True):
+            try:
+                token = slot.get_token()
+            except Exception:
+                continue
+            info = describe_token(slot, token)
+            tokens[info["slot_id"]] = (info, token)
+
+        with self._lock:
+            previous = self._tokens
+            self._tokens = tokens
+        self._ready.set()
+
+        old = {info["serial"] for info, _ in previous.values()}
+        new = {info["serial"] for info, _ in tokens.values()}
+        for info, _ in previous.values():
+            if info["serial"] not in new:
+                log.info("Removed: %s (%s)", info["label"], info["serial"])
+                if self.on_removed is not None:
+                    self.on_removed(info["serial"])
+        for info, _ in tokens.values():
+            if info["serial"] not in old:
+                log.info("Inserted: %s (%s)", info["label"], info["serial"])
+                if self.on_inserted is not None:
+                    self.on_inserted(info)
+
+    def slot_events_pending(self, lib):
+        """Drain queued slot events; True if any slot changed"""
+        changed = False
+        try:
+            for _ in range(32):
+                lib.wait_for_slot_event(blocking=False)
+                changed = True
+        except pkcs11.exceptions.NoEvent:
+            pass
+        except (
+            AttributeError,
+            pkcs11.exceptions.FunctionNotSupported,
+            pkcs11.exceptions.ArgumentsBad,
+        ) as e:
+            log.warning("Slot events unavailable (%r), polling instead", e)
+            self.use_events = False
+            changed = True
+        return changed
+
+    def run(self):
+        lib = None
+        while not self._stop_event.is_set():
+            try:
+                if lib is None:
+                    lib = self.load_lib()
+                    self.error = None
+                    self.rescan(lib)
+                elif not self.use_events or self.slot_events_pending(lib):
+                    self.rescan(lib)
+            except Exception as e:
+                if lib is None:
+                    self.error = str(e) or repr(e)
+                    log.warning("PKCS11 library not available: %s", self.error)
+                    self._stop_event.wait(max(self.poll_interval, 10))
+                    continue
+                log.warning("Monitor error: %r", e)
+            self._stop_event.wait(self.poll_interval)
@@ -0,0 +1,164 @@
+# agent/token_objects.py
+import hashlib
+import logging
+
+from cryptography import x509
+from cryptography.hazmat.primitives.asymmetric import rsa
+from pkcs11.constants import Attribute, ObjectClass
+
+log = logging.getLogger(__name__)
+
+# Attributes read per object, in one call where the library allows it
+KEY_ATTRIBUTES = (Attribute.ID, Attribute.LABEL, Attribute.SIGN, Attribute.MODULUS)
+CERT_ATTRIBUTES = (Attribute.ID, Attribute.LABEL, Attribute.VALUE)
+
+
+def read_attributes(obj, attributes):
+    """
+    Several attributes of a PKCS#11 object with one C_GetAttributeValue
+    (Object.get_attributes) where python-pkcs11 and the token support it,
+    otherwise one attribute at a time. Unreadable attributes are None.
+    """
+    get_attributes = getattr(obj, "get_attributes", None)
+    if get_attributes is not None:
+        try:
+            values = get_attributes(attributes)
+            return {attribute: values.get(attribute) for attribute in attributes}
+        except Exception:
+            # Older library, or one attribute the token refuses
+            pass
+
+    values = {}
+    for attribute in attributes:
+        try:
+            values[attribute] = obj[attribute]
+        except Exception:
+            values[attribute] = None
+    return values
+
+
+def object_id(value):
+    """CKA_ID as hex, or None when the object has none"""
+    return bytes(value).hex() if value else None
+
+
+class TokenCertificate:
+    """A certificate object on the token, parsed once"""
+
+    def __init__(self, obj, attributes):
+        self.object = obj
+        self.cert_data = bytes(attributes[Attribute.VALUE])
+        self.label = attributes[Attribute.LABEL]
+        self.thumbprint = hashlib.sha256(self.cert_data).hexdigest()
+        # CKA_ID, or the thumbprint for tokens that do not set one
+        self.cka_id = object_id(attributes[Attribute.ID])
+        self.id = self.cka_id or self.thumbprint
+        self.certificate = x509.load_der_x509_certificate(self.cert_data)
+
+    @property
+    def modulus(self):
+        public_key = self.certificate.public_key()
+        if isinstance(public_key, rsa.RSAPublicKey):
+            return public_key.public_numbers().n
+        return None
+
+    @property
+    def for_signing(self):
+        """False for certificates whose key usage excludes signatures"""
+        try:
+            usage = self.certificate.extensions.get_extension_for_class(
+                x509.KeyUsage
+            ).value
+        except x509.ExtensionNotFound:
+            return True
+        return usage.digital_signature or usage.content_commitment
+
+
+class SessionObjectIndex:
+    """
+    Keys and certificates of one session, read once.
+
+    Private keys are paired with their certificate by CKA_ID (by RSA
+    modulus when the IDs are missing), so a token holding a signing and an
+    encryption certificate signs with the matching key. Pairs are looked up
+    by certificate thumbprint. With ``private=False`` (a public session)
+    only the certificates are read.
+    """
+
+    def __init__(self, session, private=True):
+        self.certificates = []
+        for obj in session.get_objects({Attribute.CLASS: ObjectClass.CERTIFICATE}):
+            attributes = read_attributes(obj, CERT_ATTRIBUTES)
+            if not attributes[Attribute.VALUE]:
+                continue
+            try:
+                self.certificates.append(TokenCertificate(obj, attributes))
+            except ValueError as e:
+                log.warning("Skipping unreadable certificate: %s", e)
+
+        self.keys = []
+        if private:
+            for obj in session.get_objects({Attribute.CLASS: ObjectClass.PRIVATE_KEY}):
+                attributes = read_attributes(obj, KEY_ATTRIBUTES)
+                # Keys without CKA_SIGN (e.g. decryption keys) are never used
+                if attributes[Attribute.SIGN] is False:
+                    continue
+                self.keys.append((obj, attributes))
+
+        self.pairs = {}
+        for key, attributes in self.keys:
+            certificate = self._certificate_for(attributes)
+            if certificate is not None:
+                self.pairs.setdefault(certificate.thumbprint, (key, certificate))
+
+    def _certificate_for(self, key_attributes):
+        key_id = object_id(key_attributes[Attribute.ID])
+        for certificate in self.certificates:
+            if key_id and certificate.cka_id == key_id:
+                return certificate
+
+        modulus = key_attributes[Attribute.MODULUS]
+        if modulus:
+            modulus = int.from_bytes(bytes(modulus), "big")
+            for certificate in self.certificates:
+                if certificate.modulus == modulus:
+                    return certificate
+        return None
+
+    def has_certificate(self, thumbprint):
+        return thumbprint.lower() in self.pairs
+
+    def owns(self, key):
+        return any(pair_key is key for pair_key, _ in self.pairs.values())
+
+    def pair(self, thumbprint=None):
+        """
+        (private key, TokenCertificate) for the certificate with
+        ``thumbprint``; by default the first pair whose certificate allows
+        signing.
+        """
+        if thumbprint:
+            pair = self.pairs.get(thumbprint.lower())
+            if pair is None:
+                raise Exception(
+                    f"No private key on the token for certificate {thumbprint}"
+                )
+            return pair
+
+        for key, certificate in self.pairs.values():
+            if certificate.for_signing:
+                return key, certificate
+        if self.pairs:
+            return next(iter(self.pairs.values()))
+
+        if not self.keys:
+            raise Exception("No private keys found in token")
+        if not self.certificates:
+            raise Exception("No certificates found in token")
+
+        # Neither CKA_ID nor modulus matched: first key and certificate
+        log.warning("No key/certificate pair matched, using first of each")
+        key, _ = self.keys[0]
+        certificate = self.certificates[0]
+        self.pairs[certificate.thumbprint] = (key, certificate)
+        return key, certificate
@@ -1,4 +1,5 @@
 # agent/tray_gui.py
+import logging
 import threading
 import pystray
 from PIL import Image, ImageDraw
@@ -7,12 +8,18 @@ import sys
 import time
 import signal
 import warnings
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.serving import BaseWSGIServer
 
 # Suppress pystray warnings
 warnings.filterwarnings("ignore", category=DeprecationWarning)
 
+from .config import HTTP_WORKERS
 from .main import app, PORT
 
+log = logging.getLogger(__name__)
+
 
 def get_resource_path(relative_path):
     """Get absolute path to resource, works for dev and for PyInstaller"""
@@ -61,48 +68,82 @@ def create_image():
             os.path.join(os.path.dirname(sys.argv[0]), "common", "images", "logo.png"),
         ]
 
-        print(f"[DEBUG] Looking for logo.png...")
+        log.debug("Looking for logo.png...")
         for img_path in possible_paths:
             if img_path and os.path.exists(img_path):
-                print(f"[DEBUG] Loading image from: {img_path}")
+                log.debug("Loading image from: %s", img_path)
                 return Image.open(img_path)
             else:
-                print(f"[DEBUG] Not found: {img_path}")
+                log.debug("Not found: %s", img_path)
 
         # If no image found, create a simple fallback
-        print("[DEBUG] Logo image not found in any location, creating fallback image")
+        log.debug("Logo image not found in any location, creating fallback image")
         return create_fallback_image()
 
     except Exception as e:
-        print(f"[DEBUG] Error loading tray icon: {e}")
+        log.warning("Error loading tray icon: %s", e)
         return create_fallback_image()
 
 
+class PooledWSGIServer(BaseWSGIServer):
+    """werkzeug server handing each request to a fixed pool of threads"""
+
+    multithread = True
+
+    def __init__(self, host, port, app, workers=HTTP_WORKERS):
+        super().__init__(host, port, app)
+        self.executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="http-worker"
+        )
+
+    def process_request(self, request, client_address):
+        self.executor.submit(self.process_request_thread, request, client_address)
+
+    def process_request_thread(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def server_close(self):
+        super().server_close()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
 class StoppableFlaskThread(threading.Thread):
     def __init__(self):
         super().__init__(daemon=True)
         self._stop_event = threading.Event()
+        self._serving = threading.Event()
+        self.server = None
 
     def stop(self):
         """Stop the Flask thread"""
         self._stop_event.set()
+        if self._serving.is_set():
+            self.server.shutdown()
 
     def run(self):
         """Run Flask app in a separate thread"""
         try:
-            print(f"Starting Digital Signature Agent on http://127.0.0.1:{PORT}")
-            # Use development server for simplicity
-            from werkzeug.serving import make_server
+            log.info("Starting Digital Signature Agent on http://127.0.0.1:%s", PORT)
+            self.server = PooledWSGIServer("127.0.0.1", PORT, app)
+            log.info("Flask server started successfully (%s workers)", HTTP_WORKERS)
 
-            server = make_server("127.0.0.1", PORT, app)
-            print("Flask server started successfully")
+            if self._stop_event.is_set():
+                return
 
-            # Serve until stopped
-            while not self._stop_event.is_set():
-                server.handle_request()
+            # Serve until stop() calls shutdown()
+            self._serving.set()
+            self.server.serve_forever()
 
         except Exception as e:
-            print(f"Flask error: {e}")
+            log.warning("Flask error: %s", e)
+        finally:
+            if self.server is not None:
+                self.server.server_close()
 
 
 class TrayApp:
@@ -117,7 +158,7 @@ class TrayApp:
         def signal_handler(sig, frame):
             if not self.shutting_down:
                 self.shutting_down = True
-                print(f"\nReceived signal {sig}, shutting down gracefully...")
+                log.info("Received signal %s, shutting down gracefully...", sig)
                 self.stop_app()
 
         signal.signal(signal.SIGINT, signal_handler)
@@ -129,32 +170,50 @@ class TrayApp:
             return
 
         self.shutting_down = True
-        print("Stopping Digital Signature Agent...")
+        log.info("Stopping Digital Signature Agent...")
 
         # Stop Flask thread
         if self.flask_thread and self.flask_thread.is_alive():
-            print("Stopping Flask server...")
+            log.info("Stopping Flask server...")
             self.flask_thread.stop()
-            # Send a request to wake up the server
-            try:
-                import requests
-
-                requests.get(f"http://127.0.0.1:{PORT}/", timeout=0.5)
-            except:
-                pass
             self.flask_thread.join(timeout=5)
 
+        # Finish writing signed documents still queued for disk
+        try:
+            from .storage import get_writer
+
+            if not get_writer().flush(timeout=10):
+                log.warning("Some signed documents could not be saved in time")
+        except Exception as e:
+            log.warning("Signed document writer error: %s", e)
+
+        # Stop the overlay preparation processes
+        try:
+            from .pipeline import shutdown_prepare_pool
+
+            shutdown_prepare_pool()
+        except Exception as e:
+            log.warning("Prepare pool error: %s", e)
+
+        # Log out of any token sessions kept open between requests
+        try:
+            from .pkcs11_utils import get_manager
+
+            get_manager().logout()
+        except Exception as e:
+            log.warning("Token logout error: %s", e)
+
         # Stop tray icon
         if self.icon:
-            print("Stopping tray icon...")
+            log.info("Stopping tray icon...")
             self.icon.stop()
 
-        print("Shutdown complete.")
+        log.info("Shutdown complete.")
         os._exit(0)
 
     def on_quit(self, icon):
         """Handle quit from tray menu"""
-        print("Quit requested from tray menu")
+        log.info("Quit requested from tray menu")
         self.stop_app()
 
     def run_flask(self):
@@ -176,13 +235,13 @@ class TrayApp:
             ),
         )
 
-        print("Tray icon started. Use 'Quit' from tray menu to exit.")
-        print("You can also close the console window to exit.")
+        log.info("Tray icon started. Use 'Quit' from tray menu to exit.")
+        log.info("You can also close the console window to exit.")
 
         try:
             self.icon.run()
         except Exception as e:
-            print(f"Tray error: {e}")
+            log.warning("Tray error: %s", e)
             self.stop_app()
 
     def show_info(self, icon=None, item=None):
@@ -204,6 +263,14 @@ class TrayApp:
         """Start the application"""
         self.setup_signal_handlers()
 
+        # Load the PKCS#11 library and start watching for tokens right away
+        try:
+            from .pkcs11_utils import get_manager
+
+            get_manager()
+        except Exception as e:
+            log.warning("Token monitor error: %s", e)
+
         # Start Flask
         self.run_flask()
 
@@ -0,0 +1,359 @@
+# benchmarks/bench_signing.py
+"""
+End-to-end signing benchmark against a SoftHSMv2 token, so signing
+performance can be measured without a Watchdata dongle.
+
+    python benchmarks/bench_signing.py --iterations 20
+    python benchmarks/bench_signing.py --compare benchmarks/results/<old>.json
+
+Targets:
+    manager  PKCS11Manager.sign_pdf, file to file, token session reused
+    agent    singlepage_digital_sign.sign_pdf_with_pkcs11_agent, one login
+             per document
+    route    POST /sign-pdf through the Flask app (raw PDF upload, PDF back)
+
+Each synthetic document profile (see synthetic_pdfs.PROFILES) is signed
+``--iterations`` times per target after ``--warmup`` unmeasured runs.
+Latency percentiles, documents per second and the environment are
+written as JSON to benchmarks/results/. With ``--compare`` the p50 of
+every target/document is checked against an earlier result file; the
+exit status is 1 when one got slower than ``--threshold``.
+
+Requires softhsm2 (softhsm2-util and libsofthsm2) installed.
+"""
+import argparse
+import contextlib
+import datetime
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+from softhsm_token import SoftHSMToken  # noqa: E402
+from synthetic_pdfs import DEFAULT_PROFILES, PROFILES, write_profiles  # noqa: E402
+
+RESULTS_DIR = os.path.join(REPO_DIR, "benchmarks", "results")
+TARGETS = ("manager", "agent", "route")
+
+# Versions recorded with every result, since they move signing time most
+PACKAGES = (
+    "python-pkcs11",
+    "PyPDF2",
+    "reportlab",
+    "endesive",
+    "cryptography",
+    "pillow",
+    "Flask",
+)
+
+
+def percentile(ordered, q):
+    """``q`` (0-100) percentile of sorted values, linearly interpolated"""
+    if len(ordered) == 1:
+        return ordered[0]
+    rank = (len(ordered) - 1) * q / 100
+    low = int(rank)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+
+def summarize(latencies, errors, wall_seconds):
+    ordered = sorted(latencies)
+    summary = {
+        "samples": len(ordered),
+        "errors": errors,
+        "latency_ms": None,
+        "docs_per_sec": 0.0,
+    }
+    if ordered:
+        summary["latency_ms"] = {
+            name: round(value * 1000, 3)
+            for name, value in (
+                ("min", ordered[0]),
+                ("p50", percentile(ordered, 50)),
+                ("p90", percentile(ordered, 90)),
+                ("p95", percentile(ordered, 95)),
+                ("p99", percentile(ordered, 99)),
+                ("max", ordered[-1]),
+                ("mean", sum(ordered) / len(ordered)),
+            )
+        }
+        summary["docs_per_sec"] = round(len(ordered) / wall_seconds, 3)
+    return summary
+
+
+def manager_target(token, workdir, mode):
+    from agent.pkcs11_utils import get_manager
+
+    manager = get_manager(token.module)
+    output = os.path.join(workdir, "manager-signed.pdf")
+
+    def run(name, path, data):
+        signed = manager.sign_pdf(
+            path, output, token.pin, mode=mode, serial=token.serial
+        )
+        if not signed:
+            raise Exception("sign_pdf returned False")
+
+    return run, manager.logout
+
+
+def agent_target(token, workdir, mode):
+    from agent.singlepage_digital_sign import sign_pdf_with_pkcs11_agent
+
+    output = os.path.join(workdir, "agent-signed.pdf")
+
+    def run(name, path, data):
+        # The standalone signer prints its progress; keep it off the report
+        with contextlib.redirect_stdout(io.StringIO()):
+            signed, _, _ = sign_pdf_with_pkcs11_agent(
+                data, output, token.module, token.pin, token_serial=token.serial
+            )
+        if not signed:
+            raise Exception("sign_pdf_with_pkcs11_agent failed")
+
+    return run, None
+
+
+def route_target(token, workdir, mode, save_signed=False):
+    import agent.config as config
+    from agent.pkcs11_utils import get_manager
+
+    # The routes use the process-wide manager; create it on the SoftHSM
+    # module whatever PKCS11_PATH was when agent.config was first imported
+    get_manager(token.module)
+    from agent.main import app
+
+    config.SAVE_SIGNED_DOCS = save_signed
+    client = app.test_client()
+
+    def run(name, path, data):
+        response = client.post(
+            "/sign-pdf",
+            data=data,
+            content_type="application/pdf",
+            query_string={
+                "pdf_filename": f"{name}.pdf",
+                "signing_mode": mode,
+                "token_serial": token.serial,
+            },
+            headers={"X-Token-Pin": token.pin, "Accept": "application/pdf"},
+        )
+        if response.status_code != 200:
+            raise Exception(
+                f"/sign-pdf returned {response.status_code}: "
+                f"{response.get_data(as_text=True)[:200]}"
+            )
+
+    return run, lambda: get_manager(token.module).logout()
+
+
+def measure(run, documents, iterations, warmup):
+    """Yields (document name, summary) for each document"""
+    for name, path in documents:
+        with open(path, "rb") as f:
+            data = f.read()
+
+        for _ in range(warmup):
+            try:
+                run(name, path, data)
+            except Exception:
+                pass
+
+        latencies, errors, first_error = [], 0, None
+        started = time.perf_counter()
+        for _ in range(iterations):
+            call_started = time.perf_counter()
+            try:
+                run(name, path, data)
+            except Exception as e:
+                errors += 1
+                first_error = first_error or repr(e)
+                continue
+            latencies.append(time.perf_counter() - call_started)
+        summary = summarize(latencies, errors, time.perf_counter() - started)
+        summary["size_bytes"] = len(data)
+        summary["pages"] = PROFILES[name][0]
+        if first_error:
+            summary["first_error"] = first_error
+        yield name, summary
+
+
+def environment(token):
+    from importlib import metadata
+
+    from agent.config import SIGNING_MODE
+    from agent.version import __build__, __version__
+
+    packages = {}
+    for package in PACKAGES:
+        try:
+            packages[package] = metadata.version(package)
+        except metadata.PackageNotFoundError:
+            packages[package] = None
+
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=REPO_DIR,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+
+    return {
+        "agent_version": __version__,
+        "build": __build__,
+        "git_commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "packages": packages,
+        "pkcs11_module": token.module,
+        "default_signing_mode": SIGNING_MODE,
+    }
+
+
+def compare(baseline_path, results, threshold):
+    """Print p50 changes against a previous result file; returns regressions"""
+    with open(baseline_path) as f:
+        baseline = {
+            (result["target"], result["document"]): result
+            for result in json.load(f)["results"]
+        }
+
+    regressions = []
+    print(f"\nCompared with {baseline_path}:")
+    for result in results:
+        key = (result["target"], result["document"])
+        old = baseline.get(key)
+        if not old or not old["latency_ms"] or not result["latency_ms"]:
+            continue
+        before, after = old["latency_ms"]["p50"], result["latency_ms"]["p50"]
+        change = (after - before) / before if before else 0.0
+        flag = "  REGRESSION" if change > threshold else ""
+        print(
+            f"  {key[0]:<8} {key[1]:<16} p50 {before:9.1f} -> {after:9.1f} ms "
+            f"({change:+.1%}){flag}"
+        )
+        if flag:
+            regressions.append(key)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--module", help="libsofthsm2 path (default: search)")
+    parser.add_argument("--pin", default="12345678")
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--warmup", type=int, default=2)
+    parser.add_argument(
+        "--documents",
+        nargs="+",
+        default=list(DEFAULT_PROFILES),
+        choices=sorted(PROFILES),
+    )
+    parser.add_argument(
+        "--targets", nargs="+", default=list(TARGETS), choices=TARGETS
+    )
+    parser.add_argument("--mode", choices=("overlay", "incremental"))
+    parser.add_argument("--output", help="result file (default: benchmarks/results/)")
+    parser.add_argument("--compare", help="earlier result file to compare with")
+    parser.add_argument("--threshold", type=float, default=0.10)
+    parser.add_argument(
+        "--save-signed",
+        action="store_true",
+        help="let /sign-pdf save signed copies to signed_docs like the agent",
+    )
+    parser.add_argument("--keep-token", action="store_true")
+    args = parser.parse_args()
+
+    # Agent INFO lines would interleave with the report
+    os.environ.setdefault("AGENT_LOG_LEVEL", "WARNING")
+
+    factories = {
+        "manager": manager_target,
+        "agent": agent_target,
+        "route": lambda token, workdir, mode: route_target(
+            token, workdir, mode, args.save_signed
+        ),
+    }
+
+    results = []
+    with contextlib.ExitStack() as stack:
+        workdir = stack.enter_context(
+            tempfile.TemporaryDirectory(prefix="agent-bench-")
+        )
+        try:
+            token = stack.enter_context(
+                SoftHSMToken(args.module, pin=args.pin, keep=args.keep_token)
+            )
+        except Exception as e:
+            print(f"Cannot set up the SoftHSM token: {e}", file=sys.stderr)
+            return 2
+        documents = write_profiles(os.path.join(workdir, "documents"), args.documents)
+        print(f"Token {token.serial} on {token.module}")
+
+        # Only now: agent.config reads AGENT_PKCS11_PATH, set by SoftHSMToken
+        import agent.config as config
+
+        # Every iteration signs the same document; answering from the signed
+        # store would measure a file read, not signing
+        config.SIGNED_STORE_ENABLED = False
+
+        for target in args.targets:
+            run, teardown = factories[target](token, workdir, args.mode)
+            try:
+                for name, summary in measure(
+                    run, documents, args.iterations, args.warmup
+                ):
+                    results.append({"target": target, "document": name, **summary})
+                    latency = summary["latency_ms"] or {}
+                    print(
+                        f"{target:<8} {name:<16} "
+                        f"p50 {latency.get('p50', 0):9.1f} ms  "
+                        f"p95 {latency.get('p95', 0):9.1f} ms  "
+                        f"{summary['docs_per_sec']:7.2f} docs/s  "
+                        f"errors {summary['errors']}"
+                    )
+            finally:
+                # Each target logs in on its own
+                if teardown is not None:
+                    teardown()
+
+        report = {
+            "suite": "signing",
+            "created": datetime.datetime.now().astimezone().isoformat(),
+            "iterations": args.iterations,
+            "warmup": args.warmup,
+            "signing_mode": args.mode,
+            "environment": environment(token),
+            "results": results,
+        }
+
+    output = args.output
+    if output is None:
+        stamp = datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
+        version = report["environment"]["agent_version"]
+        output = os.path.join(RESULTS_DIR, f"signing-{version}-{stamp}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {output}")
+
+    if args.compare and compare(args.compare, results, args.threshold):
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,339 @@
+# benchmarks/loadtest.py
+"""
+Load generator replaying the portal's bulk signing flow against a
+running agent: per application /cert-info, /sign-pdf (the agent fetches
+the PDF from PDF_SOURCE_BASE_URL) and /save-signed-pdf/ on the portal,
+as the Django page in the README does, from ``--concurrency`` browsers
+at once.
+
+The portal is played by portal_stub.PortalStub, started in this process
+on ``--portal-port`` unless ``--portal-url`` names one already running.
+The agent has to fetch from it:
+
+    AGENT_PDF_SOURCE_BASE_URL=http://127.0.0.1:8765/uploads/unsigned_docs/ \\
+        python -m agent.main
+    python benchmarks/loadtest.py --applications 200 --concurrency 4 \\
+        --latency-ms 80 --jitter-ms 40 --sizes 1-page 10-pages 5-pages-images
+
+Prints and saves (benchmarks/results/loadtest-*.json) throughput, latency
+percentiles per step and per flow, the error mix by error_type, and how
+the agent's own stage timers (GET /metrics) moved during the run.
+"""
+import argparse
+import datetime
+import json
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+
+import requests
+
+from bench_signing import RESULTS_DIR, percentile
+from portal_stub import PortalStub
+from synthetic_pdfs import PROFILES
+
+STEPS = ("cert_info", "sign", "save")
+
+_STAGE_SAMPLE = re.compile(
+    r'^agent_stage_seconds_(sum|count)\{stage="([^"]+)"\} (\S+)$', re.MULTILINE
+)
+
+
+class FlowError(Exception):
+    def __init__(self, step, error_type, message=""):
+        super().__init__(message or error_type)
+        self.step = step
+        self.error_type = error_type
+
+
+def error_type_of(response):
+    """error_type from an agent error body, else the HTTP status"""
+    try:
+        payload = response.json()
+    except ValueError:
+        payload = None
+    if isinstance(payload, dict) and payload.get("error_type"):
+        return payload["error_type"], payload.get("error", "")
+    return f"http_{response.status_code}", response.text[:200]
+
+
+class LoadTest:
+    def __init__(self, agent_url, save_url, pin, prefix, timeout, cert_info):
+        self.agent_url = agent_url.rstrip("/")
+        self.save_url = save_url
+        self.pin = pin
+        self.prefix = prefix
+        self.timeout = timeout
+        self.cert_info = cert_info
+
+        self.latencies = defaultdict(list)
+        self.errors = Counter()
+        self.error_samples = {}
+        self.completed = 0
+        self._lock = threading.Lock()
+
+    def _call(self, step, method, url, **kwargs):
+        started = time.perf_counter()
+        try:
+            response = method(url, timeout=self.timeout, **kwargs)
+        except requests.Timeout as e:
+            raise FlowError(step, "timeout", str(e))
+        except requests.ConnectionError as e:
+            raise FlowError(step, "connection_error", str(e))
+        elapsed = time.perf_counter() - started
+
+        if response.status_code != 200:
+            raise FlowError(step, *error_type_of(response))
+        with self._lock:
+            self.latencies[step].append(elapsed)
+        return response
+
+    def flow(self, session, number, verify_pin):
+        """One application, as signSingleApplication in the README"""
+        app_no = f"{self.prefix}{number:06d}"
+
+        if verify_pin:
+            cert = self._call(
+                "cert_info",
+                session.post,
+                f"{self.agent_url}/cert-info",
+                json={"pin": self.pin},
+            ).json()
+            if cert.get("error_type") or cert.get("error"):
+                raise FlowError("cert_info", cert.get("error_type") or "error")
+
+        signed = self._call(
+            "sign",
+            session.post,
+            f"{self.agent_url}/sign-pdf",
+            json={"pin": self.pin, "pdf_filename": f"unsingedDoc_{app_no}.pdf"},
+        ).json()
+        if not signed.get("signed_pdf"):
+            raise FlowError("sign", "no_signed_pdf")
+
+        self._call(
+            "save",
+            session.post,
+            self.save_url,
+            data={
+                "pdf_base64": signed["signed_pdf"],
+                "filename": f"signedDoc_{app_no}.pdf",
+                "original_app_no": app_no,
+            },
+        )
+
+    def worker(self, numbers):
+        session = requests.Session()
+        verified = False
+        while True:
+            with self._lock:
+                number = next(numbers, None)
+            if number is None:
+                return
+
+            started = time.perf_counter()
+            try:
+                self.flow(session, number, self.cert_info == "each" or not verified)
+            except FlowError as e:
+                with self._lock:
+                    key = f"{e.step}:{e.error_type}"
+                    self.errors[key] += 1
+                    self.error_samples.setdefault(key, str(e))
+                continue
+            verified = True
+            with self._lock:
+                self.latencies["flow"].append(time.perf_counter() - started)
+                self.completed += 1
+
+    def run(self, applications, concurrency):
+        numbers = iter(range(1, applications + 1))
+        threads = [
+            threading.Thread(target=self.worker, args=(numbers,), name=f"user-{i}")
+            for i in range(concurrency)
+        ]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return time.perf_counter() - started
+
+
+def latency_summary(values):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return {
+        "samples": len(ordered),
+        "p50": round(percentile(ordered, 50) * 1000, 3),
+        "p90": round(percentile(ordered, 90) * 1000, 3),
+        "p95": round(percentile(ordered, 95) * 1000, 3),
+        "p99": round(percentile(ordered, 99) * 1000, 3),
+        "max": round(ordered[-1] * 1000, 3),
+        "mean": round(sum(ordered) / len(ordered) * 1000, 3),
+    }
+
+
+def stage_totals(agent_url):
+    """{stage: [seconds, count]} from the agent's /metrics, or None"""
+    try:
+        response = requests.get(f"{agent_url.rstrip('/')}/metrics", timeout=10)
+        response.raise_for_status()
+    except requests.RequestException:
+        return None
+    totals = defaultdict(lambda: [0.0, 0])
+    for kind, stage, value in _STAGE_SAMPLE.findall(response.text):
+        totals[stage][0 if kind == "sum" else 1] = float(value)
+    return totals
+
+
+def stage_deltas(before, after):
+    """Mean milliseconds and count per agent stage during the run"""
+    if before is None or after is None:
+        return None
+    deltas = {}
+    for stage, (seconds, count) in sorted(after.items()):
+        old_seconds, old_count = before.get(stage, (0.0, 0))
+        calls = int(count - old_count)
+        if calls > 0:
+            deltas[stage] = {
+                "count": calls,
+                "mean_ms": round((seconds - old_seconds) / calls * 1000, 3),
+            }
+    return deltas
+
+
+def print_report(report):
+    print(
+        f"\n{report['completed']}/{report['applications']} flows in "
+        f"{report['wall_seconds']:.1f}s: {report['flows_per_sec']:.2f} flows/s "
+        f"at concurrency {report['concurrency']}"
+    )
+    for step in STEPS + ("flow",):
+        summary = report["latency_ms"].get(step)
+        if summary:
+            print(
+                f"  {step:<10} p50 {summary['p50']:9.1f}  p90 {summary['p90']:9.1f}  "
+                f"p99 {summary['p99']:9.1f}  max {summary['max']:9.1f} ms"
+            )
+    if report["errors"]:
+        print("Errors:")
+        for key, count in sorted(report["errors"].items(), key=lambda e: -e[1]):
+            print(f"  {count:6d}  {key}  ({report['error_samples'][key][:100]})")
+    if report["agent_stages"]:
+        print("Agent stages (mean ms):")
+        for stage, delta in report["agent_stages"].items():
+            print(f"  {stage:<18} {delta['mean_ms']:9.1f}  x{delta['count']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--agent", default="http://127.0.0.1:5001")
+    parser.add_argument("--pin", default="12345678")
+    parser.add_argument("--applications", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument(
+        "--cert-info",
+        choices=("each", "once"),
+        default="each",
+        help="verify the PIN before every application (README flow) or once",
+    )
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument(
+        "--prefix",
+        help="application number prefix (default: unique per run, so no "
+        "document repeats between runs)",
+    )
+    parser.add_argument("--portal-url", help="use a running portal stand-in")
+    parser.add_argument("--portal-host", default="127.0.0.1")
+    parser.add_argument("--portal-port", type=int, default=8765)
+    parser.add_argument("--latency-ms", type=float, default=0)
+    parser.add_argument("--jitter-ms", type=float, default=0)
+    parser.add_argument("--save-latency-ms", type=float, default=0)
+    parser.add_argument(
+        "--sizes", nargs="+", default=["1-page"], choices=sorted(PROFILES)
+    )
+    parser.add_argument("--missing-rate", type=float, default=0.0)
+    parser.add_argument("--output", help="result file (default: benchmarks/results/)")
+    args = parser.parse_args()
+
+    try:
+        status = requests.get(f"{args.agent}/status", timeout=10).json()
+    except (requests.RequestException, ValueError) as e:
+        print(f"Agent not reachable at {args.agent}: {e}", file=sys.stderr)
+        return 2
+    print(f"Agent {args.agent}: tokens {status.get('tokens')}")
+
+    stub = None
+    if args.portal_url:
+        save_url = args.portal_url.rstrip("/") + "/save-signed-pdf/"
+    else:
+        stub = PortalStub(
+            args.portal_host,
+            args.portal_port,
+            latency_ms=args.latency_ms,
+            jitter_ms=args.jitter_ms,
+            sizes=args.sizes,
+            missing_rate=args.missing_rate,
+            save_latency_ms=args.save_latency_ms,
+        ).start()
+        save_url = stub.save_url
+        print(f"Portal stand-in: AGENT_PDF_SOURCE_BASE_URL={stub.source_base_url}")
+
+    prefix = args.prefix or datetime.datetime.now().strftime("LT%H%M%S")
+    test = LoadTest(
+        args.agent, save_url, args.pin, prefix, args.timeout, args.cert_info
+    )
+    before = stage_totals(args.agent)
+    try:
+        wall = test.run(args.applications, max(1, args.concurrency))
+    finally:
+        if stub is not None:
+            stub.stop()
+    after = stage_totals(args.agent)
+
+    report = {
+        "suite": "loadtest",
+        "created": datetime.datetime.now().astimezone().isoformat(),
+        "agent": args.agent,
+        "applications": args.applications,
+        "concurrency": args.concurrency,
+        "cert_info": args.cert_info,
+        "portal": {
+            "url": args.portal_url or stub.base_url,
+            "latency_ms": args.latency_ms,
+            "jitter_ms": args.jitter_ms,
+            "save_latency_ms": args.save_latency_ms,
+            "sizes": args.sizes,
+            "missing_rate": args.missing_rate,
+            "stats": stub.stats if stub is not None else None,
+        },
+        "completed": test.completed,
+        "failed": sum(test.errors.values()),
+        "wall_seconds": round(wall, 3),
+        "flows_per_sec": round(test.completed / wall, 3) if wall else 0.0,
+        "latency_ms": {
+            step: latency_summary(values) for step, values in test.latencies.items()
+        },
+        "errors": dict(test.errors),
+        "error_samples": test.error_samples,
+        "agent_stages": stage_deltas(before, after),
+    }
+    print_report(report)
+
+    output = args.output
+    if output is None:
+        stamp = datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
+        output = os.path.join(RESULTS_DIR, f"loadtest-{stamp}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
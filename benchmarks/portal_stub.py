@@ -0,0 +1,221 @@
+# benchmarks/portal_stub.py
+"""
+Stand-in for the Django portal during load tests: serves unsigned PDFs
+the way PDF_SOURCE_BASE_URL does and accepts /save-signed-pdf/ uploads,
+with configurable latency, document sizes and missing documents.
+
+    python benchmarks/portal_stub.py --port 8765 --latency-ms 80
+
+then start the agent with
+AGENT_PDF_SOURCE_BASE_URL=http://127.0.0.1:8765/uploads/unsigned_docs/
+"""
+import argparse
+import base64
+import binascii
+import hashlib
+import json
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+from synthetic_pdfs import PROFILES, make_pdf
+
+UNSIGNED_PREFIX = "/uploads/unsigned_docs/"
+SAVE_PATH = "/save-signed-pdf/"
+
+
+class PortalStub:
+    """
+    Threaded HTTP server on ``host:port`` (0 picks a free port).
+
+    Each document name maps to one of ``sizes`` (synthetic_pdfs profile
+    names) by its hash, so a name always gets the same size. Documents of
+    one profile share their pages; the name is written into each copy, so
+    every application still has its own bytes and hash. ``missing_rate``
+    of the names answer 404, like applications whose PDF was never
+    generated. Latency is ``latency_ms`` plus up to ``jitter_ms``.
+    """
+
+    def __init__(
+        self,
+        host="127.0.0.1",
+        port=0,
+        latency_ms=0,
+        jitter_ms=0,
+        sizes=("1-page",),
+        missing_rate=0.0,
+        save_latency_ms=0,
+    ):
+        for size in sizes:
+            if size not in PROFILES:
+                raise ValueError(f"Unknown document profile: {size}")
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.sizes = list(sizes)
+        self.missing_rate = missing_rate
+        self.save_latency_ms = save_latency_ms
+
+        self.stats = {"fetched": 0, "missing": 0, "saved": 0, "rejected": 0}
+        self.bytes_served = 0
+        self._templates = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+        stub = self
+
+        class Handler(StubHandler):
+            portal = stub
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+
+    @property
+    def base_url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def source_base_url(self):
+        """Value for AGENT_PDF_SOURCE_BASE_URL"""
+        return self.base_url + UNSIGNED_PREFIX
+
+    @property
+    def save_url(self):
+        return self.base_url + SAVE_PATH
+
+    def start(self):
+        self._thread = threading.Thread(
+            target=self.server.serve_forever, name="portal-stub", daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _pick(self, name):
+        digest = hashlib.sha256(name.encode()).digest()
+        missing = int.from_bytes(digest[:4], "big") / 2**32 < self.missing_rate
+        return missing, self.sizes[digest[4] % len(self.sizes)]
+
+    def document(self, name):
+        """PDF bytes for ``name``, or None when it is one of the missing ones"""
+        missing, size = self._pick(name)
+        if missing:
+            return None
+        with self._lock:
+            template = self._templates.get(size)
+            if template is None:
+                template = self._templates[size] = make_pdf(*PROFILES[size])
+        # A comment before the trailer keeps every xref offset valid
+        marker = template.rindex(b"startxref")
+        return template[:marker] + f"% {name}\n".encode() + template[marker:]
+
+    def delay(self, milliseconds, jitter=0):
+        if milliseconds or jitter:
+            time.sleep((milliseconds + random.uniform(0, jitter)) / 1000)
+
+    def count(self, key, nbytes=0):
+        with self._lock:
+            self.stats[key] += 1
+            self.bytes_served += nbytes
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    portal = None
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status, body, content_type="application/json"):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if not self.path.startswith(UNSIGNED_PREFIX):
+            self._send(404, b'{"error": "not found"}')
+            return
+        name = self.path[len(UNSIGNED_PREFIX) :].split("?")[0]
+        portal = self.portal
+        portal.delay(portal.latency_ms, portal.jitter_ms)
+
+        data = portal.document(name)
+        if data is None:
+            portal.count("missing")
+            self._send(404, b"Not Found", "text/plain")
+            return
+        portal.count("fetched", len(data))
+        self._send(200, data, "application/pdf")
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length)
+        if self.path.split("?")[0] != SAVE_PATH:
+            self._send(404, b'{"error": "not found"}')
+            return
+
+        portal = self.portal
+        portal.delay(portal.save_latency_ms)
+        form = parse_qs(body.decode("ascii", "replace"))
+        try:
+            pdf = base64.b64decode(form["pdf_base64"][0], validate=True)
+            if not pdf.startswith(b"%PDF") or not form.get("filename"):
+                raise ValueError("not a signed PDF")
+        except (KeyError, ValueError, binascii.Error) as e:
+            portal.count("rejected")
+            self._send(400, json.dumps({"error": str(e)}).encode())
+            return
+        portal.count("saved")
+        self._send(200, json.dumps({"status": "saved"}).encode())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency-ms", type=float, default=0)
+    parser.add_argument("--jitter-ms", type=float, default=0)
+    parser.add_argument("--save-latency-ms", type=float, default=0)
+    parser.add_argument(
+        "--sizes", nargs="+", default=["1-page"], choices=sorted(PROFILES)
+    )
+    parser.add_argument("--missing-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    stub = PortalStub(
+        args.host,
+        args.port,
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        sizes=args.sizes,
+        missing_rate=args.missing_rate,
+        save_latency_ms=args.save_latency_ms,
+    )
+    print(f"AGENT_PDF_SOURCE_BASE_URL={stub.source_base_url}")
+    print(f"Save endpoint: {stub.save_url}  (Ctrl+C to stop)")
+    try:
+        stub.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stub.server.server_close()
+        print(json.dumps(stub.stats))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,185 @@
+# benchmarks/softhsm_token.py
+"""
+A throwaway SoftHSMv2 token standing in for the Watchdata dongle: a fresh
+token directory, one RSA key and a self-signed signing certificate
+sharing a CKA_ID, as on the real token.
+"""
+import datetime
+import glob
+import os
+import shutil
+import subprocess
+import tempfile
+
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.x509.oid import NameOID
+
+# Where distributions and Homebrew install the module; SOFTHSM2_MODULE wins
+MODULE_CANDIDATES = (
+    "/usr/lib/softhsm/libsofthsm2.so",
+    "/usr/lib/*/softhsm/libsofthsm2.so",
+    "/usr/lib64/pkcs11/libsofthsm2.so",
+    "/usr/local/lib/softhsm/libsofthsm2.so",
+    "/opt/homebrew/lib/softhsm/libsofthsm2.so",
+    r"C:\SoftHSM2\lib\softhsm2-x64.dll",
+)
+
+TOKEN_LABEL = "agent-bench"
+KEY_ID = b"\x01"
+
+
+def find_module(path=None):
+    """Path of the SoftHSMv2 PKCS#11 module, or an exception saying how to get one"""
+    candidates = [path or os.environ.get("SOFTHSM2_MODULE")]
+    for pattern in MODULE_CANDIDATES:
+        candidates.extend(glob.glob(pattern))
+    for candidate in candidates:
+        if candidate and os.path.isfile(candidate):
+            return candidate
+    raise Exception(
+        "SoftHSMv2 module not found. Install softhsm2 or pass --module "
+        "(or set SOFTHSM2_MODULE) with the path to libsofthsm2.so"
+    )
+
+
+def make_certificate(common_name="Benchmark Signer", key_size=2048):
+    """RSA key and self-signed certificate like a class 3 signing certificate"""
+    key = rsa.generate_private_key(public_exponent=65537, key_size=key_size)
+    name = x509.Name(
+        [
+            x509.NameAttribute(NameOID.COMMON_NAME, common_name),
+            x509.NameAttribute(NameOID.ORGANIZATION_NAME, "Signing Benchmark"),
+            x509.NameAttribute(NameOID.COUNTRY_NAME, "IN"),
+        ]
+    )
+    now = datetime.datetime.now(datetime.timezone.utc)
+    certificate = (
+        x509.CertificateBuilder()
+        .subject_name(name)
+        .issuer_name(name)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now - datetime.timedelta(days=1))
+        .not_valid_after(now + datetime.timedelta(days=365))
+        .add_extension(
+            x509.KeyUsage(
+                digital_signature=True,
+                content_commitment=True,
+                key_encipherment=False,
+                data_encipherment=False,
+                key_agreement=False,
+                key_cert_sign=False,
+                crl_sign=False,
+                encipher_only=False,
+                decipher_only=False,
+            ),
+            critical=True,
+        )
+        .sign(key, hashes.SHA256())
+    )
+    return key, certificate
+
+
+class SoftHSMToken:
+    """
+    Initialises a SoftHSMv2 token in a temporary directory and imports a
+    generated key and certificate. Use as a context manager; the token
+    directory is removed on exit unless ``keep`` is set.
+
+    SOFTHSM2_CONF is set for this process (and the processes it starts)
+    because the module reads it when it is loaded; AGENT_PKCS11_PATH points
+    the agent at the module.
+    """
+
+    def __init__(self, module=None, pin="12345678", so_pin="87654321", keep=False):
+        self.module = find_module(module)
+        self.pin = pin
+        self.so_pin = so_pin
+        self.keep = keep
+        self.directory = None
+        self.serial = None
+        self.certificate = None
+
+    def __enter__(self):
+        self.directory = tempfile.mkdtemp(prefix="agent-softhsm-")
+        tokens = os.path.join(self.directory, "tokens")
+        os.makedirs(tokens)
+        conf = os.path.join(self.directory, "softhsm2.conf")
+        with open(conf, "w") as f:
+            f.write(f"directories.tokendir = {tokens}\n")
+            f.write("objectstore.backend = file\n")
+            f.write("log.level = ERROR\n")
+        os.environ["SOFTHSM2_CONF"] = conf
+        # Read by agent.config when the agent is imported after this
+        os.environ["AGENT_PKCS11_PATH"] = self.module
+
+        util = shutil.which("softhsm2-util")
+        if util is None:
+            raise Exception("softhsm2-util not found on PATH")
+        subprocess.run(
+            [
+                util,
+                "--init-token",
+                "--free",
+                "--label",
+                TOKEN_LABEL,
+                "--pin",
+                self.pin,
+                "--so-pin",
+                self.so_pin,
+            ],
+            check=True,
+            stdout=subprocess.DEVNULL,
+        )
+        self._import_credentials()
+        return self
+
+    def __exit__(self, *exc):
+        if self.directory and not self.keep:
+            shutil.rmtree(self.directory, ignore_errors=True)
+
+    def _import_credentials(self):
+        import pkcs11
+        from agent.pkcs11_utils import token_serial
+        from pkcs11.constants import Attribute
+        from pkcs11.util.rsa import decode_rsa_private_key
+        from pkcs11.util.x509 import decode_x509_certificate
+
+        key, self.certificate = make_certificate()
+        key_der = key.private_bytes(
+            serialization.Encoding.DER,
+            serialization.PrivateFormat.TraditionalOpenSSL,
+            serialization.NoEncryption(),
+        )
+        cert_der = self.certificate.public_bytes(serialization.Encoding.DER)
+
+        # The agent loads the same module later in this process; python-pkcs11
+        # hands back the already-loaded library
+        token = pkcs11.lib(self.module).get_token(token_label=TOKEN_LABEL)
+        self.serial = token_serial(token)
+
+        with token.open(user_pin=self.pin, rw=True) as session:
+            key_attributes = decode_rsa_private_key(key_der)
+            key_attributes.update(
+                {
+                    Attribute.TOKEN: True,
+                    Attribute.PRIVATE: True,
+                    Attribute.SENSITIVE: True,
+                    Attribute.SIGN: True,
+                    Attribute.ID: KEY_ID,
+                    Attribute.LABEL: "Benchmark Signer",
+                }
+            )
+            session.create_object(key_attributes)
+
+            cert_attributes = decode_x509_certificate(cert_der)
+            cert_attributes.update(
+                {
+                    Attribute.TOKEN: True,
+                    Attribute.ID: KEY_ID,
+                    Attribute.LABEL: "Benchmark Signer",
+                }
+            )
+            session.create_object(cert_attributes)
@@ -0,0 +1,72 @@
+# benchmarks/synthetic_pdfs.py
+"""
+Synthetic documents for the signing benchmarks: text pages, embedded
+images and a mix, generated with reportlab so no customer PDFs are needed.
+"""
+import io
+import os
+import random
+
+from PIL import Image
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.utils import ImageReader
+from reportlab.pdfgen import canvas
+
+# name: (pages, images per page, image edge in pixels)
+PROFILES = {
+    "1-page": (1, 0, 0),
+    "10-pages": (10, 0, 0),
+    "100-pages": (100, 0, 0),
+    "5-pages-images": (5, 2, 400),
+    "20-pages-scans": (20, 1, 600),
+}
+DEFAULT_PROFILES = ("1-page", "10-pages", "100-pages", "5-pages-images")
+
+LINES_PER_PAGE = 45
+LETTERS = "abcdefghijklmnopqrstuvwxyz"
+
+
+def noise_image(edge, rng):
+    """RGB image that does not compress, like a scanned page"""
+    return Image.frombytes("RGB", (edge, edge), rng.randbytes(edge * edge * 3))
+
+
+def make_pdf(pages, images_per_page=0, image_edge=0, seed=0):
+    """PDF bytes with ``pages`` pages of text and optional embedded images"""
+    rng = random.Random(seed)
+    output = io.BytesIO()
+    pdf = canvas.Canvas(output, pagesize=A4)
+    width, height = A4
+
+    for page in range(pages):
+        pdf.setFont("Helvetica", 10)
+        y = height - 50
+        for line in range(LINES_PER_PAGE):
+            words = " ".join(
+                "".join(rng.choices(LETTERS, k=rng.randint(2, 9))) for _ in range(12)
+            )
+            pdf.drawString(40, y, f"{page + 1}.{line + 1} {words}")
+            y -= 15
+
+        for index in range(images_per_page):
+            image = ImageReader(noise_image(image_edge, rng))
+            size = (width - 80) / max(images_per_page, 1)
+            pdf.drawImage(image, 40 + index * size, 60, width=size, height=size)
+        pdf.showPage()
+
+    pdf.save()
+    return output.getvalue()
+
+
+def write_profiles(directory, names=DEFAULT_PROFILES):
+    """Generate each profile into ``directory``; returns [(name, path)]"""
+    os.makedirs(directory, exist_ok=True)
+    documents = []
+    for name in names:
+        if name not in PROFILES:
+            raise ValueError(f"Unknown document profile: {name}")
+        path = os.path.join(directory, f"{name}.pdf")
+        with open(path, "wb") as f:
+            f.write(make_pdf(*PROFILES[name]))
+        documents.append((name, path))
+    return documents
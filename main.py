@@ -2,6 +2,7 @@
 import sys
 import os
 import traceback
+import multiprocessing
 import sys
 import traceback
 import linecache
@@ -77,4 +78,6 @@ def main():
 
 
 if __name__ == "__main__":
+    # Required for the overlay preparation processes in the frozen .exe
+    multiprocessing.freeze_support()
     main()